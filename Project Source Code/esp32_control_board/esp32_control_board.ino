@@ -103,6 +103,11 @@
  const unsigned long serverUrlRefreshInterval = 30000;  // Refresh server URL every 30 seconds
  const int maxConsecutiveFailures = 3;  // Reset URL after 3 consecutive failures
  
+ // Command long-poll: the server holds the poll until commands change (or this many seconds pass)
+ // Kept short so the loop still uploads sensor data on time
+ const int commandLongPollWait = 2;
+ String commandVersion;  // Version of the last command set received (sent back as If-None-Match)
+ 
  // ESP-NOW callback function
 void OnDataRecv(const esp_now_recv_info_t *info, const uint8_t *data, int len) {
     // Debug: Print sender MAC address
@@ -479,17 +484,24 @@ void OnDataRecv(const esp_now_recv_info_t *info, const uint8_t *data, int len) {
      }
      
      HTTPClient http;
-     String url = serverUrl + "/api/control/commands";
+     String url = serverUrl + "/api/control/commands?wait=" + String(commandLongPollWait);
      
      http.begin(url);
-     http.setTimeout(3000);  // 3 second timeout
+     http.setTimeout(3000 + commandLongPollWait * 1000);  // 3 second timeout on top of the long-poll wait
+     if (commandVersion.length() > 0) {
+         http.addHeader("If-None-Match", "\"" + commandVersion + "\"");
+     }
      int httpCode = http.GET();
      
      if (httpCode > 0) {
-         if (httpCode == HTTP_CODE_OK) {
+         if (httpCode == HTTP_CODE_NOT_MODIFIED) {
+             // Commands unchanged
+             http.end();
+             return true;
+         } else if (httpCode == HTTP_CODE_OK) {
              String payload = http.getString();
              
-             StaticJsonDocument<256> doc;
+             StaticJsonDocument<384> doc;
              DeserializationError error = deserializeJson(doc, payload);
              
              if (!error) {
@@ -523,6 +535,10 @@ void OnDataRecv(const esp_now_recv_info_t *info, const uint8_t *data, int len) {
                  brightnessLevel = doc["brightness_level"] | 100;
                  homeMode = doc["home_mode"] | true;
                  
+                 if (doc.containsKey("version")) {
+                     commandVersion = doc["version"].as<String>();
+                 }
+                 
                  http.end();
                  return true;  // Success
              } else {
@@ -0,0 +1,107 @@
+"""Decrypts per second for the sensor payload decryption paths.
+
+Run from the python_server directory:
+    python benchmarks/decrypt_benchmark.py [--payloads 2000] [--batch 100] [--json]
+
+Importing server does not connect to the database, so no PostgreSQL is needed.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+import server
+
+
+def sample_reading(i):
+    return {
+        'pir_motion': i % 2 == 0,
+        'flame_detected': False,
+        'door_open': i % 3 == 0,
+        'air_quality': 400 + i % 100,
+        'sound_level': 50 + i % 30,
+        'light_level': 1500 + i % 1000,
+        'temperature': 22.5,
+        'humidity': 41.0,
+        'timestamp': 1700000000 + i
+    }
+
+
+def encrypt_cbc(plaintext):
+    iv = os.urandom(16)
+    cipher = AES.new(server.ENCRYPTION_KEY, AES.MODE_CBC, iv)
+    return base64.b64encode(iv + cipher.encrypt(pad(plaintext, server.BLOCK_SIZE))).decode()
+
+
+def encrypt_gcm(plaintext):
+    nonce = os.urandom(server.SensorDecryptor.GCM_NONCE_SIZE)
+    ciphertext, tag = AES.new(server.ENCRYPTION_KEY, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(plaintext)
+    return base64.b64encode(nonce + ciphertext + tag).decode()
+
+
+def legacy_decrypt(encrypted_data):
+    """The per-call path decrypt_data() used before SensorDecryptor (without its debug prints)"""
+    from urllib.parse import unquote
+    encrypted_data = unquote(encrypted_data)
+    encrypted_data = encrypted_data.strip().replace('\n', '').replace('\r', '').replace(' ', '+')
+    if len(encrypted_data) % 4 != 0:
+        encrypted_data += '=' * (4 - len(encrypted_data) % 4)
+    combined = base64.b64decode(encrypted_data)
+    cipher = AES.new(server.ENCRYPTION_KEY, AES.MODE_CBC, combined[:16])
+    return unpad(cipher.decrypt(combined[16:]), server.BLOCK_SIZE).decode('utf-8')
+
+
+def measure(func, count, min_seconds):
+    """Calls of func per second; func handles count payloads per call"""
+    calls, start = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return calls * count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--payloads', type=int, default=2000, help='distinct payloads per run')
+    parser.add_argument('--batch', type=int, default=100, help='payloads per decrypt_many() call')
+    parser.add_argument('--seconds', type=float, default=1.0, help='minimum time per measurement')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    plaintexts = [json.dumps(sample_reading(i)).encode() for i in range(args.payloads)]
+    cbc_payloads = [encrypt_cbc(p) for p in plaintexts]
+    gcm_payloads = [encrypt_gcm(p) for p in plaintexts]
+    records = [server.encode_sensor_records([sample_reading(i)], cipher='cbc') for i in range(args.payloads)]
+    decryptor = server.SensorDecryptor(server.ENCRYPTION_KEY)
+    batches = [cbc_payloads[i:i + args.batch] for i in range(0, len(cbc_payloads), args.batch)]
+
+    results = {
+        'legacy_cbc': measure(lambda: [legacy_decrypt(p) for p in cbc_payloads], len(cbc_payloads), args.seconds),
+        'cbc': measure(lambda: [decryptor.decrypt(p) for p in cbc_payloads], len(cbc_payloads), args.seconds),
+        'cbc_batch': measure(lambda: [decryptor.decrypt_many(b) for b in batches], len(cbc_payloads), args.seconds),
+        'gcm': measure(lambda: [decryptor.decrypt(p, 'gcm') for p in gcm_payloads], len(gcm_payloads), args.seconds),
+        'binary_cbc_record': measure(lambda: [server.decode_sensor_records(r, 'cbc') for r in records],
+                                     len(records), args.seconds)
+    }
+
+    if args.json:
+        print(json.dumps({'decrypts_per_second': {name: round(rate) for name, rate in results.items()},
+                          'payloads': args.payloads, 'batch': args.batch}, indent=2))
+        return
+    baseline = results['legacy_cbc']
+    print(f"{'path':<20} {'decrypts/s':>12} {'vs legacy':>10}")
+    for name, rate in results.items():
+        print(f"{name:<20} {rate:>12,.0f} {rate / baseline:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""End-to-end load and latency benchmark with simulated boards and dashboard tabs.
+
+Start the server against a local PostgreSQL first (python server.py), then from the python_server directory:
+    python benchmarks/load_benchmark.py --sensor-boards 10 --control-boards 2 --dashboards 5 --duration 60 --json
+
+Each simulated client follows the real one's request pattern:
+  sensor board    POST /api/sensor-data every --upload-interval ms (form-urlencoded, or AES-CBC JSON
+                  like the control board forwards when encryption is on) and GET /api/sensor-board/commands every 3 s
+  control board   GET /api/control/commands?wait=2 with If-None-Match, POST /api/control/status every 5 s
+  dashboard tab   the dashboard.js polling fallback: GET /api/dashboard/snapshot with If-None-Match every 2 s,
+                  GET /api/events?per_page=10 every 5 s
+
+Reports throughput and p50/p95/p99 latency per route, and database round trips per request
+(from /api/db/pool-stats, so the server should not serve other traffic while this runs).
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+import server
+
+SENSOR_COMMAND_POLL_INTERVAL = 3.0  # esp32_sensor_board pollInterval
+CONTROL_LONGPOLL_WAIT = 2  # esp32_control_board commandLongPollWait
+CONTROL_STATUS_INTERVAL = 5.0  # esp32_control_board statusUpdateInterval
+DASHBOARD_SNAPSHOT_INTERVAL = 2.0
+DASHBOARD_EVENTS_INTERVAL = 5.0
+
+
+class Recorder:
+    """Latencies and status codes per route; only requests that start inside the measured window count"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.window_start = None
+        self.window_end = None
+
+    def measuring(self, started):
+        return self.window_start is not None and self.window_start <= started and \
+            (self.window_end is None or started < self.window_end)
+
+    def add(self, route, started, elapsed, status):
+        if not self.measuring(started):
+            return
+        with self._lock:
+            entry = self._routes.setdefault(route, {'latencies': [], 'status': {}})
+            entry['latencies'].append(elapsed)
+            entry['status'][status] = entry['status'].get(status, 0) + 1
+
+    def summary(self, duration):
+        with self._lock:
+            routes = {route: (sorted(entry['latencies']), dict(entry['status'])) for route, entry in self._routes.items()}
+        result = {}
+        for route, (latencies, status) in sorted(routes.items()):
+            errors = sum(count for code, count in status.items() if code == 'error' or int(code) >= 500)
+            result[route] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'throughput_rps': round(len(latencies) / duration, 2),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'max_ms': round(latencies[-1], 2) if latencies else None,
+                'status': {str(code): count for code, count in sorted(status.items(), key=lambda item: str(item[0]))}
+            }
+        return result
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list, in ms"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return round(sorted_values[rank - 1], 2)
+
+
+class Client(threading.Thread):
+    """One simulated device or browser tab with its own keep-alive session"""
+
+    def __init__(self, base_url, recorder, stop, timeout):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.recorder = recorder
+        self.stop = stop
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, route=None, **kwargs):
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        self.recorder.add(route or urlsplit(path).path, started, (time.monotonic() - started) * 1000.0, status)
+        return response
+
+    def wait_until(self, deadline):
+        """Sleep until deadline (monotonic); False once the run is over"""
+        return not self.stop.wait(max(0.0, deadline - time.monotonic()))
+
+
+class SensorBoard(Client):
+
+    def __init__(self, base_url, recorder, stop, timeout, index, interval, encrypted):
+        super().__init__(base_url, recorder, stop, timeout)
+        self.index = index
+        self.interval = interval
+        self.encrypted = encrypted
+        self.random = random.Random(index)
+
+    def reading(self):
+        rnd = self.random
+        return {
+            'pir_motion': rnd.random() < 0.1,
+            'flame_detected': rnd.random() < 0.01,
+            'door_open': rnd.random() < 0.9,  # reed switch active = door closed
+            'air_quality': rnd.randint(300, 900) if rnd.random() > 0.01 else rnd.randint(2000, 3000),
+            'sound_level': rnd.randint(20, 120) if rnd.random() > 0.05 else rnd.randint(200, 600),
+            'light_level': rnd.randint(500, 3500),
+            'temperature': round(rnd.uniform(18, 28), 1),
+            'humidity': round(rnd.uniform(30, 60), 1),
+            'timestamp': int(time.time())
+        }
+
+    def upload(self):
+        reading = self.reading()
+        if self.encrypted:
+            iv = os.urandom(server.BLOCK_SIZE)
+            ciphertext = AES.new(server.ENCRYPTION_KEY, AES.MODE_CBC, iv).encrypt(
+                pad(json.dumps(reading).encode(), server.BLOCK_SIZE))
+            self.request('POST', '/api/sensor-data', json={
+                'encrypted_data': base64.b64encode(iv + ciphertext).decode(),
+                'is_encrypted': True
+            })
+        else:
+            form = {key: str(value).lower() if isinstance(value, bool) else str(value) for key, value in reading.items()}
+            form['is_encrypted'] = 'false'
+            self.request('POST', '/api/sensor-data', data=form)
+
+    def run(self):
+        start = time.monotonic() + self.random.uniform(0, self.interval)
+        next_upload, next_poll = start, start
+        while True:
+            if not self.wait_until(min(next_upload, next_poll)):
+                return
+            now = time.monotonic()
+            if now >= next_poll:
+                self.request('GET', '/api/sensor-board/commands')
+                next_poll += SENSOR_COMMAND_POLL_INTERVAL
+            if now >= next_upload:
+                self.upload()
+                next_upload += self.interval
+                if next_upload < time.monotonic():
+                    next_upload = time.monotonic()  # fell behind: don't burst to catch up
+
+
+class ControlBoard(Client):
+
+    def __init__(self, base_url, recorder, stop, timeout, index):
+        super().__init__(base_url, recorder, stop, timeout + CONTROL_LONGPOLL_WAIT)
+        self.index = index
+        self.version = None
+
+    def run(self):
+        if not self.wait_until(time.monotonic() + random.uniform(0, 1)):
+            return
+        next_status = time.monotonic()
+        while not self.stop.is_set():
+            headers = {'If-None-Match': f'"{self.version}"'} if self.version else {}
+            response = self.request('GET', f'/api/control/commands?wait={CONTROL_LONGPOLL_WAIT}', headers=headers)
+            if response is None:
+                self.stop.wait(1)
+                continue
+            if response.status_code == 200:
+                self.version = response.headers.get('ETag', '').strip('"') or None
+            if time.monotonic() >= next_status:
+                self.request('POST', '/api/control/status', json={'light_on': False, 'buzzer_on': False})
+                next_status += CONTROL_STATUS_INTERVAL
+
+
+class DashboardTab(Client):
+
+    def __init__(self, base_url, recorder, stop, timeout, username, password):
+        super().__init__(base_url, recorder, stop, timeout)
+        self.username = username
+        self.password = password
+        self.etag = None
+
+    def run(self):
+        self.session.post(self.base_url + '/login', data={'username': self.username, 'password': self.password},
+                          timeout=self.timeout)
+        start = time.monotonic() + random.uniform(0, DASHBOARD_SNAPSHOT_INTERVAL)
+        next_snapshot, next_events = start, start
+        while True:
+            if not self.wait_until(min(next_snapshot, next_events)):
+                return
+            now = time.monotonic()
+            if now >= next_snapshot:
+                headers = {'If-None-Match': self.etag} if self.etag else {}
+                response = self.request('GET', '/api/dashboard/snapshot', headers=headers)
+                if response is not None and response.status_code == 200:
+                    self.etag = response.headers.get('ETag')
+                next_snapshot += DASHBOARD_SNAPSHOT_INTERVAL
+            if now >= next_events:
+                self.request('GET', '/api/events?per_page=10')
+                next_events += DASHBOARD_EVENTS_INTERVAL
+
+
+def pool_stats(session, base_url):
+    response = session.get(base_url + '/api/db/pool-stats', timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8888', help='server base URL')
+    parser.add_argument('--sensor-boards', type=int, default=5)
+    parser.add_argument('--control-boards', type=int, default=1)
+    parser.add_argument('--dashboards', type=int, default=2)
+    parser.add_argument('--upload-interval', type=int, default=2000, help='ms between sensor uploads (firmware default 2000)')
+    parser.add_argument('--encrypted', type=float, default=0.5, help='fraction of sensor boards sending encrypted data')
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=10.0, help='per-request timeout in seconds')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    admin = requests.Session()
+    response = admin.post(base_url + '/login', data={'username': args.username, 'password': args.password}, timeout=10)
+    response.raise_for_status()
+
+    recorder = Recorder()
+    stop = threading.Event()
+    encrypted_boards = int(round(args.sensor_boards * args.encrypted))
+    clients = [SensorBoard(base_url, recorder, stop, args.timeout, i, args.upload_interval / 1000.0, i < encrypted_boards)
+               for i in range(args.sensor_boards)]
+    clients += [ControlBoard(base_url, recorder, stop, args.timeout, i) for i in range(args.control_boards)]
+    clients += [DashboardTab(base_url, recorder, stop, args.timeout, args.username, args.password)
+                for _ in range(args.dashboards)]
+    for client in clients:
+        client.start()
+
+    time.sleep(args.warmup)
+    before = pool_stats(admin, base_url)
+    recorder.window_start = time.monotonic()
+    time.sleep(args.duration)
+    recorder.window_end = time.monotonic()
+    after = pool_stats(admin, base_url)
+    stop.set()
+    for client in clients:
+        client.join(timeout=args.timeout + CONTROL_LONGPOLL_WAIT)
+
+    duration = recorder.window_end - recorder.window_start
+    routes = recorder.summary(duration)
+    total = sum(route['requests'] for route in routes.values())
+    db = {key: after.get(key, 0) - before.get(key, 0) for key in ('round_trips', 'statements', 'commits', 'checkouts')}
+    # The pool-stats request in between is not part of the load; it makes no statements
+    db['round_trips_per_request'] = round(db['round_trips'] / total, 2) if total else None
+    db['checkouts_per_request'] = round(db['checkouts'] / total, 2) if total else None
+    db['max_in_use'] = after.get('max_in_use')
+    db['waits'] = after.get('waits', 0) - before.get('waits', 0)
+    results = {
+        'config': {
+            'url': base_url,
+            'sensor_boards': args.sensor_boards,
+            'encrypted_sensor_boards': encrypted_boards,
+            'control_boards': args.control_boards,
+            'dashboards': args.dashboards,
+            'upload_interval_ms': args.upload_interval,
+            'duration_s': round(duration, 2),
+            'warmup_s': args.warmup
+        },
+        'requests': total,
+        'errors': sum(route['errors'] for route in routes.values()),
+        'throughput_rps': round(total / duration, 2),
+        'routes': routes,
+        'db': db
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['requests']} requests in {duration:.1f}s ({results['throughput_rps']} req/s, "
+          f"{results['errors']} errors), {db['round_trips_per_request']} DB round trips/request")
+    print(f"{'route':<32} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>5}")
+    for route, stats in routes.items():
+        print(f"{route:<32} {stats['requests']:>7} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,22 +7,421 @@ import requests
 import math
 from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, g
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import threading
+import weakref
+import heapq
+import bisect
+import atexit
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import errors as psycopg2_errors
 import smtplib
 import ssl
 from email.mime.text import MIMEText
 import sys
+import queue
+from collections import deque
+import io
+import csv
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import re
+import random
+import struct
+import binascii
+from urllib.parse import unquote
 
 # Setting up the Flask application
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-production')
 
+# Logging (DEBUG output such as per-reading dumps and timer decisions is off by default)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # records waiting for the writer thread; more are dropped
+LOG_RATE_LIMIT = float(os.getenv('LOG_RATE_LIMIT', '5'))  # records/s per log statement, 0 = unlimited
+LOG_RATE_BURST = int(os.getenv('LOG_RATE_BURST', '20'))
+
+class LogThrottleFilter(logging.Filter):
+    """Per-call-site sampling and rate limiting.
+    log.info(..., extra={'sample': N}) keeps every Nth record of that statement. Each statement also
+    has a token bucket of rate records/s (burst deep); records beyond it are dropped and the count
+    is appended to the next record from the same statement that gets through."""
+
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._sites = {}  # (pathname, lineno) -> [tokens, last refill, records seen, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        sample = getattr(record, 'sample', 1)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [float(self.burst), now, 0, 0]
+            site[2] += 1
+            if sample > 1 and (site[2] - 1) % sample:
+                return False
+            if self.rate > 0:
+                site[0] = min(float(self.burst), site[0] + (now - site[1]) * self.rate)
+                site[1] = now
+                if site[0] < 1:
+                    site[3] += 1
+                    self.suppressed += 1
+                    return False
+                site[0] -= 1
+            suppressed, site[3] = site[3], 0
+        if suppressed:
+            record.msg = f'{record.msg} (+{suppressed} similar suppressed)'
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to a writer thread (started on first use) without ever blocking the caller.
+    Formatting happens on the writer thread; records that find the queue full are dropped and counted."""
+
+    def __init__(self, log_queue, *handlers):
+        super().__init__(log_queue)
+        self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if not self._started:
+            with self._start_lock:
+                if not self._started:
+                    self.listener.start()
+                    self._started = True
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self):
+        """Write out queued records and stop the writer thread"""
+        with self._start_lock:
+            if self._started:
+                self.listener.stop()
+                self._started = False
+
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(message)s'))
+log_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), _log_stream)
+log_throttle = LogThrottleFilter(LOG_RATE_LIMIT, LOG_RATE_BURST)
+log = logging.getLogger('smart_home')
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+log.addHandler(log_handler)
+log.addFilter(log_throttle)
+
+# Metrics (GET /metrics, Prometheus text format)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # if set, /metrics requires "Authorization: Bearer <token>"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+class _MetricsShard:
+    """Per-thread holder of a shard; its finalizer retires the shard once the thread is gone"""
+    __slots__ = ('tables', '__weakref__')
+
+    def __init__(self):
+        self.tables = ({}, {})  # counters, histograms
+
+class MetricsRegistry:
+    """Counters and histograms kept per thread, so recording never takes a lock: each thread only
+    writes its own shard and render() sums the shards. Values that already live elsewhere
+    (pool stats, queue depths) come from collectors that run at render time."""
+
+    def __init__(self):
+        self._meta = {}  # name -> (type, help, label names, buckets)
+        self._local = threading.local()
+        self._shards = {}  # id -> (counters, histograms) of every live thread that recorded something
+        self._retired = ({}, {})  # totals folded in from shards of threads that have exited
+        self._shards_lock = threading.RLock()
+        self._collectors = []
+        self._label_cache = {}
+
+    def counter(self, name, help_text, labels=()):
+        self._meta[name] = ('counter', help_text, tuple(labels), None)
+
+    def gauge(self, name, help_text, labels=()):
+        self._meta[name] = ('gauge', help_text, tuple(labels), None)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(labels), tuple(buckets))
+
+    def collector(self, func):
+        """Register func() -> iterable of (name, label values, value), called by render()"""
+        self._collectors.append(func)
+        return func
+
+    def _shard(self):
+        holder = getattr(self._local, 'shard', None)
+        if holder is None:
+            holder = self._local.shard = _MetricsShard()
+            with self._shards_lock:
+                self._shards[id(holder)] = holder.tables
+            weakref.finalize(holder, self._retire, id(holder))  # thread-local is dropped when the thread exits
+        return holder.tables
+
+    @staticmethod
+    def _add(values, histograms, counters, shard_histograms):
+        for key, value in counters:
+            values[key] = values.get(key, 0) + value
+        for key, entry in shard_histograms:
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(entry)
+            else:
+                for i, count in enumerate(entry):
+                    total[i] += count
+
+    def _retire(self, shard_id):
+        """Fold an exited thread's shard into the retired totals, so the dev server's thread per
+        request does not leave one shard per request behind"""
+        with self._shards_lock:
+            counters, histograms = self._shards.pop(shard_id)
+            self._add(*self._retired, counters.items(), histograms.items())
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        buckets = self._meta[name][3]
+        if entry is None:
+            entry = histograms[key] = [0] * (len(buckets) + 1) + [0.0]  # per-bucket counts, +Inf, sum
+        entry[bisect.bisect_left(buckets, value)] += 1
+        entry[-1] += value
+
+    @staticmethod
+    def _items(table):
+        while True:
+            try:
+                return list(table.items())
+            except RuntimeError:
+                continue  # resized by its owning thread while copying
+
+    def _labels(self, names, values, extra=''):
+        key = (names, values, extra)
+        text = self._label_cache.get(key)
+        if text is None:
+            pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for name, value in zip(names, values)]
+            if extra:
+                pairs.append(extra)
+            text = self._label_cache[key] = '{' + ','.join(pairs) + '}' if pairs else ''
+        return text
+
+    def _merged(self):
+        """Counters and histograms summed over all thread shards"""
+        values, histograms = {}, {}
+        with self._shards_lock:
+            self._add(values, histograms, *(table.items() for table in self._retired))
+            shards = list(self._shards.values())
+        for counters, shard_histograms in shards:
+            self._add(values, histograms, self._items(counters), self._items(shard_histograms))
+        return values, histograms
+
+    def histogram_totals(self, name):
+        """(buckets, {label values: per-bucket counts + [+Inf count, sum]}) of one histogram"""
+        histograms = self._merged()[1]
+        return self._meta[name][3], {labels: entry for (key, labels), entry in histograms.items() if key == name}
+
+    def render(self):
+        values, histograms = self._merged()
+        for func in self._collectors:
+            try:
+                for name, labels, value in func():
+                    values[(name, labels)] = value
+            except Exception as e:
+                log.warning("⚠️ Metrics collector %s failed: %s", getattr(func, '__name__', func), e)
+        
+        series = {}
+        for (name, labels), value in values.items():
+            series.setdefault(name, []).append((labels, value))
+        for (name, labels), entry in histograms.items():
+            series.setdefault(name, []).append((labels, entry))
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in series.get(name, ()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(label_names, labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, self._labels(label_names, labels, 'le="%s"' % bound), cumulative))
+                cumulative += value[len(buckets)]
+                lines.append('%s_bucket%s %d' % (name, self._labels(label_names, labels, 'le="+Inf"'), cumulative))
+                lines.append(f'{name}_sum{self._labels(label_names, labels)} {value[-1]}')
+                lines.append(f'{name}_count{self._labels(label_names, labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.counter('smart_home_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+metrics.histogram('smart_home_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route'))
+metrics.counter('smart_home_ingest_readings_total', 'Sensor readings committed', ('path',))
+metrics.counter('smart_home_sensor_alerts_total', 'Sensor events written to the event log', ('sensor', 'code', 'severity'))
+metrics.counter('smart_home_notifications_total', 'Dashboard notifications created', ('type',))
+metrics.counter('smart_home_decrypt_total', 'Encrypted payloads by outcome', ('result',))
+metrics.histogram('smart_home_email_send_seconds', 'Time to hand one e-mail to the SMTP server', ('result',))
+
+# Stage timing spans (GET /api/ingest/stages)
+# Every span feeds a per-stage histogram. A TRACE_SAMPLE_RATE fraction of requests (0 = none) is also
+# written as one JSON line with all its spans to TRACE_FILE, rotated at TRACE_FILE_MAX_BYTES.
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '3'))
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)  # seconds
+
+class StageSpan:
+    """Context manager timing one stage; created by StageTracer.span()"""
+    __slots__ = ('tracer', 'stage', 'started', 'outer_nested')
+
+    def __init__(self, tracer, stage):
+        self.tracer = tracer
+        self.stage = stage
+
+    def __enter__(self):
+        self.outer_nested = self.tracer.enter()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer.finish(self.stage, self.started, exc_type is not None, self.outer_nested)
+        return False
+
+class StageTracer:
+    """Timing spans around the stages of request handling (parse, decrypt, insert, alerts, ...).
+    A finished span costs two perf_counter() calls and one lock-free histogram update. Only for
+    requests picked by sample_rate are the spans also collected on the thread and written to the
+    trace log when the request ends; with sampling off nothing else happens. Spans on background
+    threads (deferred side effects, e-mail) only feed the histograms.
+    Spans may nest (parse calls decrypt): the histograms get each stage's own time, excluding the
+    spans nested in it, so stage totals add up instead of counting nested work twice."""
+
+    def __init__(self, sample_rate=0.0, trace_log=None):
+        self.sample_rate = sample_rate
+        self.trace_log = trace_log
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.traces_written = 0
+
+    def span(self, stage):
+        return StageSpan(self, stage)
+
+    def timed(self, stage):
+        """Decorator running the whole function as one stage"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with StageSpan(self, stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def enter(self):
+        """Start a span on this thread; returns the enclosing span's nested time so far"""
+        outer_nested = getattr(self._local, 'nested', 0.0)
+        self._local.nested = 0.0
+        return outer_nested
+
+    def finish(self, stage, started, failed=False, outer_nested=0.0):
+        elapsed = time.perf_counter() - started
+        own = elapsed - getattr(self._local, 'nested', 0.0)
+        self._local.nested = outer_nested + elapsed
+        metrics.observe('smart_home_stage_duration_seconds', own, (stage,))
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            span = {'stage': stage, 'offset_ms': round((started - trace['started']) * 1000.0, 3),
+                    'ms': round(elapsed * 1000.0, 3)}
+            if own < elapsed:
+                span['self_ms'] = round(own * 1000.0, 3)
+            if failed:
+                span['error'] = True
+            trace['spans'].append(span)
+
+    def begin(self, name):
+        """Start collecting spans for the current thread's request if it is sampled"""
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            self._local.trace = {'name': name, 'at': datetime.now(timezone.utc).isoformat(),
+                                 'started': time.perf_counter(), 'spans': []}
+        else:
+            self._local.trace = None
+
+    def end(self, status):
+        """Write the current thread's trace (if sampled and it recorded any spans)"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        self._local.trace = None
+        if not trace['spans'] or self.trace_log is None:
+            return
+        trace['ms'] = round((time.perf_counter() - trace.pop('started')) * 1000.0, 3)
+        trace['status'] = status
+        trace['spans'].sort(key=lambda span: span['offset_ms'])
+        self.trace_log.info('%s', json.dumps(trace))
+        with self._lock:
+            self.traces_written += 1
+
+    @staticmethod
+    def _quantile(buckets, counts, total, q):
+        """Quantile estimate from histogram buckets (linear within the bucket, as Prometheus does)"""
+        rank = q * total
+        cumulative, lower = 0, 0.0
+        for bound, count in zip(buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return buckets[-1]  # in the +Inf bucket: report the largest finite bound
+
+    def summary(self):
+        """Per-stage count, total, mean and p50/p95/p99 in milliseconds"""
+        buckets, histograms = metrics.histogram_totals('smart_home_stage_duration_seconds')
+        stages = {}
+        for (stage,), entry in sorted(histograms.items()):
+            total = sum(entry[:-1])
+            if not total:
+                continue
+            stages[stage] = {
+                'count': total,
+                'total_ms': round(entry[-1] * 1000.0, 3),
+                'mean_ms': round(entry[-1] * 1000.0 / total, 3),
+                **{f'p{int(q * 100)}_ms': round(self._quantile(buckets, entry, total, q) * 1000.0, 3)
+                   for q in (0.5, 0.95, 0.99)}
+            }
+        return stages
+
+metrics.histogram('smart_home_stage_duration_seconds', 'Time spent per request handling stage', ('stage',),
+                  buckets=STAGE_BUCKETS)
+
+_trace_file = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS,
+                                  encoding='utf-8', delay=True)  # file is only created once a trace is written
+_trace_file.setFormatter(logging.Formatter('%(message)s'))
+trace_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), _trace_file)
+trace_log = logging.getLogger('smart_home.trace')
+trace_log.setLevel(logging.INFO)
+trace_log.propagate = False
+trace_log.addHandler(trace_handler)
+stage_tracer = StageTracer(TRACE_SAMPLE_RATE, trace_log)
+
 # Email notification configuration
 EMAIL_ENABLED = os.getenv('EMAIL_ENABLED', 'false').lower() == 'true'
 EMAIL_SMTP_SERVER = os.getenv('EMAIL_SMTP_SERVER', 'smtp.gmail.com')
@@ -30,12 +429,75 @@ EMAIL_SMTP_PORT = int(os.getenv('EMAIL_SMTP_PORT', '587'))
 EMAIL_SENDER = os.getenv('EMAIL_SENDER', '')
 EMAIL_SENDER_PASSWORD = os.getenv('EMAIL_SENDER_PASSWORD', '')
 EMAIL_RECIPIENTS = [addr.strip() for addr in os.getenv('EMAIL_RECIPIENTS', '').split(',') if addr.strip()]
+EMAIL_SMTP_STARTTLS = os.getenv('EMAIL_SMTP_STARTTLS', 'true').lower() == 'true'  # false for a local SMTP stand-in
+EMAIL_SMTP_TIMEOUT = float(os.getenv('EMAIL_SMTP_TIMEOUT', '10'))  # seconds per SMTP operation
+EMAIL_SMTP_IDLE_TIMEOUT = float(os.getenv('EMAIL_SMTP_IDLE_TIMEOUT', '60'))  # close the reused session after this idle time
+
+# Outbound e-mail queue (notification_outbox table, drained by background workers)
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', '1'))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '20'))  # max queued mails claimed per recipient at once
+EMAIL_DIGEST_WINDOW = float(os.getenv('EMAIL_DIGEST_WINDOW', '0'))  # >0 = hold mails this many seconds and merge them into one
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF', '30'))  # seconds before the first retry, doubled each time
+EMAIL_RETRY_BACKOFF_MAX = float(os.getenv('EMAIL_RETRY_BACKOFF_MAX', '3600'))
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', '15'))  # seconds between checks for retries that became due
+
+# Sensor event batching
+# 0 = write the 7 sensor_events rows with each reading (same transaction as the reading)
+# >0 = coalesce rows from several readings and flush them every N seconds
+SENSOR_EVENT_FLUSH_INTERVAL = float(os.getenv('SENSOR_EVENT_FLUSH_INTERVAL', '0'))
+SENSOR_EVENT_COPY_THRESHOLD = int(os.getenv('SENSOR_EVENT_COPY_THRESHOLD', '500'))  # use COPY for batches at least this big
+SENSOR_EVENT_BUFFER_MAX = int(os.getenv('SENSOR_EVENT_BUFFER_MAX', '10000'))  # drop oldest rows beyond this if the DB is down
+
+# Sensor event logging mode
+# all = one row per sensor with every reading; changes = only rows whose state/action changed
+# or whose reading moved by more than its deadband. Both write a full keyframe (all sensors) periodically.
+SENSOR_EVENT_MODE = os.getenv('SENSOR_EVENT_MODE', 'all').lower()
+SENSOR_EVENT_KEYFRAME_INTERVAL = float(os.getenv('SENSOR_EVENT_KEYFRAME_INTERVAL', '300'))  # seconds
+SENSOR_EVENT_DEADBAND_AIR_QUALITY = float(os.getenv('SENSOR_EVENT_DEADBAND_AIR_QUALITY', '50'))
+SENSOR_EVENT_DEADBAND_SOUND = float(os.getenv('SENSOR_EVENT_DEADBAND_SOUND', '20'))
+SENSOR_EVENT_DEADBAND_LIGHT = float(os.getenv('SENSOR_EVENT_DEADBAND_LIGHT', '100'))
+SENSOR_EVENT_DEADBAND_TEMPERATURE = float(os.getenv('SENSOR_EVENT_DEADBAND_TEMPERATURE', '0.5'))
+SENSOR_EVENT_DEADBAND_HUMIDITY = float(os.getenv('SENSOR_EVENT_DEADBAND_HUMIDITY', '2'))
+
+# Time partitioning of sensor_data / sensor_events (off | daily | weekly)
+# Enabling it converts existing tables once, creating a partition for every period that holds kept rows
+SENSOR_PARTITIONING = os.getenv('SENSOR_PARTITIONING', 'off').lower()
+SENSOR_PARTITION_PREMAKE = int(os.getenv('SENSOR_PARTITION_PREMAKE', '3'))  # future partitions created ahead of time
+SENSOR_PARTITION_MAINTENANCE_INTERVAL = float(os.getenv('SENSOR_PARTITION_MAINTENANCE_INTERVAL', '3600'))  # seconds
+SENSOR_DATA_RETENTION_DAYS = int(os.getenv('SENSOR_DATA_RETENTION_DAYS', '0'))  # 0 = keep forever
+SENSOR_EVENTS_RETENTION_DAYS = int(os.getenv('SENSOR_EVENTS_RETENTION_DAYS', '0'))  # 0 = keep forever
+
+# Batch ingest (/api/sensor-data/batch)
+SENSOR_BATCH_MAX_READINGS = int(os.getenv('SENSOR_BATCH_MAX_READINGS', '5000'))
+
+# Write-behind ingest side effects
+# When enabled, /api/sensor-data commits the reading and the buzzer/light decisions, acks,
+# and leaves sensor_events, event_log and notification writes to a background worker pool
+INGEST_ASYNC_SIDE_EFFECTS = os.getenv('INGEST_ASYNC_SIDE_EFFECTS', 'false').lower() == 'true'
+SIDE_EFFECT_WORKERS = int(os.getenv('SIDE_EFFECT_WORKERS', '2'))
+SIDE_EFFECT_QUEUE_MAX = int(os.getenv('SIDE_EFFECT_QUEUE_MAX', '1000'))
+SIDE_EFFECT_SUBMIT_TIMEOUT = float(os.getenv('SIDE_EFFECT_SUBMIT_TIMEOUT', '0.5'))  # seconds to block when the queue is full
+
+# Event log totals: counted exactly at startup below this many rows, estimated from table statistics above
+EVENT_LOG_EXACT_COUNT_LIMIT = int(os.getenv('EVENT_LOG_EXACT_COUNT_LIMIT', '100000'))
 
 # Notification throttling (air quality every 5 minutes)
 # Initialize with timezone-aware datetime to avoid timezone errors
 last_air_quality_notification = datetime.min.replace(tzinfo=timezone.utc)
 AIR_QUALITY_NOTIFICATION_INTERVAL = timedelta(minutes=5)
 
+# Alert thresholds and actuator timeouts, seeded into the alert_rules table (edit them there or via /api/alert-rules)
+# LDR: Dark = high value (4095), Bright = low value (0), so light_level above light_threshold means dark
+ALERT_RULE_DEFAULTS = {
+    'air_quality_threshold': 2000,  # MQ135 reading above this is a gas leak
+    'sound_threshold': 200,  # sound level above this is a loud noise (glass breaking, etc.)
+    'light_threshold': 2000,  # LDR reading above this is low light
+    'motion_buzzer_timeout': 10,  # seconds
+    'motion_light_timeout': 60,  # seconds
+    'other_sensors_timeout': 10  # seconds, buzzer and light for fire, door, air quality and sound
+}
+
 # PostgreSQL Database configuration (from environment variables)
 POSTGRES_CONFIG = {
     'host': os.getenv('POSTGRES_HOST', 'localhost'),
@@ -45,24 +507,873 @@ POSTGRES_CONFIG = {
     'port': int(os.getenv('POSTGRES_PORT', '5432'))
 }
 
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection (or for the DB to come back)
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))  # re-validate connections idle longer than this
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # recycle connections older than this
+
+# Per-request database profiling (off by default, can also be switched at runtime via PUT /api/db/profile)
+# Adds a Server-Timing header to every response and keeps the breakdown of recent requests for GET /api/db/profile
+DB_PROFILE = os.getenv('DB_PROFILE', 'false').lower() == 'true'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))  # while profiling, log statements slower than this (0 = off)
+DB_PROFILE_HISTORY = int(os.getenv('DB_PROFILE_HISTORY', '500'))  # recent requests the worst ones are picked from
+DB_PROFILE_MAX_STATEMENTS = 50  # distinct statements broken down per request, the rest are summed as '(other)'
+
+class DatabaseUnavailableError(Exception):
+    """Raised when no database connection could be obtained within the pool timeout"""
+    pass
+
+class QueryProfiler:
+    """Connections, statements, rows and DB time of the request running on the current thread.
+    CountingCursor and PooledConnection only report here while enabled, so switched off it costs
+    one attribute check per statement. Statements outside a request (background writers, timers)
+    are not attributed to anything but still go through the slow-query log."""
+
+    def __init__(self, enabled=False, slow_query_ms=200.0, history=500):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=max(1, history))
+        self._normalized = {}  # query string -> statement text shown in breakdowns and the slow log
+        self.stats = {'requests': 0, 'slow_queries': 0}
+
+    def begin(self, method, path):
+        """Start profiling the current thread's request (no-op while disabled)"""
+        self._local.profile = {
+            'method': method,
+            'path': path,
+            'connections': 0,  # pool checkouts
+            'connections_opened': 0,  # of which needed a new physical connection
+            'pool_wait_ms': 0.0,
+            'statements': 0,
+            'rows': 0,
+            'db_ms': 0.0,
+            'queries': {}  # statement text -> [calls, rows, ms]
+        } if self.enabled else None
+
+    def end(self, route, status, total_ms):
+        """Finish the current thread's request profile and keep it; returns it (None if not profiling)"""
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return None
+        self._local.profile = None
+        profile['route'] = route
+        profile['status'] = status
+        profile['total_ms'] = total_ms
+        profile['at'] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._recent.append(profile)
+            self.stats['requests'] += 1
+        return profile
+
+    def checkout(self, wait_ms, opened):
+        profile = getattr(self._local, 'profile', None)
+        if profile is not None:
+            profile['connections'] += 1
+            profile['connections_opened'] += opened
+            profile['pool_wait_ms'] += wait_ms
+
+    def _statement_text(self, query):
+        text = self._normalized.get(query) if isinstance(query, str) else None
+        if text is None:
+            raw = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+            # execute_values() sends its rows inlined, so cut the VALUES list to keep one entry per statement
+            text = re.sub(r'\bVALUES\s*\(.*', 'VALUES ...', ' '.join(raw.split()), flags=re.IGNORECASE)
+            if len(text) > 200:
+                text = text[:197] + '...'
+            if isinstance(query, str):
+                if len(self._normalized) >= 1024:
+                    self._normalized.clear()
+                self._normalized[query] = text
+        return text
+
+    def record(self, query, started, rows):
+        """Account one statement (or commit/rollback) that started at perf_counter() value started"""
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        rows = max(rows or 0, 0)
+        text = self._statement_text(query)
+        profile = getattr(self._local, 'profile', None)
+        if profile is not None:
+            profile['statements'] += 1
+            profile['rows'] += rows
+            profile['db_ms'] += elapsed_ms
+            queries = profile['queries']
+            entry = queries.get(text)
+            if entry is None:
+                if len(queries) >= DB_PROFILE_MAX_STATEMENTS:
+                    text = '(other)'
+                entry = queries.setdefault(text, [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += rows
+            entry[2] += elapsed_ms
+        if self.slow_query_ms and elapsed_ms >= self.slow_query_ms:
+            with self._lock:
+                self.stats['slow_queries'] += 1
+            where = f"{profile['method']} {profile['path']}" if profile is not None else 'background'
+            log.warning("🐢 Slow query (%.1f ms, %d rows) during %s: %s", elapsed_ms, rows, where, text)
+
+    @staticmethod
+    def server_timing(profile):
+        """Server-Timing header value for a finished profile"""
+        return (f'db;dur={profile["db_ms"]:.1f};desc="{profile["statements"]} statements, {profile["rows"]} rows", '
+                f'db-pool;dur={profile["pool_wait_ms"]:.1f};desc="{profile["connections"]} checkouts, '
+                f'{profile["connections_opened"]} opened", '
+                f'total;dur={profile["total_ms"]:.1f}')
+
+    def worst(self, limit=10):
+        """The recent requests with the most DB time, each with its per-statement breakdown"""
+        with self._lock:
+            recent = list(self._recent)
+        result = []
+        for profile in heapq.nlargest(limit, recent, key=lambda p: p['db_ms']):
+            queries = sorted(profile['queries'].items(), key=lambda item: item[1][2], reverse=True)
+            result.append(dict(
+                {key: value for key, value in profile.items() if key != 'queries'},
+                db_ms=round(profile['db_ms'], 3),
+                pool_wait_ms=round(profile['pool_wait_ms'], 3),
+                total_ms=round(profile['total_ms'], 3),
+                queries=[{'statement': text, 'calls': calls, 'rows': rows, 'ms': round(ms, 3)}
+                         for text, (calls, rows, ms) in queries]))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+
+db_profiler = QueryProfiler(DB_PROFILE, DB_SLOW_QUERY_MS, DB_PROFILE_HISTORY)
+
+class CountingCursor:
+    """Cursor wrapper that counts the statements sent through it on its PooledConnection"""
+
+    def __init__(self, owner, cursor):
+        self._owner = owner
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._cursor.close()
+        return False
+
+    def _profiled(self, method, query, *args):
+        started = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            db_profiler.record(query, started, self._cursor.rowcount)
+
+    def execute(self, query, params=None):
+        self._owner.statements += 1
+        if db_profiler.enabled:
+            return self._profiled(self._cursor.execute, query, params)
+        return self._cursor.execute(query, params)
+
+    def executemany(self, query, params_seq):
+        self._owner.statements += 1
+        if db_profiler.enabled:
+            return self._profiled(self._cursor.executemany, query, params_seq)
+        return self._cursor.executemany(query, params_seq)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._owner.statements += 1
+        if db_profiler.enabled:
+            return self._profiled(self._cursor.copy_expert, sql, file, size)
+        return self._cursor.copy_expert(sql, file, size)
+
+class PooledConnection:
+    """Connection checked out from the pool.
+    Behaves like a psycopg2 connection, but close() hands it back to the pool
+    instead of closing the socket, so existing conn.close() call sites keep working.
+    Statements and commits/rollbacks are counted and added to the pool stats on close()."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.statements = 0
+        self.commits = 0
+
+    def _live(self):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError('connection already returned to pool')
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self, self._live().cursor(*args, **kwargs))
+
+    def commit(self):
+        self.commits += 1
+        if db_profiler.enabled:
+            started = time.perf_counter()
+            try:
+                return self._live().commit()
+            finally:
+                db_profiler.record('COMMIT', started, 0)
+        return self._live().commit()
+
+    def rollback(self):
+        self.commits += 1
+        if db_profiler.enabled:
+            started = time.perf_counter()
+            try:
+                return self._live().rollback()
+            finally:
+                db_profiler.record('ROLLBACK', started, 0)
+        return self._live().rollback()
+
+    def close(self):
+        conn = self.__dict__.get('_conn')
+        if conn is not None:
+            self._conn = None
+            self._pool.putconn(conn, self.statements, self.commits)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # Safety net for code paths that raise before reaching conn.close()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class DatabasePool:
+    """Bounded, thread-safe PostgreSQL connection pool.
+    - at most max_size connections are open at any time; callers wait (up to timeout) for a free one
+    - the session timezone is set once per physical connection (startup option, no extra round trip)
+    - idle connections are health-checked before reuse and recycled after max_lifetime
+    - if the database is down, getconn() keeps retrying until the timeout and then raises
+      DatabaseUnavailableError instead of killing the process"""
+
+    def __init__(self, config, min_size=2, max_size=10, timeout=10.0,
+                 healthcheck_interval=30.0, max_lifetime=1800.0):
+        self._config = dict(config)
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.max_lifetime = max_lifetime
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, last_used)], most recently used last
+        self._created = {}  # id(conn) -> created_at (monotonic)
+        self._size = 0  # open connections, idle + checked out
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'connect_errors': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'healthcheck_failures': 0,
+            'total_wait_ms': 0.0,
+            'max_in_use': 0,
+            'statements': 0,
+            'commits': 0  # commits and rollbacks
+        }
+
+    def _connect(self):
+        # Set timezone to UTC for consistent timestamp handling (applied at session start)
+        return psycopg2.connect(options='-c timezone=UTC', **self._config)
+
+    def _discard(self, conn):
+        """Close a connection and release its slot (caller holds the lock)"""
+        self._created.pop(id(conn), None)
+        self._size -= 1
+        self._stats['connections_closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _is_healthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            conn = None
+            needs_check = False
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        candidate, created_at, last_used = self._idle.pop()
+                        if candidate.closed or now - created_at > self.max_lifetime:
+                            self._discard(candidate)
+                            continue
+                        conn = candidate
+                        needs_check = now - last_used > self.healthcheck_interval
+                        break
+                    if conn is not None:
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1  # reserve a slot, connect outside the lock
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise DatabaseUnavailableError(
+                            f'No database connection available within {timeout:.1f}s '
+                            f'(pool exhausted: {self._size}/{self.max_size} in use)')
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if conn is not None:
+                if needs_check and not self._is_healthy(conn):
+                    with self._cond:
+                        self._stats['healthcheck_failures'] += 1
+                        self._discard(conn)
+                    continue
+                return self._checked_out(conn, started)
+
+            # Open a new physical connection, retrying while the database is unreachable
+            retry_delay = 0.25
+            while True:
+                try:
+                    conn = self._connect()
+                    break
+                except psycopg2.OperationalError as e:
+                    with self._cond:
+                        self._stats['connect_errors'] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._cond:
+                            self._size -= 1
+                            self._stats['timeouts'] += 1
+                            self._cond.notify()
+                        log.error("❌ Database connection error: %s", e)
+                        raise DatabaseUnavailableError(f'Database unavailable after {timeout:.1f}s: {e}') from e
+                    time.sleep(min(retry_delay, remaining))
+                    retry_delay = min(retry_delay * 2, 2.0)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            with self._cond:
+                self._created[id(conn)] = time.monotonic()
+                self._stats['connections_opened'] += 1
+            return self._checked_out(conn, started, opened=True)
+
+    def _checked_out(self, conn, started, opened=False):
+        wait_ms = (time.monotonic() - started) * 1000.0
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['total_wait_ms'] += wait_ms
+            in_use = self._size - len(self._idle)
+            if in_use > self._stats['max_in_use']:
+                self._stats['max_in_use'] = in_use
+        if db_profiler.enabled:
+            db_profiler.checkout(wait_ms, opened)
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn, statements=0, commits=0):
+        """Return a connection to the pool, rolling back any open transaction.
+        statements/commits are the counts of the checkout that ends here."""
+        if not conn.closed:
+            try:
+                if conn.autocommit:
+                    conn.autocommit = False
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        with self._cond:
+            self._stats['statements'] += statements
+            self._stats['commits'] += commits
+            if conn.closed:
+                self._discard(conn)
+                return
+            created_at = self._created.get(id(conn), time.monotonic())
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def warmup(self):
+        """Pre-open min_size connections (raises DatabaseUnavailableError if the DB stays down)"""
+        conns = [self.getconn() for _ in range(min(self.min_size, self.max_size))]
+        for conn in conns:
+            conn.close()
+
+    def closeall(self):
+        """Close all idle connections (used on shutdown)"""
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['min_size'] = self.min_size
+            stats['max_size'] = self.max_size
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        stats['round_trips'] = stats['statements'] + stats['commits']
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        return stats
+
+db_pool = DatabasePool(POSTGRES_CONFIG,
+                       min_size=DB_POOL_MIN_SIZE,
+                       max_size=DB_POOL_MAX_SIZE,
+                       timeout=DB_POOL_TIMEOUT,
+                       healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL,
+                       max_lifetime=DB_POOL_MAX_LIFETIME)
+
 # Function to get PostgreSQL database connection
 def get_db_connection():
-    """Get PostgreSQL database connection"""
-    try:
-        conn = psycopg2.connect(**POSTGRES_CONFIG)
-        # Set timezone to UTC for consistent timestamp handling
-        cur = conn.cursor()
-        cur.execute("SET timezone = 'UTC'")
-        cur.close()
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"❌ Database connection error: {e}")
-        sys.exit(1)
+    """Get a PostgreSQL connection from the pool (conn.close() returns it to the pool).
+    Raises DatabaseUnavailableError if none can be obtained within DB_POOL_TIMEOUT."""
+    return db_pool.getconn()
+
+class IngestTransaction:
+    """One connection and one transaction for all DB work caused by a single sensor reading.
+    Helpers such as log_event(), log_sensor_event(), send_notification() and
+    update_system_control() accept tx=... and write through it instead of opening
+    their own connection and committing. Side effects that must not run inside the
+    transaction (e-mail) are registered with after_commit().
+    With defer_side_effects=True, logging/notification helpers only record their call
+    (defer()); after commit the recorded calls are handed to the side-effect queue
+    and replayed there in a transaction of their own."""
+
+    def __init__(self, defer_side_effects=False):
+        self.defer_side_effects = defer_side_effects
+        self.deferred = []
+        self.conn = get_db_connection()
+        self.cur = self.conn.cursor(cursor_factory=RealDictCursor)
+        self.system_control = None  # system_control row as updated inside this transaction
+        self.summary = {
+            'sensor_data_id': None,
+            'sensor_events': 0,
+            'event_log': 0,
+            'notifications': 0,
+            'control_updates': 0
+        }
+        self._after_commit = []
+
+    def after_commit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) once the transaction has been committed"""
+        self._after_commit.append((func, args, kwargs))
+
+    def defer(self, func, *args, **kwargs):
+        """Record func(*args, tx=..., **kwargs) to run on the side-effect queue after commit"""
+        self.deferred.append((func, args, kwargs))
+
+    def commit(self):
+        # COMMIT on an aborted transaction silently rolls back - refuse instead
+        if self.conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            self.conn.rollback()
+            raise psycopg2.InternalError('ingest transaction aborted by an earlier failed statement')
+        with stage_tracer.span('commit'):
+            self.conn.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for func, args, kwargs in callbacks:
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                log.error("❌ Error in post-commit action %s: %s", getattr(func, '__name__', func), e)
+        # Deferred work is queued last so it sees the state cache updated by the callbacks above
+        if self.deferred:
+            deferred, self.deferred = self.deferred, []
+            self.summary['deferred'] = len(deferred)
+            side_effect_queue.submit(run_deferred_side_effects, deferred)
+
+    def rollback(self):
+        self._after_commit = []
+        self.deferred = []
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+        return False
+
+class ControlStateCache:
+    """Write-through in-process cache of the single-row tables system_control and
+    sensor_board_control, plus the per-sensor sensor_controls flags and the alert_rules settings.
+    Every write path stores the row it wrote (UPDATE ... RETURNING *) via put_*(), which
+    bumps the version, so readers see their own writes immediately without touching the DB.
+    Single-row writes carry the row's version column and a put older than the cached row is ignored.
+    Rows are loaded lazily on first use. Assumes a single server process owns these tables."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._system_control = None
+        self._sensor_board_control = None
+        self._sensor_controls = None
+        self._alert_rules = None
+        self.version = 0
+        self.versions = {'system_control': 0, 'sensor_board_control': 0, 'sensor_controls': 0, 'alert_rules': 0}
+        self._listeners = {'system_control': [], 'sensor_board_control': [], 'sensor_controls': [], 'alert_rules': []}
+
+    def subscribe(self, func, table='system_control'):
+        """Call func(row) whenever a row of table is loaded or written"""
+        self._listeners[table].append(func)
+
+    def _notify(self, row, table='system_control'):
+        for func in self._listeners[table]:
+            try:
+                func(dict(row))
+            except Exception as e:
+                log.warning("⚠️ %s listener failed: %s", table, e)
+
+    def _bump(self, table):
+        self.version += 1
+        self.versions[table] = self.version
+
+    def _load_row(self, query):
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(query)
+            return cur.fetchall()
+        finally:
+            conn.close()
+
+    def get_system_control(self, tx=None):
+        """Current system_control row (a copy), or the one written inside tx if any"""
+        if tx is not None and tx.system_control is not None:
+            return dict(tx.system_control)
+        row = self._system_control
+        if row is None:
+            rows = self._load_row('SELECT * FROM system_control WHERE id = 1')
+            if not rows:
+                return None
+            with self._lock:
+                loaded = self._system_control is None
+                if loaded:
+                    self._system_control = dict(rows[0])
+                    self._bump('system_control')
+                row = self._system_control
+            if loaded:
+                self._notify(row)
+        return dict(row)
+
+    def get_sensor_board_control(self):
+        """Current sensor_board_control row (a copy)"""
+        row = self._sensor_board_control
+        if row is None:
+            rows = self._load_row('SELECT * FROM sensor_board_control WHERE id = 1')
+            if not rows:
+                return None
+            with self._lock:
+                if self._sensor_board_control is None:
+                    self._sensor_board_control = dict(rows[0])
+                    self._bump('sensor_board_control')
+                row = self._sensor_board_control
+        return dict(row)
+
+    def get_sensor_controls(self):
+        """Per-sensor flags: {sensor_name: {'light_enabled': bool, 'buzzer_enabled': bool}} (a copy)"""
+        controls = self._sensor_controls
+        if controls is None:
+            rows = self._load_row('SELECT sensor_name, light_enabled, buzzer_enabled FROM sensor_controls')
+            with self._lock:
+                if self._sensor_controls is None:
+                    self._sensor_controls = {row['sensor_name']: {'light_enabled': row['light_enabled'], 'buzzer_enabled': row['buzzer_enabled']}
+                                             for row in rows}
+                    self._bump('sensor_controls')
+                controls = self._sensor_controls
+        return {name: dict(flags) for name, flags in controls.items()}
+
+    def get_alert_rules(self):
+        """Thresholds and timeouts: {name: value} (a copy), defaults for names missing from alert_rules"""
+        rules = self._alert_rules
+        if rules is None:
+            rows = self._load_row('SELECT name, value FROM alert_rules')
+            with self._lock:
+                if self._alert_rules is None:
+                    self._alert_rules = dict(ALERT_RULE_DEFAULTS, **{row['name']: row['value'] for row in rows})
+                    self._bump('alert_rules')
+                rules = self._alert_rules
+        return dict(rules)
+
+    @staticmethod
+    def _is_stale(row, cached):
+        """True if row is not newer than the cached row, e.g. the put of a transaction that
+        committed earlier but reached the cache after a later one"""
+        return cached is not None and row.get('version', 0) <= cached.get('version', 0)
+
+    def put_system_control(self, row):
+        with self._lock:
+            if self._is_stale(row, self._system_control):
+                return
+            self._system_control = dict(row)
+            self._bump('system_control')
+        self._notify(row)
+
+    def put_sensor_board_control(self, row):
+        with self._lock:
+            if self._is_stale(row, self._sensor_board_control):
+                return
+            self._sensor_board_control = dict(row)
+            self._bump('sensor_board_control')
+        self._notify(row, 'sensor_board_control')
+
+    def put_sensor_control(self, row):
+        with self._lock:
+            controls = dict(self._sensor_controls or {})
+            controls[row['sensor_name']] = {'light_enabled': row['light_enabled'], 'buzzer_enabled': row['buzzer_enabled']}
+            # Not loaded yet: keep only after a full load so other sensors are not missing
+            if self._sensor_controls is not None:
+                self._sensor_controls = controls
+            self._bump('sensor_controls')
+        self._notify(row, 'sensor_controls')
+
+    def put_alert_rule(self, row):
+        with self._lock:
+            if self._alert_rules is not None:
+                self._alert_rules = dict(self._alert_rules, **{row['name']: row['value']})
+            self._bump('alert_rules')
+        self._notify(row, 'alert_rules')
+
+    def invalidate(self):
+        """Drop everything so the next read reloads from the database"""
+        with self._lock:
+            self._system_control = None
+            self._sensor_board_control = None
+            self._sensor_controls = None
+            self._alert_rules = None
+            self._bump('system_control')
+            self._bump('sensor_board_control')
+            self._bump('sensor_controls')
+            self._bump('alert_rules')
+
+state_cache = ControlStateCache()
+
+class LatestReadingSnapshot:
+    """The newest sensor_data row, kept in process memory.
+    Updated after every committed ingest and rebuilt from the database at startup,
+    so the control board poll and dashboard refresh never query sensor_data for it."""
+
+    COLUMNS = ('id, pir_motion, flame_detected, door_open, air_quality, sound_level, '
+               'light_level, temperature, humidity, timestamp, created_at')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._row = None
+        self._loaded = False
+        self.version = 0
+        self._listeners = []
+
+    def subscribe(self, func):
+        """Call func(row) after each newly published reading"""
+        self._listeners.append(func)
+
+    def load(self):
+        """(Re)build the snapshot from the database"""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(f'''
+                SELECT {self.COLUMNS} FROM sensor_data
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ''')
+            row = cur.fetchone()
+        finally:
+            conn.close()
+        with self._lock:
+            self._row = dict(row) if row else None
+            self._loaded = True
+            self.version += 1
+
+    def get(self):
+        """Latest reading as a dict (a copy), or None if there is none yet"""
+        if not self._loaded:
+            self.load()
+        row = self._row
+        return dict(row) if row is not None else None
+
+    def update(self, row):
+        """Publish a newly committed reading (ignored if an even newer one is already published)"""
+        with self._lock:
+            if self._row is not None and self._row.get('id') is not None and row.get('id') is not None \
+                    and row['id'] < self._row['id']:
+                return
+            self._row = dict(row)
+            self._loaded = True
+            self.version += 1
+        for func in self._listeners:
+            try:
+                func(dict(row))
+            except Exception as e:
+                log.warning("⚠️ Latest reading listener failed: %s", e)
+
+latest_reading = LatestReadingSnapshot()
+
+class EventLogCounter:
+    """Number of event_log rows, kept in process memory so /api/events never runs COUNT(*).
+    Loaded once (exactly for small tables, from the planner's row estimate above
+    EVENT_LOG_EXACT_COUNT_LIMIT), then maintained by log_event() and the clear endpoint."""
+
+    def __init__(self, exact_limit):
+        self.exact_limit = exact_limit
+        self._lock = threading.Lock()
+        self._count = None
+        self.exact = False
+
+    def load(self):
+        """(Re)read the count from the database"""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = 'event_log'::regclass")
+            row = cur.fetchone()
+            count, exact = (row[0] if row else 0), False
+            if count < self.exact_limit:
+                cur.execute('SELECT COUNT(*) FROM event_log')
+                count, exact = cur.fetchone()[0], True
+        finally:
+            conn.close()
+        with self._lock:
+            self._count = count
+            self.exact = exact
+
+    def get(self):
+        if self._count is None:
+            self.load()
+        return self._count
+
+    def add(self, n=1):
+        with self._lock:
+            if self._count is not None:
+                self._count += n
+
+    def reset(self):
+        with self._lock:
+            self._count = 0
+            self.exact = True
+
+event_log_counter = EventLogCounter(EVENT_LOG_EXACT_COUNT_LIMIT)
+
+# Dashboard push stream (Server-Sent Events)
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))  # seconds between keep-alive comments
+SSE_HISTORY_SIZE = int(os.getenv('SSE_HISTORY_SIZE', '500'))  # events kept for Last-Event-ID resume
+
+class EventBroadcaster:
+    """Fan-out of dashboard change events to /api/stream clients.
+    Events get increasing ids and are kept in a ring buffer so a reconnecting client can resume
+    from its Last-Event-ID. Ids start at the boot time in ms, so ids from before a restart
+    always look too old and trigger a full resync."""
+
+    def __init__(self, history_size):
+        self._cond = threading.Condition()
+        self._history = deque(maxlen=history_size)  # (id, event, json data)
+        self._last_payload = {}
+        self.last_id = int(time.time() * 1000)
+        self.clients = 0
+        self.published = 0
+
+    def publish(self, event, data, only_if_changed=False):
+        """Queue an event for all clients. With only_if_changed, identical consecutive payloads are dropped."""
+        payload = json.dumps(data, default=str)
+        with self._cond:
+            if only_if_changed and self._last_payload.get(event) == payload:
+                return
+            self._last_payload[event] = payload
+            self.last_id += 1
+            self._history.append((self.last_id, event, payload))
+            self.published += 1
+            self._cond.notify_all()
+
+    def events_after(self, last_id):
+        """Events newer than last_id, or None if last_id is unknown (too old, or from before a restart)"""
+        with self._cond:
+            return self._events_after(last_id)
+
+    def _events_after(self, last_id):
+        if last_id > self.last_id:
+            return None
+        if self._history and last_id < self._history[0][0] - 1:
+            return None
+        if not self._history and last_id != self.last_id:
+            return None
+        return [e for e in self._history if e[0] > last_id]
+
+    def wait(self, last_id, timeout):
+        """Block until there are events after last_id (or timeout); returns them as for events_after"""
+        with self._cond:
+            if self.last_id == last_id:
+                self._cond.wait(timeout)
+            return self._events_after(last_id)
+
+    def add_client(self):
+        with self._cond:
+            self.clients += 1
+
+    def remove_client(self):
+        with self._cond:
+            self.clients -= 1
+
+broadcaster = EventBroadcaster(SSE_HISTORY_SIZE)
 
 # AES encryption configuration (must match ESP32)
 ENCRYPTION_KEY = b'MySecretKey12345'  # 16 bytes key for AES-128
 BLOCK_SIZE = 16
 
+# Binary sensor upload format, selected by Content-Type (JSON/form uploads keep working)
+SENSOR_BINARY_CONTENT_TYPE = 'application/x-sensor-reading'
+SENSOR_BINARY_ENCRYPTED_CONTENT_TYPE = 'application/x-sensor-reading+aes'  # 16-byte IV + AES-CBC(records)
+SENSOR_BINARY_GCM_CONTENT_TYPE = 'application/x-sensor-reading+aes-gcm'  # 12-byte nonce + AES-GCM(records) + 16-byte tag
+SENSOR_BINARY_CONTENT_TYPES = {
+    SENSOR_BINARY_CONTENT_TYPE: None,
+    SENSOR_BINARY_ENCRYPTED_CONTENT_TYPE: 'cbc',
+    SENSOR_BINARY_GCM_CONTENT_TYPE: 'gcm'
+}
+SENSOR_RECORD_VERSION = 1
+# Little-endian, 16 bytes: version, flags (1 = motion, 2 = flame, 4 = reed switch active),
+# air_quality, sound_level, light_level, temperature (0.01 °C), humidity (0.01 %), unix timestamp
+SENSOR_RECORD = struct.Struct('<BBHHHhHI')
+
 # Initialize database with required tables
 def init_database():
     """Initialize PostgreSQL database with required tables"""
@@ -112,6 +1423,7 @@ def init_database():
             control_board_server_url VARCHAR(255),
             buzzer_activated_at TIMESTAMP,
             light_activated_at TIMESTAMP,
+            version BIGINT NOT NULL DEFAULT 0,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -126,6 +1438,7 @@ def init_database():
             wifi_ssid VARCHAR(100),
             wifi_password VARCHAR(100),
             server_url VARCHAR(255),
+            version BIGINT NOT NULL DEFAULT 0,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -136,10 +1449,25 @@ def init_database():
             id SERIAL PRIMARY KEY,
             event_type VARCHAR(50) NOT NULL,
             event_message TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sensor VARCHAR(20),
+            event_code VARCHAR(50),
+            severity VARCHAR(10) DEFAULT 'info'
         )
     ''')
     
+    # Add structured event columns if they don't exist (for existing databases) and fill them in once
+    cur.execute('''
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'event_log' AND column_name = 'event_code')
+    ''')
+    has_event_code = cur.fetchone()[0]
+    if not has_event_code:
+        cur.execute('ALTER TABLE event_log ADD COLUMN IF NOT EXISTS sensor VARCHAR(20)')
+        cur.execute('ALTER TABLE event_log ADD COLUMN IF NOT EXISTS event_code VARCHAR(50)')
+        cur.execute("ALTER TABLE event_log ADD COLUMN IF NOT EXISTS severity VARCHAR(10) DEFAULT 'info'")
+        backfill_event_log_fields(cur)
+    
     # Create per-sensor control table (for individual sensor light/buzzer controls)
     cur.execute('''
         CREATE TABLE IF NOT EXISTS sensor_controls (
@@ -200,6 +1528,19 @@ def init_database():
                 ON CONFLICT (sensor_name) DO NOTHING
             ''', (sensor_name, light_enabled, buzzer_enabled))
     
+    # Alert thresholds and timeouts (compiled into the alert rule engine's decision table)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            name VARCHAR(50) PRIMARY KEY,
+            value INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    execute_values(cur, '''
+        INSERT INTO alert_rules (name, value) VALUES %s
+        ON CONFLICT (name) DO NOTHING
+    ''', list(ALERT_RULE_DEFAULTS.items()))
+    
     # Create sensor events table (for sensor events with actions)
     # Use TIMESTAMPTZ (timestamp with timezone) to ensure proper timezone handling
     cur.execute('''
@@ -208,7 +1549,8 @@ def init_database():
             sensor_name VARCHAR(100) NOT NULL,
             sensor_information TEXT NOT NULL,
             action_taken TEXT NOT NULL,
-            timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            is_keyframe BOOLEAN DEFAULT FALSE
         )
     ''')
     
@@ -239,6 +1581,10 @@ def init_database():
     except Exception:
         pass
     
+    # Row versions: bumped by every UPDATE so state_cache can ignore write-throughs that arrive out of order
+    cur.execute('ALTER TABLE system_control ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0')
+    cur.execute('ALTER TABLE sensor_board_control ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0')
+    
     # Create notifications table for dashboard/email alerts
     cur.execute('''
         CREATE TABLE IF NOT EXISTS notifications (
@@ -251,6 +1597,24 @@ def init_database():
         )
     ''')
     
+    # Create outbound e-mail queue (one row per recipient, drained by EmailDispatcher)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id SERIAL PRIMARY KEY,
+            notification_id INTEGER,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(status, next_attempt_at)')
+    
     # Add read column if it doesn't exist
     try:
         cur.execute('ALTER TABLE notifications ADD COLUMN IF NOT EXISTS read BOOLEAN DEFAULT FALSE')
@@ -280,11 +1644,43 @@ def init_database():
         # Table might already exist, ignore error
         pass
     
+    # Keyframe marker for change-only sensor event logging (for existing databases)
+    cur.execute('ALTER TABLE sensor_events ADD COLUMN IF NOT EXISTS is_keyframe BOOLEAN DEFAULT FALSE')
+    
+    # Convert sensor_data / sensor_events to range-partitioned tables if enabled
+    if SENSOR_PARTITIONING in ('daily', 'weekly'):
+        for table in PARTITIONED_TABLES:
+            partition_table(cur, table)
+    
     # Create indexes for better performance
     cur.execute('CREATE INDEX IF NOT EXISTS idx_sensor_timestamp ON sensor_data(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sensor_created_at ON sensor_data(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sensor_events_timestamp ON sensor_events(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sensor_events_sensor_timestamp ON sensor_events(sensor_name, timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sensor_events_keyframe ON sensor_events(timestamp) WHERE is_keyframe')
     cur.execute('CREATE INDEX IF NOT EXISTS idx_event_timestamp ON event_log(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_event_timestamp_id ON event_log(timestamp, id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_event_sensor_timestamp ON event_log(sensor, timestamp, id) WHERE sensor IS NOT NULL')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_event_severity_timestamp ON event_log(severity, timestamp) WHERE severity <> 'info'")
     cur.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
     
+    # Create time-bucket rollups of sensor_data (maintained incrementally by the ingest transaction)
+    for resolution in ROLLUP_RESOLUTIONS:
+        metric_columns = ',\n'.join(f'                {metric}_min DOUBLE PRECISION,\n'
+                                    f'                {metric}_max DOUBLE PRECISION,\n'
+                                    f'                {metric}_sum DOUBLE PRECISION' for metric in ROLLUP_METRICS)
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS sensor_rollup_{resolution} (
+                bucket TIMESTAMP PRIMARY KEY,
+                samples INTEGER NOT NULL,
+{metric_columns},
+                motion_count INTEGER NOT NULL DEFAULT 0,
+                flame_count INTEGER NOT NULL DEFAULT 0,
+                door_open_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+    backfill_sensor_rollups(cur)
+    
     # Insert default admin user if not exists
     admin_password = hash_password('admin123')
     cur.execute('''
@@ -303,7 +1699,7 @@ def init_database():
     # Ensure buzzer and light start OFF (reset on startup)
     cur.execute('''
         UPDATE system_control 
-        SET buzzer_on = FALSE, light_on = FALSE, buzzer_manual_off = FALSE
+        SET version = version + 1, buzzer_on = FALSE, light_on = FALSE, buzzer_manual_off = FALSE
         WHERE id = 1
     ''')
     
@@ -316,7 +1712,8 @@ def init_database():
     
     conn.commit()
     conn.close()
-    print("✅ Database initialized successfully!")
+    state_cache.invalidate()
+    log.info("✅ Database initialized successfully!")
 
 # Password hashing functions
 def hash_password(password):
@@ -327,60 +1724,140 @@ def verify_password(password, password_hash):
     """Verify password against hash"""
     return hash_password(password) == password_hash
 
-# Decrypt data from ESP32
-def decrypt_data(encrypted_data):
-    """Decrypt AES-encrypted data from ESP32"""
-    try:
-        from urllib.parse import unquote
-        print(f"🔐 Decrypt: Input length: {len(encrypted_data)}")
-        encrypted_data = unquote(encrypted_data)
-        print(f"🔐 Decrypt: After unquote length: {len(encrypted_data)}")
-        encrypted_data = encrypted_data.strip().replace('\n', '').replace('\r', '').replace(' ', '+')
-        
-        if len(encrypted_data) % 4 != 0:
-            padding_needed = 4 - (len(encrypted_data) % 4)
-            print(f"🔐 Decrypt: Adding {padding_needed} padding chars")
-            encrypted_data += '=' * padding_needed
-        
-        print(f"🔐 Decrypt: Base64 string length: {len(encrypted_data)}")
-        combined_data = base64.b64decode(encrypted_data)
-        print(f"🔐 Decrypt: Decoded binary length: {len(combined_data)}")
-        
-        if len(combined_data) < 16:
-            print("Error: Encrypted data too short")
+class SensorDecryptor:
+    """AES decryption of sensor payloads with the key schedule set up once.
+    CBC (the firmware's format: IV + ciphertext, PKCS7) runs one ECB pass over the
+    ciphertext and XORs it with the shifted ciphertext, so no cipher object is built
+    per payload; decrypt_many() does that ECB pass once for a whole batch.
+    GCM (nonce + ciphertext + tag) is authenticated: a corrupted payload fails the
+    tag check instead of going through the CBC padding fallback."""
+
+    GCM_NONCE_SIZE = 12
+    GCM_TAG_SIZE = 16
+
+    def __init__(self, key):
+        self.key = key
+        self._ecb = AES.new(key, AES.MODE_ECB)
+
+    @staticmethod
+    def _count(result, n=1):
+        # Called from concurrent request threads: per-thread metric shards instead of a shared dict
+        if n:
+            metrics.inc('smart_home_decrypt_total', (result,), n)
+
+    @staticmethod
+    def decode(payload):
+        """Raw bytes of a base64 payload as uploaded (URL-quoted, '+' turned into ' ', unpadded)"""
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            return bytes(payload)
+        payload = payload.strip()
+        if '%' in payload:
+            payload = unquote(payload)
+        if ' ' in payload:
+            payload = payload.replace(' ', '+')
+        if '\n' in payload or '\r' in payload:
+            payload = payload.replace('\n', '').replace('\r', '')
+        if len(payload) % 4:
+            payload += '=' * (-len(payload) % 4)
+        return binascii.a2b_base64(payload)
+
+    @staticmethod
+    def _unpad(data):
+        try:
+            return unpad(data, BLOCK_SIZE)
+        except ValueError:
+            # Older firmware sent zero-padded blocks
+            data = data.rstrip(b'\x00')
+            if data and 0 < data[-1] <= 16:
+                data = data[:-data[-1]]
+            return data
+
+    def _cbc_valid(self, data):
+        return len(data) >= 32 and len(data) % 16 == 0
+
+    def _xor_chain(self, decrypted, data):
+        # CBC: P[i] = D(C[i]) ^ C[i-1], with C[-1] = IV = data[:16]
+        size = len(decrypted)
+        chained = int.from_bytes(decrypted, 'little') ^ int.from_bytes(data[:size], 'little')
+        return chained.to_bytes(size, 'little')
+
+    def decrypt_cbc(self, data, strict=False):
+        """Plaintext bytes of IV + AES-CBC ciphertext, or None if malformed
+        (strict: also if the PKCS7 padding is wrong, instead of the zero-padding fallback)"""
+        if not self._cbc_valid(data):
+            self._count('rejected')
             return None
-        
-        iv = combined_data[:16]
-        ciphertext = combined_data[16:]
-        print(f"🔐 Decrypt: IV length: {len(iv)}, Ciphertext length: {len(ciphertext)}")
-        
-        if len(ciphertext) % 16 != 0:
-            print(f"Warning: Ciphertext length {len(ciphertext)} not multiple of 16")
+        view = memoryview(data)
+        plain = self._xor_chain(self._ecb.decrypt(view[16:]), view)
+        try:
+            plain = unpad(plain, BLOCK_SIZE) if strict else self._unpad(plain)
+        except ValueError:
+            self._count('rejected')
             return None
-        
-        cipher = AES.new(ENCRYPTION_KEY, AES.MODE_CBC, iv)
-        decrypted_padded = cipher.decrypt(ciphertext)
-        
+        self._count('decrypted')
+        return plain
+
+    def decrypt_gcm(self, data):
+        """Plaintext bytes of nonce + AES-GCM ciphertext + tag, or None if malformed or tampered with"""
+        if len(data) <= self.GCM_NONCE_SIZE + self.GCM_TAG_SIZE:
+            self._count('rejected')
+            return None
+        view = memoryview(data)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=view[:self.GCM_NONCE_SIZE])
         try:
-            decrypted = unpad(decrypted_padded, BLOCK_SIZE)
-        except ValueError as e:
-            print(f"Padding error: {e}")
-            decrypted = decrypted_padded.rstrip(b'\x00')
-            if len(decrypted) > 0:
-                padding_length = decrypted[-1]
-                if padding_length <= 16 and padding_length > 0:
-                    decrypted = decrypted[:-padding_length]
-        
+            plain = cipher.decrypt_and_verify(view[self.GCM_NONCE_SIZE:-self.GCM_TAG_SIZE], view[-self.GCM_TAG_SIZE:])
+        except ValueError:
+            self._count('rejected')
+            return None
+        self._count('decrypted')
+        return plain
+
+    def decrypt(self, payload, mode='cbc'):
+        """Decrypted text of one uploaded payload (base64 str or raw bytes), or None"""
         try:
-            result = decrypted.decode('utf-8')
-            return result
-        except UnicodeDecodeError:
-            result = decrypted.decode('utf-8', errors='replace')
-            return result
-        
-    except Exception as e:
-        print(f"Decryption error: {e}")
-        return None
+            data = self.decode(payload)
+        except (binascii.Error, ValueError, TypeError, AttributeError):  # not base64, or not a string at all
+            self._count('rejected')
+            return None
+        plain = self.decrypt_gcm(data) if mode == 'gcm' else self.decrypt_cbc(data)
+        return plain.decode('utf-8', errors='replace') if plain is not None else None
+
+    def decrypt_many(self, payloads, mode='cbc'):
+        """decrypt() for a list of payloads; CBC ciphertexts share a single ECB pass"""
+        if mode == 'gcm':
+            return [self.decrypt(payload, mode) for payload in payloads]
+        blobs = []
+        for payload in payloads:
+            try:
+                data = self.decode(payload)
+            except (binascii.Error, ValueError, TypeError, AttributeError):
+                data = None
+            blobs.append(data if data is not None and self._cbc_valid(data) else None)
+        valid = [data for data in blobs if data is not None]
+        self._count('rejected', len(blobs) - len(valid))
+        decrypted = memoryview(self._ecb.decrypt(b''.join(memoryview(data)[16:] for data in valid)))
+        results, offset = [], 0
+        for data in blobs:
+            if data is None:
+                results.append(None)
+                continue
+            size = len(data) - 16
+            plain = self._unpad(self._xor_chain(decrypted[offset:offset + size], memoryview(data)))
+            offset += size
+            results.append(plain.decode('utf-8', errors='replace'))
+        self._count('decrypted', len(valid))
+        return results
+
+sensor_decryptor = SensorDecryptor(ENCRYPTION_KEY)
+
+# Decrypt data from ESP32
+@stage_tracer.timed('decrypt')
+def decrypt_data(encrypted_data, mode='cbc'):
+    """Decrypt AES-encrypted data from ESP32 (mode 'cbc' or the authenticated 'gcm')"""
+    result = sensor_decryptor.decrypt(encrypted_data, mode)
+    if result is None:
+        log.warning("Decryption error: rejected %s payload (%d chars)", mode, len(str(encrypted_data)))
+    return result
 
 # Login required decorator
 def login_required(f):
@@ -482,7 +1959,7 @@ def register():
         except Exception as e:
             conn.rollback()
             conn.close()
-            print(f"Error creating user: {e}")
+            log.error("Error creating user: %s", e)
             flash('Error creating account. Please try again.', 'error')
             return render_template('register.html')
     
@@ -538,7 +2015,7 @@ def logout():
             conn.commit()
             conn.close()
         except Exception as e:
-            print(f"Error updating active sessions on logout: {e}")
+            log.error("Error updating active sessions on logout: %s", e)
     
     session.clear()
     flash('Logged out successfully!', 'info')
@@ -560,169 +2037,520 @@ def visualization():
                          username=session.get('username'),
                          role=session.get('role', 'user'))
 
-# API Routes for ESP32 Sensor Board
-@app.route('/api/sensor-data', methods=['POST'])
-def receive_sensor_data():
-    """Receive sensor data from ESP32 Board 1"""
-    try:
-        # Handle both JSON (for encrypted data) and form-urlencoded (for unencrypted data)
-        if request.is_json:
-            data = request.get_json()
-        else:
-            data = request.form
-        
-        # Extract raw values (handle both JSON and form-urlencoded)
-        def get_bool_value(key, default=False):
-            val = data.get(key, default)
-            if isinstance(val, bool):
-                return val
-            return str(val).lower() == 'true'
-        
-        def get_int_value(key, default=0):
-            val = data.get(key, default)
-            if isinstance(val, int):
-                return val
-            return int(val) if val else default
-        
-        def get_float_value(key, default=0.0):
-            val = data.get(key, default)
-            if isinstance(val, (int, float)):
-                return float(val)
-            return float(val) if val else default
-        
-        def get_str_value(key, default=''):
-            val = data.get(key, default)
-            return str(val) if val else default
-        
-        pir_motion = get_bool_value('pir_motion', False)
-        flame_detected_raw = data.get('flame_detected', False)
-        # Debug: Print raw flame value
-        print(f"🔥 FLAME RAW VALUE: {flame_detected_raw} (type: {type(flame_detected_raw)})")
-        if isinstance(flame_detected_raw, bool):
-            flame_detected = flame_detected_raw
-        else:
-            flame_detected = str(flame_detected_raw).lower() == 'true'
-        print(f"🔥 FLAME PARSED: {flame_detected}")
-        # Reed switch logic: When magnet is close (reed switch active) = door closed
-        # When magnet is far (reed switch inactive) = door open
-        # So we need to invert the value from the sensor
-        door_open_raw = get_bool_value('door_open', False)
-        door_open = not door_open_raw  # Invert: active (magnet close) = closed, inactive (magnet far) = open
-        air_quality = get_int_value('air_quality', 0)
-        sound_level = get_int_value('sound_level', 0)
-        light_level = get_int_value('light_level', 0)
-        temperature = get_float_value('temperature', 0.0)
-        humidity = get_float_value('humidity', 0.0)
-        timestamp = get_int_value('timestamp', 0)
-        is_encrypted = get_bool_value('is_encrypted', False)
-        encrypted_data = get_str_value('encrypted_data', '')
-        
-        # Validate humidity range
-        if humidity < 0.0:
-            humidity = 0.0
-        if humidity > 100.0:
-            humidity = 100.0
-        
-        # Decrypt if encrypted
-        if is_encrypted and encrypted_data:
-            print(f"🔐 Received encrypted_data length: {len(encrypted_data)}")
-            print(f"🔐 First 50 chars: {encrypted_data[:50]}")
-            decrypted_json = decrypt_data(encrypted_data)
-            if decrypted_json:
-                try:
-                    decrypted_data = json.loads(decrypted_json)
-                    # Handle boolean or string values from JSON
-                    pir_motion_val = decrypted_data.get('pir_motion', pir_motion)
-                    if isinstance(pir_motion_val, bool):
-                        pir_motion = pir_motion_val
-                    else:
-                        pir_motion = str(pir_motion_val).lower() == 'true'
-                    
-                    flame_detected_val = decrypted_data.get('flame_detected', flame_detected)
-                    if isinstance(flame_detected_val, bool):
-                        flame_detected = flame_detected_val
-                    else:
-                        flame_detected = str(flame_detected_val).lower() == 'true'
-                    # Reed switch logic: When magnet is close (reed switch active) = door closed
-                    # When magnet is far (reed switch inactive) = door open
-                    # So we need to invert the value from the sensor
-                    door_open_raw = decrypted_data.get('door_open', door_open)
-                    if isinstance(door_open_raw, bool):
-                        door_open = not door_open_raw  # Invert: active (magnet close) = closed, inactive (magnet far) = open
-                    else:
-                        door_open_raw = str(door_open_raw).lower() == 'true'
-                        door_open = not door_open_raw
-                    air_quality = int(decrypted_data.get('air_quality', air_quality))
-                    sound_level = int(decrypted_data.get('sound_level', sound_level))
-                    light_level = int(decrypted_data.get('light_level', light_level))
-                    temperature = float(decrypted_data.get('temperature', temperature))
-                    humidity = float(decrypted_data.get('humidity', humidity))
-                    timestamp = int(decrypted_data.get('timestamp', timestamp))
-                    if humidity < 0.0:
-                        humidity = 0.0
-                    if humidity > 100.0:
-                        humidity = 100.0
-                    print(f"✅ Successfully decrypted sensor data")
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}")
-            else:
-                print("⚠️ Failed to decrypt data, using unencrypted values")
-        
-        # Store sensor data in database
-        # Use timezone-aware datetime
-        if timestamp > 0:
-            created_at_timestamp = datetime.fromtimestamp(timestamp, tz=timezone.utc).astimezone()
-        else:
-            created_at_timestamp = datetime.now(timezone.utc).astimezone()
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO sensor_data (pir_motion, flame_detected, door_open, air_quality, sound_level, 
-                                   light_level, temperature, humidity, timestamp, encrypted_data, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, 
-              temperature, humidity, timestamp, encrypted_data, created_at_timestamp))
-        conn.commit()
-        conn.close()
+class SideEffectQueue:
+    """Bounded worker pool for ingest side effects (event logging, notifications).
+    submit() blocks for up to submit_timeout when the queue is full (backpressure) and
+    then runs the job on the caller's thread rather than dropping it."""
+
+    def __init__(self, workers=2, max_depth=1000, submit_timeout=0.5):
+        self.workers = max(1, workers)
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=max(1, max_depth))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = True
+        self.stats_counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'ran_inline': 0, 'max_depth_seen': 0}
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'side-effects-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self, func, args):
+        try:
+            func(*args)
+            key = 'completed'
+        except Exception as e:
+            log.error("❌ Side effect %s failed: %s", getattr(func, '__name__', func), e)
+            key = 'failed'
+        with self._lock:
+            self.stats_counters[key] += 1
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._run(*item)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args):
+        if not self._accepting:
+            self._run(func, args)
+            return
+        if not self._threads:
+            self._start()
+        with self._lock:
+            self.stats_counters['submitted'] += 1
+        try:
+            self._queue.put((func, args), timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self.stats_counters['ran_inline'] += 1
+            self._run(func, args)
+            return
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self.stats_counters['max_depth_seen']:
+                self.stats_counters['max_depth_seen'] = depth
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counters)
+        stats['depth'] = self._queue.qsize()
+        stats['capacity'] = self._queue.maxsize
+        stats['workers'] = self.workers
+        return stats
+
+    def shutdown(self, timeout=30.0):
+        """Stop accepting work and drain what is already queued"""
+        self._accepting = False
+        if not self._threads:
+            return
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        remaining = self._queue.qsize()
+        if remaining:
+            log.warning("⚠️ Side-effect queue shut down with %d jobs not drained", remaining)
+
+side_effect_queue = SideEffectQueue(SIDE_EFFECT_WORKERS, SIDE_EFFECT_QUEUE_MAX, SIDE_EFFECT_SUBMIT_TIMEOUT)
+
+def run_deferred_side_effects(calls):
+    """Replay calls recorded with IngestTransaction.defer() in one transaction"""
+    with IngestTransaction() as tx:
+        for func, args, kwargs in calls:
+            func(*args, tx=tx, **kwargs)
+
+def run_ingest_pipeline(reading, defer_side_effects=None):
+    """Store one sensor reading and all of its consequences in a single transaction.
+    Inserts the sensor_data row, applies alerts/auto-controls and logs the per-sensor
+    events on one pooled connection, then commits once. If any step fails nothing is
+    written. Returns a summary of what was written.
+    With defer_side_effects (default: INGEST_ASYNC_SIDE_EFFECTS) only the reading and the
+    buzzer/light state are written before returning; sensor events, event log entries and
+    notifications follow on the side-effect queue."""
+    if defer_side_effects is None:
+        defer_side_effects = INGEST_ASYNC_SIDE_EFFECTS
+    with IngestTransaction(defer_side_effects=defer_side_effects) as tx:
+        with stage_tracer.span('insert'):
+            tx.cur.execute('''
+                INSERT INTO sensor_data (pir_motion, flame_detected, door_open, air_quality, sound_level, 
+                                       light_level, temperature, humidity, timestamp, encrypted_data, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (reading['pir_motion'], reading['flame_detected'], reading['door_open'], reading['air_quality'],
+                  reading['sound_level'], reading['light_level'], reading['temperature'], reading['humidity'],
+                  reading['timestamp'], reading['encrypted_data'], reading['created_at']))
+            tx.summary['sensor_data_id'] = tx.cur.fetchone()['id']
+        update_sensor_rollups(tx.cur, [reading])
+        tx.after_commit(latest_reading.update, {
+            'id': tx.summary['sensor_data_id'],
+            'pir_motion': reading['pir_motion'],
+            'flame_detected': reading['flame_detected'],
+            'door_open': reading['door_open'],
+            'air_quality': reading['air_quality'],
+            'sound_level': reading['sound_level'],
+            'light_level': reading['light_level'],
+            'temperature': reading['temperature'],
+            'humidity': reading['humidity'],
+            'timestamp': reading['timestamp'],
+            'created_at': reading['created_at']
+        })
         
         # Process all alerts and auto-controls (buzzer, lights, notifications) FIRST
         # This ensures actions are determined before logging sensor events
-        process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level)
+        process_alerts_and_controls(reading['pir_motion'], reading['flame_detected'], reading['door_open'],
+                                    reading['air_quality'], reading['sound_level'], reading['light_level'], tx=tx)
         
         # Log all sensors in real-time (shows all sensors with their current readings)
         # This is called AFTER processing alerts so actions reflect current system state
-        log_all_sensors(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, temperature, humidity)
-        
-        sensor_payload = {
-            "pir_motion": pir_motion,
-            "flame_detected": flame_detected,
-            "door_open": door_open,
-            "air_quality": air_quality,
-            "sound_level": sound_level,
-            "light_level": light_level,
-            "temperature": round(float(temperature), 2),
-            "humidity": round(float(humidity), 2),
-            "timestamp": timestamp,
-            "encrypted": is_encrypted
-        }
+        sensor_args = (reading['pir_motion'], reading['flame_detected'], reading['door_open'],
+                       reading['air_quality'], reading['sound_level'], reading['light_level'],
+                       reading['temperature'], reading['humidity'])
+        if tx.defer_side_effects:
+            # Replayed later on a worker: keep the reading's time and the control state it was judged against
+            tx.defer(log_all_sensors, *sensor_args, control=state_cache.get_system_control(tx), at=reading['created_at'])
+        else:
+            log_all_sensors(*sensor_args, tx=tx)
+    metrics.inc('smart_home_ingest_readings_total', ('single',))
+    return tx.summary
+
+def _as_utc(ts):
+    """Aware UTC datetime for a reading time (naive DB timestamps are stored in UTC)"""
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def run_ingest_batch(readings, defer_side_effects=None):
+    """Store several sensor readings and their consequences in a single transaction.
+    The readings are inserted with one multi-row INSERT and folded into the rollups together.
+    Alerts (event log, notifications) are evaluated for every reading in time order, but only
+    the newest reading drives the buzzer/light, and only if it is not older than the reading
+    already published. Sensor events are stamped with each reading's own time."""
+    if defer_side_effects is None:
+        defer_side_effects = INGEST_ASYNC_SIDE_EFFECTS
+    readings = sorted(readings, key=lambda reading: _as_utc(reading['created_at']))
+    current = latest_reading.get()
+    drive_actuators = current is None or current.get('created_at') is None \
+        or _as_utc(readings[-1]['created_at']) >= _as_utc(current['created_at'])
+    with IngestTransaction(defer_side_effects=defer_side_effects) as tx:
+        with stage_tracer.span('insert'):
+            ids = execute_values(tx.cur, '''
+                INSERT INTO sensor_data (pir_motion, flame_detected, door_open, air_quality, sound_level, 
+                                       light_level, temperature, humidity, timestamp, encrypted_data, created_at)
+                VALUES %s
+                RETURNING id
+            ''', [(reading['pir_motion'], reading['flame_detected'], reading['door_open'], reading['air_quality'],
+                   reading['sound_level'], reading['light_level'], reading['temperature'], reading['humidity'],
+                   reading['timestamp'], reading['encrypted_data'], reading['created_at']) for reading in readings],
+                page_size=len(readings), fetch=True)
+        tx.summary['readings'] = len(readings)
+        tx.summary['sensor_data_id'] = max(row['id'] for row in ids)
+        update_sensor_rollups(tx.cur, readings)
+        
+        newest = readings[-1]
+        for reading in readings:
+            process_alerts_and_controls(reading['pir_motion'], reading['flame_detected'], reading['door_open'],
+                                        reading['air_quality'], reading['sound_level'], reading['light_level'], tx=tx,
+                                        drive_actuators=drive_actuators and reading is newest)
+        if drive_actuators:
+            tx.after_commit(latest_reading.update, dict(
+                {key: newest[key] for key in ('pir_motion', 'flame_detected', 'door_open', 'air_quality',
+                                              'sound_level', 'light_level', 'temperature', 'humidity',
+                                              'timestamp', 'created_at')},
+                id=tx.summary['sensor_data_id']))
+        
+        if tx.defer_side_effects:
+            tx.defer(log_sensor_event_batch, readings)
+        else:
+            log_sensor_event_batch(readings, tx=tx)
+    metrics.inc('smart_home_ingest_readings_total', ('batch',), len(readings))
+    return tx.summary
+
+def parse_sensor_reading(data, decrypted_json=None):
+    """Normalize one uploaded reading (JSON object or form fields, plain or encrypted) into the
+    dict run_ingest_pipeline()/run_ingest_batch() store. Raises ValueError for malformed numbers and
+    for encrypted payloads that fail to decrypt or do not hold a JSON object.
+    encrypted_data is decrypted here unless the caller already did (decrypted_json); the optional
+    cipher field selects 'cbc' (default) or the authenticated 'gcm'."""
+    # Extract raw values (handle both JSON and form-urlencoded)
+    def get_bool_value(key, default=False):
+        val = data.get(key, default)
+        if isinstance(val, bool):
+            return val
+        return str(val).lower() == 'true'
+    
+    def get_int_value(key, default=0):
+        val = data.get(key, default)
+        if isinstance(val, int):
+            return val
+        return int(val) if val else default
+    
+    def get_float_value(key, default=0.0):
+        val = data.get(key, default)
+        if isinstance(val, (int, float)):
+            return float(val)
+        return float(val) if val else default
+    
+    def get_str_value(key, default=''):
+        val = data.get(key, default)
+        return str(val) if val else default
+    
+    pir_motion = get_bool_value('pir_motion', False)
+    flame_detected = get_bool_value('flame_detected', False)
+    # Reed switch logic: When magnet is close (reed switch active) = door closed
+    # When magnet is far (reed switch inactive) = door open
+    # So we need to invert the value from the sensor
+    door_open_raw = get_bool_value('door_open', False)
+    door_open = not door_open_raw  # Invert: active (magnet close) = closed, inactive (magnet far) = open
+    air_quality = get_int_value('air_quality', 0)
+    sound_level = get_int_value('sound_level', 0)
+    light_level = get_int_value('light_level', 0)
+    temperature = get_float_value('temperature', 0.0)
+    humidity = get_float_value('humidity', 0.0)
+    timestamp = get_int_value('timestamp', 0)
+    is_encrypted = get_bool_value('is_encrypted', False)
+    encrypted_data = get_str_value('encrypted_data', '')
+    
+    # Decrypt if encrypted
+    if is_encrypted and encrypted_data:
+        if decrypted_json is None:
+            decrypted_json = decrypt_data(encrypted_data, get_str_value('cipher', 'cbc'))
+        if decrypted_json:
+            try:
+                decrypted_data = json.loads(decrypted_json)
+                # Handle boolean or string values from JSON
+                pir_motion_val = decrypted_data.get('pir_motion', pir_motion)
+                if isinstance(pir_motion_val, bool):
+                    pir_motion = pir_motion_val
+                else:
+                    pir_motion = str(pir_motion_val).lower() == 'true'
+                
+                flame_detected_val = decrypted_data.get('flame_detected', flame_detected)
+                if isinstance(flame_detected_val, bool):
+                    flame_detected = flame_detected_val
+                else:
+                    flame_detected = str(flame_detected_val).lower() == 'true'
+                # Reed switch logic: When magnet is close (reed switch active) = door closed
+                # When magnet is far (reed switch inactive) = door open
+                # So we need to invert the value from the sensor
+                door_open_raw = decrypted_data.get('door_open', door_open)
+                if isinstance(door_open_raw, bool):
+                    door_open = not door_open_raw  # Invert: active (magnet close) = closed, inactive (magnet far) = open
+                else:
+                    door_open_raw = str(door_open_raw).lower() == 'true'
+                    door_open = not door_open_raw
+                air_quality = int(decrypted_data.get('air_quality', air_quality))
+                sound_level = int(decrypted_data.get('sound_level', sound_level))
+                light_level = int(decrypted_data.get('light_level', light_level))
+                temperature = float(decrypted_data.get('temperature', temperature))
+                humidity = float(decrypted_data.get('humidity', humidity))
+                timestamp = int(decrypted_data.get('timestamp', timestamp))
+            except json.JSONDecodeError as e:
+                raise ValueError(f'decrypted payload is not valid JSON: {e}') from e
+            except AttributeError as e:
+                raise ValueError('decrypted payload must be a JSON object') from e
+        else:
+            # An encrypted upload carries no plaintext fields, so the defaults would be stored (door open)
+            raise ValueError('decryption failed')
+    
+    # Validate humidity range
+    humidity = min(max(humidity, 0.0), 100.0)
+    
+    return {
+        'pir_motion': pir_motion,
+        'flame_detected': flame_detected,
+        'door_open': door_open,
+        'air_quality': air_quality,
+        'sound_level': sound_level,
+        'light_level': light_level,
+        'temperature': temperature,
+        'humidity': humidity,
+        'timestamp': timestamp,
+        'encrypted_data': encrypted_data,
+        'is_encrypted': is_encrypted,
+        'created_at': reading_created_at(timestamp)
+    }
+
+def reading_created_at(timestamp):
+    """Reading time for a board timestamp (unix seconds, 0 = unknown -> now), timezone-aware"""
+    if timestamp > 0:
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc).astimezone()
+    return datetime.now(timezone.utc).astimezone()
+
+def encode_sensor_records(readings, cipher=None, iv=None):
+    """Reference encoder for the binary upload format (SENSOR_RECORD).
+    readings are dicts with the JSON upload fields; door_open is the raw reed switch value
+    as the board reports it. cipher='cbc' encrypts the records with AES-128-CBC/PKCS7 behind
+    the 16-byte IV, cipher='gcm' with AES-GCM as nonce + ciphertext + tag (iv: random unless given)."""
+    body = bytearray()
+    for reading in readings:
+        flags = ((1 if reading.get('pir_motion') else 0)
+                 | (2 if reading.get('flame_detected') else 0)
+                 | (4 if reading.get('door_open') else 0))
+        body += SENSOR_RECORD.pack(SENSOR_RECORD_VERSION, flags,
+                                   int(reading.get('air_quality', 0)), int(reading.get('sound_level', 0)),
+                                   int(reading.get('light_level', 0)),
+                                   int(round(float(reading.get('temperature', 0.0)) * 100)),
+                                   int(round(float(reading.get('humidity', 0.0)) * 100)),
+                                   int(reading.get('timestamp', 0)))
+    if cipher == 'gcm':
+        nonce = iv or os.urandom(SensorDecryptor.GCM_NONCE_SIZE)
+        ciphertext, tag = AES.new(ENCRYPTION_KEY, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(bytes(body))
+        return nonce + ciphertext + tag
+    if cipher == 'cbc':
+        iv = iv or os.urandom(16)
+        return iv + AES.new(ENCRYPTION_KEY, AES.MODE_CBC, iv).encrypt(pad(bytes(body), BLOCK_SIZE))
+    return bytes(body)
+
+def decode_sensor_records(body, cipher=None):
+    """Readings (as returned by parse_sensor_reading) from a binary upload of one or more
+    SENSOR_RECORDs, optionally encrypted (cipher 'cbc' or 'gcm'). Raises ValueError for a malformed body."""
+    view = memoryview(body)
+    if cipher == 'gcm':
+        with stage_tracer.span('decrypt'):
+            plain = sensor_decryptor.decrypt_gcm(view)
+        if plain is None:
+            raise ValueError('encrypted sensor payload failed authentication')
+        view = memoryview(plain)
+    elif cipher == 'cbc':
+        with stage_tracer.span('decrypt'):
+            plain = sensor_decryptor.decrypt_cbc(view, strict=True)
+        if plain is None:
+            raise ValueError('encrypted sensor payload must be a 16-byte IV plus PKCS7-padded AES blocks')
+        view = memoryview(plain)
+    if not len(view) or len(view) % SENSOR_RECORD.size:
+        raise ValueError(f'sensor payload must be a multiple of {SENSOR_RECORD.size} bytes')
+    readings = []
+    for version, flags, air_quality, sound_level, light_level, temperature, humidity, timestamp \
+            in SENSOR_RECORD.iter_unpack(view):
+        if version != SENSOR_RECORD_VERSION:
+            raise ValueError(f'unsupported sensor record version {version}')
+        readings.append({
+            'pir_motion': bool(flags & 1),
+            'flame_detected': bool(flags & 2),
+            'door_open': not flags & 4,  # reed switch active (magnet close) = door closed
+            'air_quality': air_quality,
+            'sound_level': sound_level,
+            'light_level': light_level,
+            'temperature': temperature / 100,
+            'humidity': min(humidity / 100, 100.0),
+            'timestamp': timestamp,
+            'encrypted_data': '',
+            'is_encrypted': cipher is not None,
+            'created_at': reading_created_at(timestamp)
+        })
+    return readings
+
+# API Routes for ESP32 Sensor Board
+@app.route('/api/sensor-data', methods=['POST'])
+def receive_sensor_data():
+    """Receive sensor data from ESP32 Board 1"""
+    try:
+        # Binary records (plain or encrypted), JSON (for encrypted data) or form-urlencoded (for unencrypted data)
+        with stage_tracer.span('parse'):
+            if request.mimetype in SENSOR_BINARY_CONTENT_TYPES:
+                try:
+                    readings = decode_sensor_records(request.get_data(), SENSOR_BINARY_CONTENT_TYPES[request.mimetype])
+                except ValueError as e:
+                    return jsonify({'status': 'error', 'message': str(e)}), 400
+                if len(readings) != 1:
+                    return jsonify({'status': 'error',
+                                    'message': 'Expected one record, use /api/sensor-data/batch for several'}), 400
+                reading = readings[0]
+            else:
+                data = request.get_json() if request.is_json else request.form
+                try:
+                    reading = parse_sensor_reading(data)
+                except ValueError as e:
+                    return jsonify({'status': 'error', 'message': str(e)}), 400
+        pir_motion, flame_detected, door_open = reading['pir_motion'], reading['flame_detected'], reading['door_open']
+        air_quality, sound_level, light_level = reading['air_quality'], reading['sound_level'], reading['light_level']
+        temperature, humidity, timestamp = reading['temperature'], reading['humidity'], reading['timestamp']
+        is_encrypted = reading['is_encrypted']
+        
+        # Sensor row, alerts/auto-controls and sensor events are written in one transaction
+        ingest_summary = run_ingest_pipeline(reading)
+        
+        if log.isEnabledFor(logging.DEBUG):
+            sensor_payload = {
+                "pir_motion": pir_motion,
+                "flame_detected": flame_detected,
+                "door_open": door_open,
+                "air_quality": air_quality,
+                "sound_level": sound_level,
+                "light_level": light_level,
+                "temperature": round(float(temperature), 2),
+                "humidity": round(float(humidity), 2),
+                "timestamp": timestamp,
+                "encrypted": is_encrypted
+            }
+            log.debug("📊 SENSOR DATA RECEIVED (ESP32 Board 1): %s", json.dumps(sensor_payload))
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Data received and stored',
+            'timestamp': timestamp,
+            'written': ingest_summary
+        })
+        
+    except Exception as e:
+        log.error("❌ Error receiving sensor data: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/sensor-data/batch', methods=['POST'])
+def receive_sensor_data_batch():
+    """Receive several buffered readings from ESP32 Board 1 (or a replay/load tool) at once.
+    Body: {"readings": [...]} (or a bare JSON array), each item in the /api/sensor-data JSON format,
+    plain or encrypted, or concatenated binary records (SENSOR_BINARY_CONTENT_TYPE, optionally encrypted
+    as a whole). Malformed JSON items are skipped and reported in 'rejected'."""
+    try:
+        if request.mimetype in SENSOR_BINARY_CONTENT_TYPES:
+            try:
+                with stage_tracer.span('parse'):
+                    readings = decode_sensor_records(request.get_data(), SENSOR_BINARY_CONTENT_TYPES[request.mimetype])
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+            if len(readings) > SENSOR_BATCH_MAX_READINGS:
+                return jsonify({'status': 'error',
+                                'message': f'At most {SENSOR_BATCH_MAX_READINGS} readings per batch'}), 413
+            ingest_summary = run_ingest_batch(readings)
+            log.info("📊 SENSOR DATA BATCH RECEIVED (ESP32 Board 1, binary): %d stored", len(readings))
+            return jsonify({
+                'status': 'success',
+                'message': 'Data received and stored',
+                'received': len(readings),
+                'stored': len(readings),
+                'rejected': [],
+                'written': ingest_summary
+            })
         
-        current_time = datetime.now(timezone.utc)
-        print(f"📊 SENSOR DATA RECEIVED (ESP32 Board 1) at {current_time.isoformat()}")
-        print(json.dumps(sensor_payload, indent=2))
-        # Debug: Print flame sensor value specifically
-        print(f"🔥 FLAME SENSOR DEBUG: flame_detected={flame_detected} (type: {type(flame_detected)})")
+        data = request.get_json(silent=True)
+        items = data.get('readings') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'status': 'error', 'message': 'Expected a non-empty JSON array of readings'}), 400
+        if len(items) > SENSOR_BATCH_MAX_READINGS:
+            return jsonify({'status': 'error',
+                            'message': f'At most {SENSOR_BATCH_MAX_READINGS} readings per batch'}), 413
+        
+        # Decrypt all CBC-encrypted items in one pass; a bad payload rejects only its own item
+        encrypted, malformed = [], {}
+        for index, item in enumerate(items):
+            if not (isinstance(item, dict) and str(item.get('is_encrypted')).lower() == 'true' and item.get('encrypted_data')):
+                continue
+            if not isinstance(item['encrypted_data'], str):
+                malformed[index] = 'encrypted_data must be a base64 string'
+            elif item.get('cipher', 'cbc') == 'cbc':
+                encrypted.append(index)
+        with stage_tracer.span('decrypt'):
+            results = sensor_decryptor.decrypt_many([items[index]['encrypted_data'] for index in encrypted])
+        decrypted = {}
+        for index, result in zip(encrypted, results):
+            if result is None:
+                malformed[index] = 'decryption failed'
+            else:
+                decrypted[index] = result
         
-        # Debug: Log that we're about to log sensor events
-        print(f"🔄 About to log sensor events for all sensors...")
+        readings, rejected = [], []
+        with stage_tracer.span('parse'):
+            for index, item in enumerate(items):
+                try:
+                    if not isinstance(item, dict):
+                        raise ValueError('reading must be a JSON object')
+                    if index in malformed:
+                        raise ValueError(malformed[index])
+                    readings.append(parse_sensor_reading(item, decrypted.get(index)))
+                except (ValueError, TypeError) as e:
+                    rejected.append({'index': index, 'error': str(e)})
+        if not readings:
+            return jsonify({'status': 'error', 'message': 'No valid readings', 'rejected': rejected}), 400
+        
+        ingest_summary = run_ingest_batch(readings)
+        log.info("📊 SENSOR DATA BATCH RECEIVED (ESP32 Board 1): %d stored, %d rejected", len(readings), len(rejected))
         
         return jsonify({
             'status': 'success',
             'message': 'Data received and stored',
-            'timestamp': timestamp
+            'received': len(items),
+            'stored': len(readings),
+            'rejected': rejected,
+            'written': ingest_summary
         })
-        
     except Exception as e:
-        print(f"❌ Error receiving sensor data: {e}")
+        log.error("❌ Error receiving sensor data batch: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -733,11 +2561,7 @@ def receive_sensor_data():
 def get_sensor_board_commands():
     """Get control commands for ESP32 Board 1 (Sensor Board) - Called by ESP32"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM sensor_board_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
+        control = state_cache.get_sensor_board_control()
         
         if control:
             encryption_value = control.get('encryption_enabled', True)
@@ -746,7 +2570,7 @@ def get_sensor_board_commands():
                 encryption_value = encryption_value.lower() in ('true', '1', 'yes', 'on', 't')
             else:
                 encryption_value = bool(encryption_value)
-            print(f"📡 Sensor board polling: returning encryption_enabled={encryption_value}")
+            log.debug("📡 Sensor board polling: returning encryption_enabled=%s", encryption_value)
             return jsonify({
                 'monitoring': control['monitoring'],
                 'encryption_enabled': encryption_value,
@@ -765,7 +2589,7 @@ def get_sensor_board_commands():
                 'server_url': ''
             })
     except Exception as e:
-        print(f"❌ Error getting sensor board commands: {e}")
+        log.error("❌ Error getting sensor board commands: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/sensor-board/status', methods=['POST'])
@@ -777,26 +2601,21 @@ def update_sensor_board_status():
         monitoring_state = data.get('monitoring', False)
         encryption_state = data.get('encryption_enabled', True)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
         # Update status but don't overwrite commands from dashboard
         # Only update if ESP32 reports different state (for sync)
-        cur.execute('SELECT monitoring, encryption_enabled FROM sensor_board_control WHERE id = 1')
-        current = cur.fetchone()
+        current = state_cache.get_sensor_board_control()
         if current:
             # Only update if there's a mismatch (ESP32 might be out of sync)
-            if current[0] != monitoring_state or current[1] != encryption_state:
-                cur.execute('''
+            if current['monitoring'] != monitoring_state or current['encryption_enabled'] != encryption_state:
+                update_sensor_board_control('''
                     UPDATE sensor_board_control 
-                    SET monitoring = %s, encryption_enabled = %s, updated_at = CURRENT_TIMESTAMP
+                    SET version = version + 1, monitoring = %s, encryption_enabled = %s, updated_at = CURRENT_TIMESTAMP
                     WHERE id = 1
                 ''', (monitoring_state, encryption_state))
-                conn.commit()
-        conn.close()
         
         return jsonify({'status': 'success'})
     except Exception as e:
-        print(f"❌ Error updating sensor board status: {e}")
+        log.error("❌ Error updating sensor board status: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/sensor-board/monitoring', methods=['PUT'])
@@ -807,15 +2626,11 @@ def control_sensor_monitoring():
         data = request.get_json()
         monitoring = data.get('monitoring', data.get('state', False))
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_sensor_board_control('''
             UPDATE sensor_board_control 
-            SET monitoring = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, monitoring = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (monitoring,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'📊 Sensor monitoring {"STARTED" if monitoring else "STOPPED"} (manual)')
         
@@ -842,27 +2657,21 @@ def control_sensor_encryption():
         else:
             encryption_enabled = bool(encryption_enabled)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        updated = update_sensor_board_control('''
             UPDATE sensor_board_control 
-            SET encryption_enabled = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, encryption_enabled = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (encryption_enabled,))
         
-        if cur.rowcount == 0:
+        if updated == 0:
             # Row doesn't exist, create it
-            cur.execute('''
+            update_sensor_board_control('''
                 INSERT INTO sensor_board_control (id, encryption_enabled, updated_at)
                 VALUES (1, %s, CURRENT_TIMESTAMP)
             ''', (encryption_enabled,))
         
-        conn.commit()
-        conn.close()
-        
         log_event('CONTROL', f'🔐 Encryption {"ENABLED" if encryption_enabled else "DISABLED"} (manual)')
-        print(f"🔐 Encryption setting updated in database: {encryption_enabled}")
-        print(f"🔐 Sensor board will pick up this change on next poll (every 3 seconds)")
+        log.info("🔐 Encryption setting updated in database: %s (sensor board picks it up on its next poll)", encryption_enabled)
         
         return jsonify({
             'status': 'ok',
@@ -870,9 +2679,7 @@ def control_sensor_encryption():
             'message': f'Encryption {"enabled" if encryption_enabled else "disabled"} successfully'
         })
     except Exception as e:
-        print(f"❌ Error toggling encryption: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error toggling encryption: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/sensor-board/wifi', methods=['PUT'])
@@ -885,15 +2692,11 @@ def update_sensor_wifi():
         wifi_password = data.get('password', '')
         server_url = data.get('server_url', '')
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_sensor_board_control('''
             UPDATE sensor_board_control 
-            SET wifi_ssid = %s, wifi_password = %s, server_url = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, wifi_ssid = %s, wifi_password = %s, server_url = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (wifi_ssid, wifi_password, server_url))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'📡 WiFi settings updated for Sensor Board')
         
@@ -901,33 +2704,33 @@ def update_sensor_wifi():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_sensor_board_info():
+    """Sensor Board status and configuration shown on the dashboard"""
+    control = state_cache.get_sensor_board_control()
+    
+    if control:
+        return {
+            'monitoring': control['monitoring'],
+            'encryption_enabled': control['encryption_enabled'],
+            'upload_interval': control['upload_interval'],
+            'wifi_ssid': control.get('wifi_ssid', ''),
+            'server_url': control.get('server_url', '')
+        }
+    else:
+        return {
+            'monitoring': False,
+            'encryption_enabled': True,
+            'upload_interval': 2000,
+            'wifi_ssid': '',
+            'server_url': ''
+        }
+
 @app.route('/api/sensor-board/info', methods=['GET'])
 @login_required
 def get_sensor_board_info():
     """Get current Sensor Board status and configuration"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM sensor_board_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
-        
-        if control:
-            return jsonify({
-                'monitoring': control['monitoring'],
-                'encryption_enabled': control['encryption_enabled'],
-                'upload_interval': control['upload_interval'],
-                'wifi_ssid': control.get('wifi_ssid', ''),
-                'server_url': control.get('server_url', '')
-            })
-        else:
-            return jsonify({
-                'monitoring': False,
-                'encryption_enabled': True,
-                'upload_interval': 2000,
-                'wifi_ssid': '',
-                'server_url': ''
-            })
+        return jsonify(build_sensor_board_info())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -940,15 +2743,11 @@ def set_upload_interval():
         upload_interval = int(data.get('upload_interval', data.get('interval', 2000)))
         upload_interval = max(1000, min(10000, upload_interval))  # Clamp to 1000-10000ms
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_sensor_board_control('''
             UPDATE sensor_board_control 
-            SET upload_interval = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, upload_interval = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (upload_interval,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'📊 Upload interval set to {upload_interval} ms')
         
@@ -956,238 +2755,318 @@ def set_upload_interval():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Buzzer/light auto-off timers
+CONTROL_TIMER_RECHECK_INTERVAL = float(os.getenv('CONTROL_TIMER_RECHECK_INTERVAL', '2'))  # seconds between re-checks of a held buzzer
+
+class TimerScheduler:
+    """Min-heap of deadlines served by one lazily started thread.
+    Timers are keyed: arming a key again replaces its pending timer, and each timer fires at most once."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []  # (deadline, seq, key)
+        self._timers = {}  # key -> (seq, token, func, args)
+        self._seq = 0
+        self._thread = None
+        self._stopping = False
+        self.fired = 0
+        self.errors = 0
+
+    def schedule(self, key, delay, func, *args, token=None):
+        """Run func(*args) after delay seconds. With token, re-arming an identical token is a no-op."""
+        with self._cond:
+            current = self._timers.get(key)
+            if token is not None and current is not None and current[1] == token:
+                return
+            self._seq += 1
+            self._timers[key] = (self._seq, token, func, args)
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), self._seq, key))
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='timer-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            self._timers.pop(key, None)
+
+    def pending(self):
+        """{key: seconds until it fires}"""
+        now = time.monotonic()
+        with self._cond:
+            live = {seq: key for key, (seq, _, _, _) in self._timers.items()}
+            return {live[seq]: round(max(0.0, deadline - now), 3) for deadline, seq, _ in self._heap if seq in live}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    # Drop cancelled or replaced entries
+                    while self._heap and self._timers.get(self._heap[0][2], (None,))[0] != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, _, key = heapq.heappop(self._heap)
+                _, _, func, args = self._timers.pop(key)
+            try:
+                func(*args)
+                self.fired += 1
+            except Exception as e:
+                self.errors += 1
+                log.error("❌ Timer '%s' failed: %s", key, e)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._timers.clear()
+            self._heap = []
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+timer_scheduler = TimerScheduler()
+
+def _seconds_since(ts):
+    """Seconds elapsed since a DB timestamp (TIMESTAMP columns are stored in UTC)"""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - ts).total_seconds()
+
+def sync_control_timers(control):
+    """Arm or cancel the buzzer/light auto-off timers to match a committed system_control row.
+    Called by state_cache on every system_control write, so a deadline exists exactly when
+    buzzer_activated_at/light_activated_at is set (and manual mode is off)."""
+    if not control:
+        return
+    manual = control.get('manual_mode', False)
+    OTHER_SENSORS_TIMEOUT = alert_rules.current().other_sensors_timeout
+    
+    buzzer_at = control.get('buzzer_activated_at')
+    if control.get('buzzer_on', False) and buzzer_at and not manual:
+        timer_scheduler.schedule('buzzer', OTHER_SENSORS_TIMEOUT - _seconds_since(buzzer_at),
+                                 buzzer_timeout_expired, buzzer_at, token=buzzer_at)
+    else:
+        timer_scheduler.cancel('buzzer')
+    
+    # The light is first checked at the short timeout; a motion light re-arms itself to 60s
+    light_at = control.get('light_activated_at')
+    if control.get('light_on', False) and light_at and not manual:
+        timer_scheduler.schedule('light', OTHER_SENSORS_TIMEOUT - _seconds_since(light_at),
+                                 light_timeout_expired, light_at, token=light_at)
+    else:
+        timer_scheduler.cancel('light')
+
+def buzzer_timeout_expired(activated_at):
+    """Buzzer deadline reached: turn it off unless it is being held on.
+    The UPDATE is conditional on the same activation, so it takes effect at most once."""
+    control = state_cache.get_system_control()
+    if (not control or not control.get('buzzer_on', False) or control.get('manual_mode', False)
+            or control.get('buzzer_activated_at') != activated_at):
+        return  # Superseded by a newer write
+    
+    OTHER_SENSORS_TIMEOUT = alert_rules.current().other_sensors_timeout  # motion buzzer uses the same timeout
+    time_elapsed = _seconds_since(activated_at)
+    if time_elapsed < OTHER_SENSORS_TIMEOUT:
+        # App clock behind the DB clock - try again at the real deadline
+        timer_scheduler.schedule('buzzer', OTHER_SENSORS_TIMEOUT - time_elapsed, buzzer_timeout_expired, activated_at,
+                                 token=activated_at)
+        return
+    
+    # Latest sensor data determines if this was motion-triggered
+    sensor_result = latest_reading.get()
+    door_closed = True  # Default to closed if no data
+    motion_active = False  # Default to no motion
+    if sensor_result:
+        door_closed = not sensor_result.get('door_open', False)  # door_open is inverted, so not door_open = door closed
+        motion_active = sensor_result.get('pir_motion', False)
+    
+    manual_off = control.get('buzzer_manual_off', False)
+    log.debug("🔔 Buzzer timeout: elapsed=%.1fs, timeout=%ss, manual_off=%s, door_closed=%s, motion_active=%s",
+              time_elapsed, OTHER_SENSORS_TIMEOUT, manual_off, door_closed, motion_active)
+    
+    if motion_active and not door_closed:
+        # Motion buzzer always turns off after timeout, even if manual_off is True
+        reason = 'Motion timeout'
+        clear_manual_off = True
+    elif manual_off and door_closed:
+        # User manually turned off buzzer but door closed - clear manual_off and turn off
+        reason = 'Door closed, timeout'
+        clear_manual_off = True
+    elif manual_off:
+        log.debug("⏳ Buzzer timeout passed but manual_off=True and door still open, keeping ON")
+        timer_scheduler.schedule('buzzer', CONTROL_TIMER_RECHECK_INTERVAL, buzzer_timeout_expired, activated_at,
+                                 token=activated_at)
+        return
+    else:
+        reason = 'Timeout'
+        clear_manual_off = False
+    
+    rowcount = update_system_control(f'''
+        UPDATE system_control 
+        SET version = version + 1, buzzer_on = FALSE, buzzer_activated_at = NULL,{' buzzer_manual_off = FALSE,' if clear_manual_off else ''} updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1 AND buzzer_on = TRUE AND buzzer_activated_at = %s
+    ''', (activated_at,))
+    if rowcount:
+        log.info("✅ Buzzer turned OFF in database - %s: %ss elapsed", reason, OTHER_SENSORS_TIMEOUT)
+        log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - {reason}: {OTHER_SENSORS_TIMEOUT}s elapsed')
+
+def light_timeout_expired(activated_at):
+    """Light deadline reached: turn it off, or re-arm to the full motion timeout if motion triggered it.
+    The UPDATE is conditional on the same activation, so it takes effect at most once."""
+    control = state_cache.get_system_control()
+    if (not control or not control.get('light_on', False) or control.get('manual_mode', False)
+            or control.get('light_activated_at') != activated_at):
+        return  # Superseded by a newer write
+    
+    time_elapsed = _seconds_since(activated_at)
+    rules = alert_rules.current()
+    MOTION_LIGHT_TIMEOUT = rules.motion_light_timeout
+    OTHER_SENSORS_TIMEOUT = rules.other_sensors_timeout
+    
+    # Determine if it's a motion light: once motion triggers the light it gets the full 60s,
+    # unless a CRITICAL sensor (fire/gas/loud noise) is active. An open door does not shorten it.
+    is_motion_light = False
+    latest_sensor = latest_reading.get()
+    if latest_sensor:
+        if latest_sensor.get('pir_motion', False):
+            is_motion_light = True
+        elif time_elapsed < MOTION_LIGHT_TIMEOUT:
+            is_motion_light = not rules.decide(False, latest_sensor.get('flame_detected', False), False,
+                                               latest_sensor.get('air_quality'), latest_sensor.get('sound_level'),
+                                               latest_sensor.get('light_level'), control).hazard
+    
+    check_timeout = MOTION_LIGHT_TIMEOUT if is_motion_light else OTHER_SENSORS_TIMEOUT
+    log.debug("💡 Light timeout: elapsed=%.1fs, timeout=%ss, is_motion=%s", time_elapsed, check_timeout, is_motion_light)
+    
+    if time_elapsed < check_timeout:
+        timer_scheduler.schedule('light', check_timeout - time_elapsed, light_timeout_expired, activated_at,
+                                 token=activated_at)
+        return
+    
+    rowcount = update_system_control('''
+        UPDATE system_control 
+        SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1 AND light_on = TRUE AND light_activated_at = %s
+    ''', (activated_at,))
+    if rowcount:
+        log.info("✅ Light turned OFF in database - Timeout: %ss elapsed", check_timeout)
+        log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {check_timeout}s elapsed')
+
+state_cache.subscribe(sync_control_timers)
+
 # API Routes for ESP32 Control Board (Board 2)
-def check_timeouts():
-    """Check if buzzer/light timeouts have passed and turn them off if needed.
-    This is called on every ESP32 poll to ensure timeouts are checked even when no sensor data is received."""
-    try:
-        MOTION_BUZZER_TIMEOUT = 10   # seconds
-        MOTION_LIGHT_TIMEOUT = 60    # seconds
-        OTHER_SENSORS_TIMEOUT = 10   # seconds
-        
-        # Use UTC for all time comparisons to avoid timezone issues
-        now = datetime.now(timezone.utc)
-        
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        
+# Control board command document (conditional GET / long-poll)
+CONTROL_LONGPOLL_MAX_WAIT = float(os.getenv('CONTROL_LONGPOLL_MAX_WAIT', '30'))  # cap on ?wait= seconds
+
+class CommandDocument:
+    """The command set served to the control board, versioned by a hash of its content.
+    Rebuilt whenever system_control is written; waiters blocked in a long-poll are woken
+    only when the document actually changes."""
+
+    DEFAULT = {
+        'light_on': False,
+        'buzzer_on': False,
+        'manual_mode': False,
+        'brightness_level': 100,
+        'home_mode': True
+    }
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._doc = None
+        self._etag = None
+        self.changes = 0
+        self.waiting = 0
+
+    @staticmethod
+    def build(control):
         if not control:
-            conn.close()
-            return
-        
-        # Check buzzer timeout using PostgreSQL's time functions to avoid timezone issues
-        # Both motion and other sensors use 10s timeout for buzzer
-        if control.get('buzzer_on', False) and control.get('buzzer_activated_at') and not control.get('manual_mode', False):
-            # Use SQL to calculate elapsed time directly (avoids timezone issues)
-            cur.execute('''
-                SELECT EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - buzzer_activated_at)) as elapsed_seconds
-                FROM system_control 
-                WHERE id = 1 AND buzzer_on = TRUE AND buzzer_activated_at IS NOT NULL
-            ''')
-            result = cur.fetchone()
-            if result and result['elapsed_seconds'] is not None:
-                time_elapsed = result['elapsed_seconds']
-                
-                # Get latest sensor data to determine if this was motion-triggered
-                cur.execute('''
-                    SELECT pir_motion, door_open FROM sensor_data 
-                    ORDER BY created_at DESC 
-                    LIMIT 1
-                ''')
-                sensor_result = cur.fetchone()
-                door_closed = True  # Default to closed if no data
-                motion_active = False  # Default to no motion
-                if sensor_result:
-                    # sensor_result is a dict from RealDictCursor, access by column name
-                    door_open_value = sensor_result.get('door_open', False)
-                    door_closed = not door_open_value  # door_open is inverted, so not door_open = door closed
-                    motion_active = sensor_result.get('pir_motion', False)
-                
-                manual_off = control.get('buzzer_manual_off', False)
-                print(f"🔔 Buzzer timeout check: elapsed={time_elapsed:.1f}s, timeout={OTHER_SENSORS_TIMEOUT}s, manual_off={manual_off}, door_closed={door_closed}, motion_active={motion_active}")
-                
-                # Buzzer timeout is 10s for both motion and other sensors
-                if time_elapsed >= OTHER_SENSORS_TIMEOUT:
-                    # For motion-triggered buzzer: always turn off after timeout, even if manual_off is True
-                    # This ensures motion buzzer respects the 10s timeout regardless of manual_off flag
-                    if motion_active and not door_closed:
-                        # Motion is active and door is open - this is likely a motion buzzer
-                        # Turn off after timeout even if manual_off is True
-                        print(f"🏃 Motion buzzer timeout reached - turning OFF (ignoring manual_off for motion timeout)")
-                        cur.execute('''
-                            UPDATE system_control 
-                            SET buzzer_on = FALSE, buzzer_activated_at = NULL, buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
-                            WHERE id = 1
-                        ''')
-                        conn.commit()
-                        print(f"✅ Buzzer turned OFF in database - Motion timeout: {OTHER_SENSORS_TIMEOUT}s elapsed")
-                        log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - Motion timeout: {OTHER_SENSORS_TIMEOUT}s elapsed')
-                    # If door is closed and timeout passed, turn off buzzer even if manual_off is True
-                    # This handles case where user manually turned off buzzer but door closed
-                    elif manual_off and door_closed:
-                        print(f"🚪 Door closed and timeout passed - clearing manual_off and turning OFF buzzer")
-                        cur.execute('''
-                            UPDATE system_control 
-                            SET buzzer_on = FALSE, buzzer_activated_at = NULL, buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
-                            WHERE id = 1
-                        ''')
-                        conn.commit()
-                        print(f"✅ Buzzer turned OFF in database - Door closed, timeout: {OTHER_SENSORS_TIMEOUT}s elapsed")
-                        log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - Door closed, timeout: {OTHER_SENSORS_TIMEOUT}s elapsed')
-                    elif manual_off:
-                        print(f"⏳ Buzzer timeout passed ({time_elapsed:.1f}s >= {OTHER_SENSORS_TIMEOUT}s) but manual_off=True and door still open, keeping ON")
-                    else:
-                        print(f"⏰ Buzzer timeout reached! Turning OFF...")
-                        cur.execute('''
-                            UPDATE system_control 
-                            SET buzzer_on = FALSE, buzzer_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
-                            WHERE id = 1
-                        ''')
-                        conn.commit()
-                        print(f"✅ Buzzer turned OFF in database - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed")
-                        log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed')
-                else:
-                    print(f"⏳ Buzzer still within timeout: {time_elapsed:.1f}s < {OTHER_SENSORS_TIMEOUT}s")
-        
-        # Check light timeout using PostgreSQL's time functions to avoid timezone issues
-        # Motion: 60s, Other sensors: 10s
-        # To properly determine if it's motion, check the latest sensor data
-        if control.get('light_on', False) and control.get('light_activated_at') and not control.get('manual_mode', False):
-            # Use SQL to calculate elapsed time directly (avoids timezone issues)
-            cur.execute('''
-                SELECT EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - light_activated_at)) as elapsed_seconds
-                FROM system_control 
-                WHERE id = 1 AND light_on = TRUE AND light_activated_at IS NOT NULL
-            ''')
-            result = cur.fetchone()
-            if result and result['elapsed_seconds'] is not None:
-                time_elapsed = result['elapsed_seconds']
-                
-                # Get latest sensor data to determine if motion triggered the light
-                cur.execute('''
-                    SELECT pir_motion, flame_detected, door_open, air_quality, sound_level
-                    FROM sensor_data 
-                    ORDER BY created_at DESC 
-                    LIMIT 1
-                ''')
-                latest_sensor = cur.fetchone()
-                
-                # Determine if it's motion light:
-                # IMPORTANT: We need to determine if motion was the original trigger, not just if it's currently active
-                # Strategy: If elapsed < 60s AND no other sensor is currently active, assume it's motion (60s timeout)
-                # If fire/door/air quality/sound is currently active, it's NOT a motion light (use 10s timeout)
-                is_motion_light = False
-                if latest_sensor:
-                    pir_motion = latest_sensor.get('pir_motion', False) or False
-                    flame_detected = latest_sensor.get('flame_detected', False) or False
-                    door_open = latest_sensor.get('door_open', False) or False
-                    air_quality = int(latest_sensor.get('air_quality', 0) or 0)
-                    sound_level = int(latest_sensor.get('sound_level', 0) or 0)
-                    
-                    AIR_QUALITY_THRESHOLD = 2000
-                    SOUND_THRESHOLD = 2000
-                    
-                    # Check if other sensors are currently active (excluding motion)
-                    other_sensor_active = (door_open or flame_detected or 
-                                          air_quality > AIR_QUALITY_THRESHOLD or 
-                                          sound_level > SOUND_THRESHOLD)
-                    
-                    # KEY PRINCIPLE: Once motion triggers the light, it gets the FULL 60s timeout
-                    # Even if motion stops and other sensors (like door) are active, we maintain the 60s timeout
-                    # This prevents premature light shutoff when motion stops but door is still open
-                    
-                    # Strategy: Check if we're within 60s window first
-                    # If we are within 60s AND no CRITICAL sensor (fire/gas/loud noise) is active,
-                    # assume it was motion-triggered and use 60s timeout
-                    # Only doors don't override motion's 60s timeout
-                    
-                    if pir_motion:
-                        # Motion is currently active → definitely motion light (60s timeout)
-                        is_motion_light = True
-                    elif time_elapsed < MOTION_LIGHT_TIMEOUT:
-                        # We're within the 60s motion window
-                        # Only CRITICAL sensors (fire/gas/loud noise) override motion timeout
-                        # Door being open doesn't change motion's 60s timeout
-                        critical_sensor_active = (flame_detected or 
-                                                air_quality > AIR_QUALITY_THRESHOLD or 
-                                                sound_level > SOUND_THRESHOLD)
-                        
-                        if critical_sensor_active:
-                            # Critical sensor is currently active → likely the trigger, use 10s timeout
-                            is_motion_light = False
-                        else:
-                            # No critical sensor active, and we're within 60s window
-                            # Assume motion triggered it, maintain 60s timeout
-                            # Door being open doesn't affect this
-                            is_motion_light = True
-                    else:
-                        # Beyond 60s window → definitely not motion anymore
-                        is_motion_light = False
-                
-                # Determine timeout based on whether it's motion or other sensors
-                if is_motion_light:
-                    check_timeout = MOTION_LIGHT_TIMEOUT  # 60s for motion
-                else:
-                    check_timeout = OTHER_SENSORS_TIMEOUT  # 10s for other sensors
-                
-                print(f"💡 Light timeout check: elapsed={time_elapsed:.1f}s, timeout={check_timeout}s, is_motion={is_motion_light}")
-                
-                if time_elapsed >= check_timeout:
-                    print(f"⏰ Light timeout reached! Turning OFF...")
-                    cur.execute('''
-                        UPDATE system_control 
-                        SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = 1
-                    ''')
-                    conn.commit()
-                    print(f"✅ Light turned OFF in database - Timeout: {check_timeout}s elapsed")
-                    log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {check_timeout}s elapsed')
-                else:
-                    print(f"⏳ Light still within timeout: {time_elapsed:.1f}s < {check_timeout}s")
-        
-        conn.close()
-    except Exception as e:
-        print(f"❌ Error checking timeouts: {e}")
-        import traceback
-        traceback.print_exc()
+            return dict(CommandDocument.DEFAULT)
+        doc = {
+            'light_on': control['light_on'],
+            'buzzer_on': control.get('buzzer_on', False),
+            'manual_mode': control['manual_mode'],
+            'brightness_level': control['brightness_level'],
+            'home_mode': control['home_mode']
+        }
+        # Include server URL if configured
+        if control.get('control_board_server_url'):
+            doc['server_url'] = control['control_board_server_url']
+        return doc
+
+    def update(self, control):
+        doc = self.build(control)
+        etag = hashlib.sha1(json.dumps(doc, sort_keys=True).encode()).hexdigest()[:16]
+        with self._cond:
+            if etag == self._etag:
+                return
+            self._doc = doc
+            self._etag = etag
+            self.changes += 1
+            self._cond.notify_all()
+
+    def get(self):
+        """(etag, document)"""
+        if self._etag is None:
+            self.update(state_cache.get_system_control())
+        with self._cond:
+            return self._etag, dict(self._doc)
+
+    def wait_for_change(self, etag, timeout):
+        """Block until the document's etag differs from etag (or timeout); returns (etag, document)"""
+        current, doc = self.get()
+        if current != etag or timeout <= 0:
+            return current, doc
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self._etag == etag:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                return self._etag, dict(self._doc)
+            finally:
+                self.waiting -= 1
+
+command_document = CommandDocument()
+state_cache.subscribe(command_document.update)
 
 @app.route('/api/control/commands', methods=['GET'])
 def get_control_commands():
-    """Get control commands for ESP32 Board 2 - Also returns server URL"""
+    """Get control commands for ESP32 Board 2 - Also returns server URL.
+    The board may send its last version (If-None-Match: "<version>" or ?since=<version>):
+    an unchanged document is answered with 304, right away or, with ?wait=<seconds>,
+    once it changes or the wait runs out."""
     try:
-        # Check timeouts before returning commands (ensures timeouts are checked on every poll)
-        check_timeouts()
+        if_none_match = request.headers.get('If-None-Match', '')
+        since = request.args.get('since') or if_none_match.replace('W/', '').strip().strip('"')
+        wait = min(max(request.args.get('wait', 0, type=float), 0), CONTROL_LONGPOLL_MAX_WAIT)
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
+        if since:
+            version, doc = command_document.wait_for_change(since, wait)
+        else:
+            version, doc = command_document.get()
         
-        if control:
-            response = {
-                'light_on': control['light_on'],
-                'buzzer_on': control.get('buzzer_on', False),
-                'manual_mode': control['manual_mode'],
-                'brightness_level': control['brightness_level'],
-                'home_mode': control['home_mode']
-            }
-            # Include server URL if configured
-            if control.get('control_board_server_url'):
-                response['server_url'] = control['control_board_server_url']
-            return jsonify(response)
+        if since and version == since:
+            response = app.response_class(status=304)
         else:
-            return jsonify({
-                'light_on': False,
-                'buzzer_on': False,
-                'manual_mode': False,
-                'brightness_level': 100,
-                'home_mode': True
-            })
+            doc['version'] = version
+            response = jsonify(doc)
+        response.headers['ETag'] = f'"{version}"'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
-        print(f"❌ Error getting control commands: {e}")
+        log.error("❌ Error getting control commands: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/control/status', methods=['POST'])
@@ -1199,132 +3078,121 @@ def update_control_status():
         light_on = data.get('light_on', False)
         buzzer_on = data.get('buzzer_on', False)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET light_on = %s, buzzer_on = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, light_on = %s, buzzer_on = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (light_on, buzzer_on))
-        conn.commit()
-        conn.close()
         
         return jsonify({'status': 'success'})
     except Exception as e:
-        print(f"❌ Error updating control status: {e}")
+        log.error("❌ Error updating control status: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # API Routes for Dashboard
+def build_system_state():
+    """Sensor readings and actuator state shown on the dashboard (served by /api/system-state and /api/stream)"""
+    # Get latest sensor data
+    sensor = latest_reading.get()
+    
+    if sensor and sensor.get('air_quality') is not None:
+        log.debug("Air quality raw value: %r", sensor.get('air_quality'))
+    
+    # Get system control
+    control = state_cache.get_system_control()
+    
+    if sensor and control:
+        # Calculate air quality percentage and status
+        # Get air quality value, handle None/NoneType
+        air_quality_value = sensor.get('air_quality')
+        if air_quality_value is None:
+            air_quality_raw = 0
+        else:
+            try:
+                air_quality_raw = int(float(air_quality_value))
+            except (ValueError, TypeError):
+                air_quality_raw = 0
+        
+        # MQ135 typically reads 0-4095 (12-bit ADC on ESP32)
+        # Map to 0-100% where higher values = worse air quality (higher pollution)
+        # Simple linear mapping: 0 = 0%, 4095 = 100%
+        if air_quality_raw <= 0:
+            air_quality_percent = 0
+        else:
+            # Map 0-4095 to 0-100%
+            air_quality_percent = int(round((air_quality_raw / 4095.0) * 100))
+            air_quality_percent = min(100, max(0, air_quality_percent))
+        
+        # Determine air quality status based on raw value
+        # Thresholds: Excellent < 1000, Good < 2000, Moderate < 3000, Poor < 4000, Very Poor >= 4000
+        if air_quality_raw < 1000:
+            air_quality_status = 'Excellent'
+        elif air_quality_raw < 2000:
+            air_quality_status = 'Good'
+        elif air_quality_raw < 3000:
+            air_quality_status = 'Moderate'
+        elif air_quality_raw < 4000:
+            air_quality_status = 'Poor'
+        else:
+            air_quality_status = 'Very Poor'
+        
+        return {
+            'sensors': {
+                'pir_motion': sensor['pir_motion'],
+                'flame_detected': sensor['flame_detected'],
+                'door_open': sensor['door_open'],
+                'air_quality': air_quality_raw,
+                'air_quality_raw': air_quality_raw,
+                'air_quality_percent': air_quality_percent,
+                'air_quality_status': air_quality_status,
+                'sound_level': sensor['sound_level'],
+                'light_level': sensor['light_level'],
+                'temperature': float(sensor['temperature']),
+                'humidity': float(sensor['humidity']),
+                'last_update': sensor['timestamp']
+            },
+            'system': {
+                'light_on': control['light_on'],
+                'buzzer_on': control.get('buzzer_on', False),
+                'manual_mode': control['manual_mode'],
+                'brightness_level': control['brightness_level'],
+                'home_mode': control['home_mode'],
+                'control_board_server_url': control.get('control_board_server_url', '')
+            }
+        }
+    else:
+        return {
+            'sensors': {
+                'pir_motion': False,
+                'flame_detected': False,
+                'door_open': False,
+                'air_quality': 0,
+                'air_quality_raw': 0,
+                'air_quality_percent': 0,
+                'air_quality_status': 'Unknown',
+                'sound_level': 0,
+                'light_level': 0,
+                'temperature': 0.0,
+                'humidity': 0.0,
+                'last_update': 0
+            },
+            'system': {
+                'light_on': False,
+                'buzzer_on': False,
+                'manual_mode': False,
+                'brightness_level': 100,
+                'home_mode': True
+            }
+        }
+
 @app.route('/api/system-state', methods=['GET'])
 @login_required
 def get_system_state():
     """Get current system state for dashboard"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get latest sensor data
-        cur.execute('''
-            SELECT * FROM sensor_data
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''')
-        sensor = cur.fetchone()
-        
-        # Debug: Print air quality value if available
-        if sensor and sensor.get('air_quality') is not None:
-            print(f"DEBUG: Air quality raw value from DB: {sensor.get('air_quality')}, type: {type(sensor.get('air_quality'))}")
-        
-        # Get system control
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
-        
-        if sensor and control:
-            # Calculate air quality percentage and status
-            # Get air quality value, handle None/NoneType
-            air_quality_value = sensor.get('air_quality')
-            if air_quality_value is None:
-                air_quality_raw = 0
-            else:
-                try:
-                    air_quality_raw = int(float(air_quality_value))
-                except (ValueError, TypeError):
-                    air_quality_raw = 0
-            
-            # MQ135 typically reads 0-4095 (12-bit ADC on ESP32)
-            # Map to 0-100% where higher values = worse air quality (higher pollution)
-            # Simple linear mapping: 0 = 0%, 4095 = 100%
-            if air_quality_raw <= 0:
-                air_quality_percent = 0
-            else:
-                # Map 0-4095 to 0-100%
-                air_quality_percent = int(round((air_quality_raw / 4095.0) * 100))
-                air_quality_percent = min(100, max(0, air_quality_percent))
-            
-            # Determine air quality status based on raw value
-            # Thresholds: Excellent < 1000, Good < 2000, Moderate < 3000, Poor < 4000, Very Poor >= 4000
-            if air_quality_raw < 1000:
-                air_quality_status = 'Excellent'
-            elif air_quality_raw < 2000:
-                air_quality_status = 'Good'
-            elif air_quality_raw < 3000:
-                air_quality_status = 'Moderate'
-            elif air_quality_raw < 4000:
-                air_quality_status = 'Poor'
-            else:
-                air_quality_status = 'Very Poor'
-            
-            return jsonify({
-                'sensors': {
-                    'pir_motion': sensor['pir_motion'],
-                    'flame_detected': sensor['flame_detected'],
-                    'door_open': sensor['door_open'],
-                    'air_quality': air_quality_raw,
-                    'air_quality_raw': air_quality_raw,
-                    'air_quality_percent': air_quality_percent,
-                    'air_quality_status': air_quality_status,
-                    'sound_level': sensor['sound_level'],
-                    'light_level': sensor['light_level'],
-                    'temperature': float(sensor['temperature']),
-                    'humidity': float(sensor['humidity']),
-                    'last_update': sensor['timestamp']
-                },
-                'system': {
-                    'light_on': control['light_on'],
-                    'buzzer_on': control.get('buzzer_on', False),
-                    'manual_mode': control['manual_mode'],
-                    'brightness_level': control['brightness_level'],
-                    'home_mode': control['home_mode'],
-                    'control_board_server_url': control.get('control_board_server_url', '')
-                }
-            })
-        else:
-            return jsonify({
-                'sensors': {
-                    'pir_motion': False,
-                    'flame_detected': False,
-                    'door_open': False,
-                    'air_quality': 0,
-                    'air_quality_raw': 0,
-                    'air_quality_percent': 0,
-                    'air_quality_status': 'Unknown',
-                    'sound_level': 0,
-                    'light_level': 0,
-                    'temperature': 0.0,
-                    'humidity': 0.0,
-                    'last_update': 0
-                },
-                'system': {
-                    'light_on': False,
-                    'buzzer_on': False,
-                    'manual_mode': False,
-                    'brightness_level': 100,
-                    'home_mode': True
-                }
-            })
+        return jsonify(build_system_state())
     except Exception as e:
-        print(f"❌ Error getting system state: {e}")
+        log.error("❌ Error getting system state: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/control/light', methods=['PUT'])
@@ -1335,15 +3203,11 @@ def control_light():
         data = request.get_json()
         light_on = data.get('state', False)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET light_on = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, light_on = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (light_on,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'💡 Light turned {"ON" if light_on else "OFF"} (manual)')
         
@@ -1359,16 +3223,11 @@ def control_buzzer():
         data = request.get_json()
         buzzer_on = data.get('state', False)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Track if user manually turned off (so we don't auto-activate for non-critical alerts)
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET buzzer_on = %s, buzzer_manual_off = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, buzzer_on = %s, buzzer_manual_off = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (buzzer_on, not buzzer_on))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'🔔 Buzzer turned {"ON" if buzzer_on else "OFF"} (manual)')
         
@@ -1385,15 +3244,11 @@ def control_mode():
         mode = data.get('mode', 'auto')
         manual_mode = (mode == 'manual')
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET manual_mode = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, manual_mode = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (manual_mode,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'Mode: {"Manual" if manual_mode else "Auto"}')
         
@@ -1410,15 +3265,11 @@ def control_brightness():
         brightness = int(data.get('brightness', 100))
         brightness = max(0, min(100, brightness))  # Clamp to 0-100
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET brightness_level = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, brightness_level = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (brightness,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'Brightness set to {brightness}%')
         
@@ -1434,15 +3285,11 @@ def control_home_mode():
         data = request.get_json()
         home_mode = data.get('home_mode', True)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET home_mode = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, home_mode = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (home_mode,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'Home mode: {"Someone home" if home_mode else "Away"}')
         
@@ -1465,15 +3312,11 @@ def set_control_board_server_url():
         if not (server_url.startswith('http://') or server_url.startswith('https://')):
             return jsonify({'error': 'Server URL must start with http:// or https://'}), 400
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
+        update_system_control('''
             UPDATE system_control 
-            SET control_board_server_url = %s, updated_at = CURRENT_TIMESTAMP
+            SET version = version + 1, control_board_server_url = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = 1
         ''', (server_url,))
-        conn.commit()
-        conn.close()
         
         log_event('CONTROL', f'Control Board Server URL updated: {server_url}')
         
@@ -1486,11 +3329,7 @@ def set_control_board_server_url():
 def get_control_board_server_url():
     """Get current server URL for ESP32 Control Board"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT control_board_server_url FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
+        control = state_cache.get_system_control()
         
         if control:
             return jsonify({
@@ -1504,28 +3343,53 @@ def get_control_board_server_url():
 @app.route('/api/events', methods=['GET'])
 @login_required
 def get_events():
-    """Get event log with pagination"""
+    """Get event log, newest first, with keyset pagination on (timestamp, id).
+    Pass pagination.next_cursor as cursor= for older events, or pagination.prev_cursor
+    as before= for newer ones. total comes from event_log_counter, not COUNT(*)."""
     try:
-        page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
-        offset = (page - 1) * per_page
+        per_page = max(1, min(per_page, 500))
+        cursor, before = request.args.get('cursor'), request.args.get('before')
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get total count
-        cur.execute('SELECT COUNT(*) as total FROM event_log')
-        total = cur.fetchone()['total']
+        conditions, params = [], []
+        try:
+            if cursor:
+                conditions.append('(timestamp, id) < (%s, %s)')
+                params.extend(decode_cursor(cursor))
+            elif before:
+                conditions.append('(timestamp, id) > (%s, %s)')
+                params.extend(decode_cursor(before))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        order = 'ASC' if before and not cursor else 'DESC'
+        
+        def fetch(conditions, params, order):
+            # One extra row tells whether another page follows in this direction
+            cur.execute(f'''
+                SELECT id, event_type, event_message, timestamp
+                FROM event_log
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                ORDER BY timestamp {order}, id {order}
+                LIMIT %s
+            ''', params + [per_page + 1])
+            rows = cur.fetchall()
+            return rows[:per_page], len(rows) > per_page
         
-        # Get events for current page
-        cur.execute('''
-            SELECT event_type, event_message, timestamp
-            FROM event_log
-            ORDER BY timestamp DESC
-            LIMIT %s OFFSET %s
-        ''', (per_page, offset))
-        events = cur.fetchall()
-        conn.close()
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            events, more = fetch(conditions, params, order)
+            if order == 'ASC' and not more:
+                # Paged back to the newest events: serve a full first page instead of a partial one
+                events, more = fetch([], [], 'DESC')
+                has_prev, has_next = False, more
+            elif order == 'ASC':
+                events.reverse()
+                has_prev, has_next = True, True
+            else:
+                has_prev, has_next = bool(cursor), more
+        finally:
+            conn.close()
         
         event_list = []
         for event in events:
@@ -1536,208 +3400,65 @@ def get_events():
                 'timestamp': timestamp_str
             })
         
-        total_pages = (total + per_page - 1) // per_page
+        total = event_log_counter.get()
+        total_pages = max((total + per_page - 1) // per_page, 1)
         
         return jsonify({
             'events': event_list,
             'pagination': {
-                'page': page,
                 'per_page': per_page,
                 'total': total,
+                'total_exact': event_log_counter.exact,
                 'total_pages': total_pages,
-                'has_next': page < total_pages,
-                'has_prev': page > 1
+                'has_next': has_next,
+                'has_prev': has_prev,
+                'next_cursor': encode_cursor(events[-1]['timestamp'], events[-1]['id']) if has_next and events else None,
+                'prev_cursor': encode_cursor(events[0]['timestamp'], events[0]['id']) if has_prev and events else None
             }
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_sensor_events():
+    """Current reading and auto action per sensor, with its light/buzzer toggles (served by /api/sensor-events and /api/stream)"""
+    # Get the latest sensor data entry (same as what's shown in Sensor Readings)
+    latest_data = latest_reading.get()
+    
+    if not latest_data:
+        return []
+    
+    # Get current system control state to determine actions
+    control = state_cache.get_system_control()
+    
+    # Get per-sensor control states
+    sensor_controls = state_cache.get_sensor_controls()
+    
+    rows = describe_sensor_actions(latest_data['pir_motion'], latest_data['flame_detected'], latest_data['door_open'],
+                                   latest_data['air_quality'], latest_data['sound_level'], latest_data['light_level'],
+                                   latest_data['temperature'], latest_data['humidity'], control)
+    
+    # Add all sensors with their current readings and control states
+    event_list = []
+    for sensor_name, sensor_information, action_taken in reversed(rows):
+        flags = sensor_controls.get(sensor_name, {'light_enabled': True, 'buzzer_enabled': True})
+        event_list.append({
+            'sensor_name': sensor_name,
+            'sensor_information': sensor_information,
+            'action_taken': action_taken,
+            'light_enabled': flags['light_enabled'],
+            'buzzer_enabled': flags['buzzer_enabled']
+        })
+    
+    return event_list
+
 @app.route('/api/sensor-events', methods=['GET'])
 @login_required
 def get_sensor_events():
     """Get latest sensor readings (one per sensor) for real-time updates - shows current sensor data"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get the latest sensor data entry (same as what's shown in Sensor Readings)
-        cur.execute('''
-            SELECT pir_motion, flame_detected, door_open, air_quality, sound_level, 
-                   light_level, temperature, humidity, created_at
-            FROM sensor_data 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''')
-        
-        latest_data = cur.fetchone()
-        
-        if not latest_data:
-            conn.close()
-            return jsonify({'sensor_events': [], 'query_time': time.time(), 'count': 0})
-        
-        # Get current system control state to determine actions
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        
-        # Get per-sensor control states
-        cur.execute('SELECT sensor_name, light_enabled, buzzer_enabled FROM sensor_controls')
-        sensor_controls = {row['sensor_name']: {'light_enabled': row['light_enabled'], 'buzzer_enabled': row['buzzer_enabled']} 
-                          for row in cur.fetchall()}
-        
-        conn.close()
-        
-        if not control:
-            control = {'buzzer_on': False, 'light_on': False, 'manual_mode': False, 'home_mode': True}
-        
-        # Extract sensor values
-        pir_motion = latest_data['pir_motion']
-        flame_detected = latest_data['flame_detected']
-        door_open = latest_data['door_open']
-        air_quality = int(latest_data['air_quality'])
-        sound_level = int(latest_data['sound_level'])
-        light_level = int(latest_data['light_level'])
-        temperature = float(latest_data['temperature'])
-        humidity = float(latest_data['humidity'])
-        timestamp = latest_data['created_at']
-        
-        # Thresholds
-        LIGHT_THRESHOLD = 2000  # Higher value = darker (0-4095 range, Dark=4095, Bright=0)
-        # If light_level > 2000, it's considered dark
-        AIR_QUALITY_THRESHOLD = 2000
-        SOUND_THRESHOLD = 200
-        
-        # Determine actions for each sensor (same logic as log_all_sensors)
-        actions = {}
-        
-        # PIR Motion Sensor
-        if pir_motion:
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            if not control.get('manual_mode', False) and low_light:
-                actions['pir'] = 'Light ON (auto - low light)'
-            elif not control.get('home_mode', True):
-                actions['pir'] = 'Buzzer ON, Light ON (away mode)'
-            else:
-                actions['pir'] = 'No action (normal conditions)'
-        else:
-            actions['pir'] = 'No action (no motion)'
-        
-        # Flame Sensor
-        if flame_detected:
-            actions['flame'] = 'Buzzer ON, Light ON'
-        else:
-            actions['flame'] = 'No action (no fire detected)'
-        
-        # MQ135 Air Quality Sensor
-        if air_quality > AIR_QUALITY_THRESHOLD:
-            actions['mq135'] = 'Buzzer ON, Light ON'
-        else:
-            actions['mq135'] = f'No action (normal: {air_quality} < {AIR_QUALITY_THRESHOLD})'
-        
-        # Reed Switch (Door Sensor)
-        if door_open:
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            if not control.get('manual_mode', False) and low_light:
-                actions['door'] = 'Light ON (auto - low light)'
-            elif not control.get('home_mode', True):
-                actions['door'] = 'Buzzer ON, Light ON (away mode)'
-            else:
-                actions['door'] = 'No action (normal conditions)'
-        else:
-            actions['door'] = 'No action (door closed)'
-        
-        # Sound Sensor
-        if sound_level > SOUND_THRESHOLD:
-            actions['sound'] = 'Buzzer ON, Light ON'
-        else:
-            actions['sound'] = f'No action (normal: {sound_level} < {SOUND_THRESHOLD})'
-        
-        # LDR Light Sensor
-        if light_level > LIGHT_THRESHOLD:  # Higher value = darker
-            if control.get('light_on', False):
-                actions['ldr'] = 'Light ON (low light detected)'
-            else:
-                actions['ldr'] = f'Light ready (low light: {light_level} < {LIGHT_THRESHOLD})'
-        else:
-            actions['ldr'] = f'No action (sufficient light: {light_level})'
-        
-        # DHT11 Temperature & Humidity Sensor
-        actions['dht11'] = 'No action (monitoring only)'
-        
-        # Build event list with current sensor readings
-        event_list = []
-        
-        # Convert timestamp to ISO format
-        if timestamp:
-            if hasattr(timestamp, 'isoformat'):
-                timestamp_str = timestamp.isoformat()
-            else:
-                timestamp_str = str(timestamp)
-        else:
-            timestamp_str = None
-        
-        # Helper function to get sensor control states
-        def get_sensor_control(sensor_name):
-            return sensor_controls.get(sensor_name, {'light_enabled': True, 'buzzer_enabled': True})
-        
-        # Add all sensors with their current readings and control states
-            event_list.append({
-            'sensor_name': 'DHT11 Temperature & Humidity',
-            'sensor_information': f'Temp: {temperature}°C, Humidity: {humidity}%',
-            'action_taken': actions['dht11'],
-            'light_enabled': get_sensor_control('DHT11 Temperature & Humidity')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('DHT11 Temperature & Humidity')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'LDR Light Sensor',
-            'sensor_information': f'Light level: {light_level} (threshold: {LIGHT_THRESHOLD})',
-            'action_taken': actions['ldr'],
-            'light_enabled': get_sensor_control('LDR Light Sensor')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('LDR Light Sensor')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'Sound Sensor',
-            'sensor_information': f'Level: {sound_level} (threshold: {SOUND_THRESHOLD})',
-            'action_taken': actions['sound'],
-            'light_enabled': get_sensor_control('Sound Sensor')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('Sound Sensor')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'Reed Switch (Door Sensor)',
-            'sensor_information': f'Door: {"Open" if door_open else "Closed"}',
-            'action_taken': actions['door'],
-            'light_enabled': get_sensor_control('Reed Switch (Door Sensor)')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('Reed Switch (Door Sensor)')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'MQ135 Air Quality Sensor',
-            'sensor_information': f'Reading: {air_quality} (threshold: {AIR_QUALITY_THRESHOLD})',
-            'action_taken': actions['mq135'],
-            'light_enabled': get_sensor_control('MQ135 Air Quality Sensor')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('MQ135 Air Quality Sensor')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'Flame Sensor',
-            'sensor_information': f'Fire: {"Detected" if flame_detected else "None"}',
-            'action_taken': actions['flame'],
-            'light_enabled': get_sensor_control('Flame Sensor')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('Flame Sensor')['buzzer_enabled']
-        })
-        
-        event_list.append({
-            'sensor_name': 'PIR Motion Sensor',
-            'sensor_information': f'Motion: {"Detected" if pir_motion else "None"}',
-            'action_taken': actions['pir'],
-            'light_enabled': get_sensor_control('PIR Motion Sensor')['light_enabled'],
-            'buzzer_enabled': get_sensor_control('PIR Motion Sensor')['buzzer_enabled']
-        })
+        event_list = build_sensor_events()
         
         # Add a unique identifier to force frontend refresh
-        import time
         response_data = {
             'sensor_events': event_list,
             'query_time': time.time(),
@@ -1751,11 +3472,77 @@ def get_sensor_events():
         response.headers['Expires'] = '0'
         return response
     except Exception as e:
-        print(f"❌ Error getting sensor events: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error getting sensor events: %s", e)
         return jsonify({'error': str(e), 'sensor_events': []}), 500
 
+def sensor_event_to_dict(row):
+    return {
+        'sensor_name': row['sensor_name'],
+        'sensor_information': row['sensor_information'],
+        'action_taken': row['action_taken'],
+        'timestamp': row['timestamp'].isoformat() if isinstance(row['timestamp'], datetime) else row['timestamp'],
+        'is_keyframe': bool(row['is_keyframe'])
+    }
+
+@app.route('/api/sensor-events/timeline', methods=['GET'])
+@login_required
+def get_sensor_event_timeline():
+    """Rebuild the per-sensor timeline from sensor_events (works for both SENSOR_EVENT_MODE values).
+    start/end as unix seconds or ISO 8601, or hours= back from now (default 1); optional sensor= name.
+    'initial' is each sensor's state at start: its last row since the latest keyframe at or before
+    start. 'events' are the rows logged in (start, end], oldest first, at most limit (default 1000)."""
+    try:
+        end = parse_history_time(request.args['end']) if request.args.get('end') else datetime.now(timezone.utc).replace(tzinfo=None)
+        if request.args.get('start'):
+            start = parse_history_time(request.args['start'])
+        else:
+            start = end - timedelta(hours=request.args.get('hours', 1, type=float))
+        start, end = start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)
+        sensor = request.args.get('sensor')
+        limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+        sensor_filter = 'AND sensor_name = %s' if sensor else ''
+        sensor_params = (sensor,) if sensor else ()
+        
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            # The latest keyframe bounds how far back the initial state has to be searched
+            cur.execute('''
+                SELECT MAX(timestamp) AS keyframe_at FROM sensor_events
+                WHERE is_keyframe AND timestamp <= %s
+            ''', (start,))
+            row = cur.fetchone()
+            keyframe_at = row['keyframe_at'] if row else None
+            cur.execute(f'''
+                SELECT DISTINCT ON (sensor_name) sensor_name, sensor_information, action_taken, timestamp, is_keyframe
+                FROM sensor_events
+                WHERE timestamp <= %s {'AND timestamp >= %s' if keyframe_at is not None else ''} {sensor_filter}
+                ORDER BY sensor_name, timestamp DESC, id DESC
+            ''', (start,) + ((keyframe_at,) if keyframe_at is not None else ()) + sensor_params)
+            initial = cur.fetchall()
+            cur.execute(f'''
+                SELECT sensor_name, sensor_information, action_taken, timestamp, is_keyframe
+                FROM sensor_events
+                WHERE timestamp > %s AND timestamp <= %s {sensor_filter}
+                ORDER BY timestamp, id
+                LIMIT %s
+            ''', (start, end) + sensor_params + (limit,))
+            events = cur.fetchall()
+        finally:
+            conn.close()
+        
+        return jsonify({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'mode': SENSOR_EVENT_MODE,
+            'keyframe_at': keyframe_at.isoformat() if isinstance(keyframe_at, datetime) else keyframe_at,
+            'initial': [sensor_event_to_dict(row) for row in initial],
+            'events': [sensor_event_to_dict(row) for row in events],
+            'truncated': len(events) == limit
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/sensor-control/toggle', methods=['POST'])
 @login_required
 def toggle_sensor_control():
@@ -1773,7 +3560,7 @@ def toggle_sensor_control():
             return jsonify({'error': 'control_type must be "light" or "buzzer"'}), 400
         
         conn = get_db_connection()
-        cur = conn.cursor()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Update or insert sensor control
         if control_type == 'light':
@@ -1782,6 +3569,7 @@ def toggle_sensor_control():
                 VALUES (%s, %s, TRUE)
                 ON CONFLICT (sensor_name) 
                 DO UPDATE SET light_enabled = %s, updated_at = CURRENT_TIMESTAMP
+                RETURNING sensor_name, light_enabled, buzzer_enabled
             ''', (sensor_name, enabled, enabled))
         else:  # buzzer
             cur.execute('''
@@ -1789,10 +3577,13 @@ def toggle_sensor_control():
                 VALUES (%s, TRUE, %s)
                 ON CONFLICT (sensor_name) 
                 DO UPDATE SET buzzer_enabled = %s, updated_at = CURRENT_TIMESTAMP
+                RETURNING sensor_name, light_enabled, buzzer_enabled
             ''', (sensor_name, enabled, enabled))
+        row = cur.fetchone()
         
         conn.commit()
         conn.close()
+        state_cache.put_sensor_control(row)
         
         # Build response with dynamic key
         response_data = {
@@ -1802,188 +3593,142 @@ def toggle_sensor_control():
         }
         return jsonify(response_data)
     except Exception as e:
-        print(f"❌ Error toggling sensor control: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error toggling sensor control: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/history/motion', methods=['GET'])
+@app.route('/api/alert-rules', methods=['GET'])
 @login_required
-def get_motion_history():
-    """Get motion detection history"""
+def get_alert_rules():
+    """Alert thresholds and actuator timeouts, with the version the rule engine compiled"""
     try:
-        limit = request.args.get('limit', 10, type=int)
-        if limit is None or limit <= 0:
-            limit = 10
-        limit = int(limit)  # Ensure it's an integer
-        
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('''
-            SELECT timestamp, event_message
-            FROM event_log
-            WHERE event_message LIKE %s OR event_message LIKE %s 
-               OR event_message LIKE %s OR event_message LIKE %s
-            ORDER BY timestamp DESC
-            LIMIT %s
-        ''', ('%Motion%', '%motion%', '%👁️%', '%🚨 Motion%', limit))
-        events = cur.fetchall()
-        conn.close()
-        
-        history = []
-        for event in events:
-            if not event:
-                continue
-            timestamp = event.get('timestamp')
-            event_message = event.get('event_message', '')
-            
-            # Determine if motion was detected based on message
-            motion_detected = 'detected' in event_message.lower() or 'Motion' in event_message
-            
-            if timestamp:
-                # Format timestamp - if timezone-aware, convert to ISO format; otherwise format as-is
-                if isinstance(timestamp, datetime):
-                    # Use ISO format which JavaScript can parse correctly
-                    timestamp_str = timestamp.isoformat()
-                else:
-                    timestamp_str = str(timestamp)
-            else:
-                timestamp_str = None
-            
-            history.append({
-                'timestamp': timestamp_str,
-                'motion_detected': motion_detected,
-                'message': event_message
-            })
-        
+        compiled = alert_rules.current()
         return jsonify({
-            'history': history,
-            'count': len(history)
+            'rules': compiled.rules,
+            'version': '-'.join(str(part) for part in compiled.key),
+            'compiles': alert_rules.compiles
         })
     except Exception as e:
-        print(f"❌ Error getting motion history: {e}")
-        import traceback
-        traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/history/door', methods=['GET'])
+@app.route('/api/alert-rules', methods=['PUT'])
 @login_required
-def get_door_history():
-    """Get door open/close history"""
+def update_alert_rules():
+    """Change thresholds/timeouts, e.g. {"sound_threshold": 300}; takes effect from the next reading"""
     try:
-        limit = request.args.get('limit', 10, type=int)
-        if limit is None or limit <= 0:
-            limit = 10
-        limit = int(limit)  # Ensure it's an integer
+        data = request.get_json() or {}
+        unknown = [name for name in data if name not in ALERT_RULE_DEFAULTS]
+        if unknown or not data:
+            return jsonify({'error': f'Expected some of: {", ".join(ALERT_RULE_DEFAULTS)}'}), 400
+        try:
+            values = {name: int(value) for name, value in data.items()}
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Values must be integers'}), 400
+        if any(value < 0 for value in values.values()):
+            return jsonify({'error': 'Values must not be negative'}), 400
         
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('''
-            SELECT timestamp, event_message
-            FROM event_log
-            WHERE event_message LIKE %s OR event_message LIKE %s 
-               OR event_message LIKE %s OR event_message LIKE %s
-               OR event_message LIKE %s OR event_message LIKE %s
-            ORDER BY timestamp DESC
-            LIMIT %s
-        ''', ('%Door%', '%door%', '%Window%', '%window%', '%🚪%', '%🚨 Door%', limit))
-        events = cur.fetchall()
-        conn.close()
-        
-        history = []
-        for event in events:
-            if not event:
-                continue
-            timestamp = event.get('timestamp')
-            event_message = event.get('event_message', '')
-            
-            # Determine if door is open based on message
-            door_open = 'open' in event_message.lower() or 'opened' in event_message.lower()
-            
-            if timestamp:
-                # Format timestamp - if timezone-aware, convert to ISO format; otherwise format as-is
-                if isinstance(timestamp, datetime):
-                    # Use ISO format which JavaScript can parse correctly
-                    timestamp_str = timestamp.isoformat()
-                else:
-                    timestamp_str = str(timestamp)
-            else:
-                timestamp_str = None
-            
-            history.append({
-                'timestamp': timestamp_str,
-                'door_open': door_open,
-                'message': event_message
-            })
-        
-        return jsonify({
-            'history': history,
-            'count': len(history)
-        })
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            rows = []
+            for name, value in values.items():
+                cur.execute('''
+                    INSERT INTO alert_rules (name, value) VALUES (%s, %s)
+                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
+                    RETURNING name, value
+                ''', (name, value))
+                rows.append(cur.fetchone())
+            conn.commit()
+        finally:
+            conn.close()
+        for row in rows:
+            state_cache.put_alert_rule(row)
+        log_event('CONTROL', '🎚️ Alert rules updated: ' + ', '.join(f'{name}={value}' for name, value in values.items()))
+        return jsonify({'success': True, 'rules': alert_rules.current().rules})
     except Exception as e:
-        print(f"❌ Error getting door history: {e}")
-        import traceback
-        traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/history/fire', methods=['GET'])
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor for (timestamp, id) ordered pages"""
+    value = f'{timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp}|{row_id}'
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp, id) from encode_cursor(); raises ValueError for a malformed cursor"""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = value.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+@app.route('/api/history/<sensor>', methods=['GET'])
 @login_required
-def get_fire_history():
-    """Get fire detection history"""
+def get_sensor_history(sensor):
+    """Get alert/detection history for one sensor (motion, door, fire, air_quality, sound), newest first.
+    Optional start/end (unix seconds or ISO 8601), code= and severity= filters; limit (default 10).
+    Pass the returned next_cursor as cursor= to get the following (older) page."""
     try:
+        if sensor not in HISTORY_SENSORS:
+            return jsonify({'error': f'Unknown sensor, expected one of: {", ".join(HISTORY_SENSORS)}'}), 400
         limit = request.args.get('limit', 10, type=int)
         if limit is None or limit <= 0:
             limit = 10
-        limit = int(limit)  # Ensure it's an integer
+        limit = min(limit, 1000)
+        
+        conditions = ['sensor = %s']
+        params = [sensor]
+        if request.args.get('start'):
+            conditions.append('timestamp >= %s')
+            params.append(parse_history_time(request.args['start']))
+        if request.args.get('end'):
+            conditions.append('timestamp < %s')
+            params.append(parse_history_time(request.args['end']))
+        if request.args.get('code'):
+            conditions.append('event_code = %s')
+            params.append(request.args['code'])
+        if request.args.get('severity'):
+            conditions.append('severity = %s')
+            params.append(request.args['severity'])
+        if request.args.get('cursor'):
+            try:
+                params.extend(decode_cursor(request.args['cursor']))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('(timestamp, id) < (%s, %s)')
         
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('''
-            SELECT timestamp, event_message
+        cur.execute(f'''
+            SELECT id, timestamp, event_message, event_code, severity
             FROM event_log
-            WHERE event_message LIKE %s OR event_message LIKE %s 
-               OR event_message LIKE %s OR event_message LIKE %s
-               OR event_message LIKE %s
-            ORDER BY timestamp DESC
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp DESC, id DESC
             LIMIT %s
-        ''', ('%Fire%', '%fire%', '%Flame%', '%flame%', '%🔥%', limit))
+        ''', params + [limit + 1])
         events = cur.fetchall()
         conn.close()
         
+        has_more = len(events) > limit
+        events = events[:limit]
+        flag = HISTORY_SENSORS[sensor]
         history = []
         for event in events:
-            if not event:
-                continue
-            timestamp = event.get('timestamp')
-            event_message = event.get('event_message', '')
-            
-            # Determine if fire was detected based on message
-            flame_detected = 'fire' in event_message.lower() or 'flame' in event_message.lower() or '🔥' in event_message
-            
-            if timestamp:
-                # Format timestamp - if timezone-aware, convert to ISO format; otherwise format as-is
-                if isinstance(timestamp, datetime):
-                    # Use ISO format which JavaScript can parse correctly
-                    timestamp_str = timestamp.isoformat()
-                else:
-                    timestamp_str = str(timestamp)
-            else:
-                timestamp_str = None
-            
+            timestamp = event['timestamp']
             history.append({
-                'timestamp': timestamp_str,
-                'flame_detected': flame_detected,
-                'message': event_message
+                'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+                flag: True,
+                'event_code': event['event_code'],
+                'severity': event['severity'],
+                'message': event['event_message']
             })
         
         return jsonify({
             'history': history,
-            'count': len(history)
+            'count': len(history),
+            'next_cursor': encode_cursor(events[-1]['timestamp'], events[-1]['id']) if has_more else None
         })
     except Exception as e:
-        print(f"❌ Error getting fire history: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error getting %s history: %s", sensor, e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/notifications', methods=['GET'])
@@ -1992,29 +3737,7 @@ def get_notifications():
     """Get recent notifications for dashboard"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('''
-            SELECT id, title, message, notification_type, created_at, read
-            FROM notifications
-            ORDER BY created_at DESC
-            LIMIT %s
-        ''', (limit,))
-        notifications = cur.fetchall()
-        conn.close()
-        
-        notif_list = []
-        for notif in notifications:
-            notif_list.append({
-                'id': notif['id'],
-                'title': notif['title'],
-                'message': notif['message'],
-                'type': notif['notification_type'],
-                'timestamp': notif['created_at'].isoformat() if notif['created_at'] else None,
-                'read': notif['read']
-            })
-        
-        return jsonify({'notifications': notif_list})
+        return jsonify({'notifications': load_notifications(limit)})
     except Exception as e:
         return jsonify({'error': str(e), 'notifications': []}), 500
 
@@ -2028,6 +3751,7 @@ def mark_notification_read(notif_id):
         cur.execute('UPDATE notifications SET read = TRUE WHERE id = %s', (notif_id,))
         conn.commit()
         conn.close()
+        notifications_changed('notifications-changed', {'read': notif_id})
         return jsonify({'status': 'ok'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2039,9 +3763,11 @@ def clear_events():
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute('DELETE FROM event_log')
+        cur.execute('TRUNCATE event_log')
         conn.commit()
         conn.close()
+        event_log_counter.reset()
+        broadcaster.publish('event-log', {'cleared': True})
         log_event('INFO', 'Event log cleared by user')
         return jsonify({'status': 'ok', 'message': 'Event log cleared'})
     except Exception as e:
@@ -2057,25 +3783,229 @@ def clear_notifications():
         cur.execute('DELETE FROM notifications')
         conn.commit()
         conn.close()
+        notifications_changed('notifications-changed', {'cleared': True})
         return jsonify({'status': 'ok', 'message': 'Notifications cleared'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/notifications/outbox', methods=['GET'])
+@login_required
+def get_notification_outbox_stats():
+    """Outbound e-mail queue counts and dispatcher counters"""
+    try:
+        return jsonify(email_dispatcher.stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream', methods=['GET'])
+@login_required
+def stream():
+    """Server-Sent Events stream of dashboard changes.
+    Sends a 'snapshot' (state + sensor events) on connect, then 'state', 'sensor-events', 'notification',
+    'notifications-changed' and 'event-log' events as they happen, with a heartbeat comment while idle.
+    A client reconnecting with Last-Event-ID gets the events it missed; if they are no longer
+    buffered the snapshot carries resync=true and the client reloads its lists."""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    def sse(event, data, event_id):
+        return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+    
+    def generate():
+        broadcaster.add_client()
+        try:
+            cursor = broadcaster.last_id
+            missed = broadcaster.events_after(last_event_id) if last_event_id is not None else None
+            snapshot = {'state': build_system_state(), 'sensor_events': build_sensor_events(), 'resync': missed is None}
+            yield 'retry: 3000\n\n'
+            yield sse('snapshot', json.dumps(snapshot, default=str), cursor)
+            if missed:
+                for event_id, event, data in missed:
+                    if event_id <= cursor and event in ('notification', 'notifications-changed', 'event-log'):
+                        yield sse(event, data, event_id)
+            while True:
+                events = broadcaster.wait(cursor, SSE_HEARTBEAT_INTERVAL)
+                if events is None:
+                    # Fell behind the ring buffer - start over from a snapshot
+                    cursor = broadcaster.last_id
+                    snapshot = {'state': build_system_state(), 'sensor_events': build_sensor_events(), 'resync': True}
+                    yield sse('snapshot', json.dumps(snapshot, default=str), cursor)
+                elif not events:
+                    yield ': heartbeat\n\n'
+                else:
+                    for event_id, event, data in events:
+                        yield sse(event, data, event_id)
+                    cursor = events[-1][0]
+        finally:
+            broadcaster.remove_client()
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+class DashboardSnapshot:
+    """Everything the dashboard renders, memoized on the versions of its inputs:
+    (latest reading id, system_control, sensor_controls, alert_rules and sensor_board_control versions,
+    notifications version). Between changes a request costs a tuple comparison; the
+    notification list is only re-queried when notifications change."""
+
+    NOTIFICATION_LIMIT = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boot = format(int(time.time() * 1000), 'x')  # keeps ETags from a previous run from matching
+        self._key = None
+        self._etag = None
+        self._body = None
+        self._notifications_version = 0
+        self._notifications = None  # (version, list)
+        self.hits = 0
+        self.builds = 0
+
+    def notifications_changed(self):
+        with self._lock:
+            self._notifications_version += 1
+
+    def _current_key(self):
+        reading = latest_reading.get()
+        versions = state_cache.versions
+        return (reading['id'] if reading else None,
+                versions['system_control'], versions['sensor_controls'], versions['alert_rules'],
+                versions['sensor_board_control'], self._notifications_version)
+
+    def get(self):
+        """(etag, JSON body)"""
+        key = self._current_key()
+        with self._lock:
+            if key == self._key:
+                self.hits += 1
+                return self._etag, self._body
+        
+        # Loading a table into state_cache bumps its version - make sure they are loaded before keying
+        state_cache.get_system_control()
+        state_cache.get_sensor_controls()
+        state_cache.get_alert_rules()
+        state_cache.get_sensor_board_control()
+        key = self._current_key()
+        notif_version = key[-1]
+        cached = self._notifications
+        if cached is None or cached[0] != notif_version:
+            cached = (notif_version, load_notifications(self.NOTIFICATION_LIMIT))
+        snapshot = {
+            'state': build_system_state(),
+            'sensor_events': build_sensor_events(),
+            'notifications': cached[1],
+            'sensor_board': build_sensor_board_info()
+        }
+        body = json.dumps(snapshot, default=str)
+        etag = f'"{self._boot}-' + '-'.join(str(part) for part in key) + '"'
+        with self._lock:
+            self._notifications = cached
+            self._key, self._etag, self._body = key, etag, body
+            self.builds += 1
+        return etag, body
+
+dashboard_snapshot = DashboardSnapshot()
+
+@app.route('/api/dashboard/snapshot', methods=['GET'])
+@login_required
+def get_dashboard_snapshot():
+    """System state, per-sensor table, recent notifications and Sensor Board info in one response.
+    Answers 304 when If-None-Match still matches."""
+    try:
+        etag, body = dashboard_snapshot.get()
+        if request.headers.get('If-None-Match') == etag:
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(body, mimetype='application/json')
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        log.error("❌ Error building dashboard snapshot: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream/stats', methods=['GET'])
+@login_required
+def get_stream_stats():
+    """Dashboard stream clients and event counters"""
+    return jsonify({
+        'clients': broadcaster.clients,
+        'published': broadcaster.published,
+        'last_event_id': broadcaster.last_id
+    })
+
+def parse_history_time(value):
+    """Parse a history range bound: unix seconds or ISO 8601 (naive = UTC). Returns a naive UTC datetime."""
+    try:
+        parsed = datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def pick_rollup_resolution(start, end, max_points):
+    """Finest rollup whose buckets over [start, end) still fit in max_points"""
+    span = max((end - start).total_seconds(), 1)
+    for resolution, width in ROLLUP_RESOLUTIONS.items():
+        if span / width <= max_points:
+            return resolution
+    return 'day'
+
 @app.route('/api/sensor-data/history', methods=['GET'])
 @login_required
 def get_sensor_data_history():
-    """Get sensor data history for visualization (last N records)"""
+    """Get sensor data history for visualization.
+    Without parameters: the last N raw records (limit, default 50).
+    With resolution=minute|hour|day|auto (and start/end as unix seconds or ISO 8601, or hours=
+    back from now; default the last 24 hours): one point per bucket from the rollup tables
+    (avg plus _min/_max per metric and event counts). auto picks the finest table that covers
+    the range in at most limit points (default 500). resolution=raw with a range returns raw rows."""
     try:
-        limit = request.args.get('limit', 50, type=int)
+        resolution = request.args.get('resolution', 'raw')
+        has_range = any(request.args.get(arg) for arg in ('start', 'end', 'hours'))
+        limit = request.args.get('limit', 500 if resolution != 'raw' else 50, type=int)
+        limit = max(1, min(limit, 10000))
+        
+        if resolution not in ('raw', 'auto') and resolution not in ROLLUP_RESOLUTIONS:
+            return jsonify({'error': 'resolution must be raw, auto, minute, hour or day'}), 400
+        
+        start = end = None
+        if has_range or resolution != 'raw':
+            end = parse_history_time(request.args['end']) if request.args.get('end') else datetime.now(timezone.utc).replace(tzinfo=None)
+            if request.args.get('start'):
+                start = parse_history_time(request.args['start'])
+            else:
+                start = end - timedelta(hours=request.args.get('hours', 24, type=float))
+            if resolution == 'auto':
+                resolution = pick_rollup_resolution(start, end, limit)
+        
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('''
-            SELECT temperature, humidity, air_quality, sound_level, light_level, 
-                   pir_motion, flame_detected, door_open, created_at
-            FROM sensor_data
-            ORDER BY created_at DESC
-            LIMIT %s
-        ''', (limit,))
+        if resolution == 'raw':
+            cur.execute(f'''
+                SELECT temperature, humidity, air_quality, sound_level, light_level, 
+                       pir_motion, flame_detected, door_open, created_at
+                FROM sensor_data
+                {'WHERE created_at >= %s AND created_at < %s' if start is not None else ''}
+                ORDER BY created_at DESC
+                LIMIT %s
+            ''', (start, end, limit) if start is not None else (limit,))
+        else:
+            averages = ', '.join(f'{metric}_sum / samples AS {metric}, {metric}_min, {metric}_max' for metric in ROLLUP_METRICS)
+            cur.execute(f'''
+                SELECT bucket AS created_at, samples, {averages},
+                       motion_count, flame_count, door_open_count
+                FROM sensor_rollup_{resolution}
+                WHERE bucket >= %s AND bucket < %s
+                ORDER BY bucket DESC
+                LIMIT %s
+            ''', (rollup_bucket(start, resolution), end, limit))
         data = cur.fetchall()
         conn.close()
         
@@ -2093,352 +4023,1099 @@ def get_sensor_data_history():
             else:
                 timestamp_str = None
             
-            history.append({
-                'timestamp': timestamp_str,
-                'temperature': float(row['temperature']),
-                'humidity': float(row['humidity']),
-                'air_quality': int(row['air_quality']),
-                'sound_level': int(row['sound_level']),
-                'light_level': int(row['light_level']),
-                'pir_motion': bool(row['pir_motion']),
-                'flame_detected': bool(row['flame_detected']),
-                'door_open': bool(row['door_open'])
+            if resolution == 'raw':
+                history.append({
+                    'timestamp': timestamp_str,
+                    'temperature': float(row['temperature']),
+                    'humidity': float(row['humidity']),
+                    'air_quality': int(row['air_quality']),
+                    'sound_level': int(row['sound_level']),
+                    'light_level': int(row['light_level']),
+                    'pir_motion': bool(row['pir_motion']),
+                    'flame_detected': bool(row['flame_detected']),
+                    'door_open': bool(row['door_open'])
+                })
+                continue
+            
+            point = {'timestamp': timestamp_str, 'samples': row['samples']}
+            for metric in ROLLUP_METRICS:
+                point[metric] = round(float(row[metric]), 2)
+                point[f'{metric}_min'] = float(row[f'{metric}_min'])
+                point[f'{metric}_max'] = float(row[f'{metric}_max'])
+            point.update({
+                'pir_motion': row['motion_count'] > 0,
+                'flame_detected': row['flame_count'] > 0,
+                'door_open': row['door_open_count'] > 0,
+                'motion_count': row['motion_count'],
+                'flame_count': row['flame_count'],
+                'door_open_count': row['door_open_count']
             })
-        
-        return jsonify({'data': history})
+            history.append(point)
+        
+        response = {'data': history, 'resolution': resolution}
+        if start is not None:
+            response['start'] = start.isoformat()
+            response['end'] = end.isoformat()
+        return jsonify(response)
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid range: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/db/pool-stats', methods=['GET'])
+@login_required
+def get_db_pool_stats():
+    """Get database connection pool statistics"""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/ingest/stages', methods=['GET'])
+@login_required
+def get_ingest_stages():
+    """Time spent per ingest stage (parse, decrypt, insert, rollups, alerts, sensor_events, commit, smtp_send)"""
+    try:
+        return jsonify({
+            'stages': stage_tracer.summary(),
+            'trace_sample_rate': stage_tracer.sample_rate,
+            'trace_file': TRACE_FILE if stage_tracer.sample_rate > 0 else None,
+            'traces_written': stage_tracer.traces_written,
+            'traces_dropped': trace_handler.dropped
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/db/profile', methods=['GET'])
+@login_required
+def get_db_profile():
+    """Profiler settings and the recent requests with the most DB time (?limit=10), admin only"""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    try:
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+        return jsonify({
+            'enabled': db_profiler.enabled,
+            'slow_query_ms': db_profiler.slow_query_ms,
+            'requests_profiled': db_profiler.stats['requests'],
+            'slow_queries': db_profiler.stats['slow_queries'],
+            'worst': db_profiler.worst(limit)
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def log_event(event_type, message):
-    """Log event to database"""
+@app.route('/api/db/profile', methods=['PUT'])
+@login_required
+def update_db_profile():
+    """Switch profiling on/off or change the slow-query threshold, e.g. {"enabled": true, "slow_query_ms": 50};
+    {"clear": true} forgets the profiled requests. Admin only, not persisted across restarts."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    try:
+        data = request.get_json() or {}
+        if 'slow_query_ms' in data:
+            try:
+                slow_query_ms = float(data['slow_query_ms'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'slow_query_ms must be a number'}), 400
+            if slow_query_ms < 0:
+                return jsonify({'error': 'slow_query_ms must not be negative'}), 400
+            db_profiler.slow_query_ms = slow_query_ms
+        if 'enabled' in data:
+            db_profiler.enabled = bool(data['enabled'])
+        if data.get('clear'):
+            db_profiler.clear()
+        log.info("🔬 DB profiling %s (slow query threshold %.0f ms)",
+                 'enabled' if db_profiler.enabled else 'disabled', db_profiler.slow_query_ms)
+        return jsonify({'success': True, 'enabled': db_profiler.enabled, 'slow_query_ms': db_profiler.slow_query_ms})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ingest/stats', methods=['GET'])
+@login_required
+def get_ingest_stats():
+    """Get background ingest queue depths and counters"""
+    return jsonify({
+        'async_side_effects': INGEST_ASYNC_SIDE_EFFECTS,
+        'side_effect_queue': side_effect_queue.stats(),
+        'sensor_event_writer': dict(sensor_event_writer.stats,
+                                    pending=sensor_event_writer.pending(),
+                                    flush_interval=sensor_event_writer.flush_interval),
+        'sensor_event_filter': dict(sensor_event_filter.stats,
+                                    mode=SENSOR_EVENT_MODE,
+                                    keyframe_interval=sensor_event_filter.keyframe_interval),
+        'logging': {'level': logging.getLevelName(log.level),
+                    'queued': log_handler.queue.qsize(),
+                    'dropped': log_handler.dropped,
+                    'rate_limited': log_throttle.suppressed}
+    })
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    db_profiler.begin(request.method, request.path)
+    stage_tracer.begin(f'{request.method} {request.path}')
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # The URL rule, not the path, so /api/history/<sensor> is one series; 404s share 'unmatched'
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('smart_home_http_request_duration_seconds', elapsed, (request.method, route))
+        metrics.inc('smart_home_http_requests_total', (request.method, route, str(response.status_code)))
+        profile = db_profiler.end(route, response.status_code, elapsed * 1000.0)
+        if profile is not None:
+            response.headers['Server-Timing'] = QueryProfiler.server_timing(profile)
+        stage_tracer.end(response.status_code)
+    return response
+
+metrics.counter('smart_home_email_total', 'E-mails by outcome (retried ones are attempted again later)', ('result',))
+metrics.counter('smart_home_db_connections_opened_total', 'Physical PostgreSQL connections opened')
+metrics.counter('smart_home_db_connections_closed_total', 'Physical PostgreSQL connections closed')
+metrics.counter('smart_home_db_checkouts_total', 'Connections checked out of the pool')
+metrics.counter('smart_home_db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+metrics.counter('smart_home_db_statements_total', 'Statements executed on pooled connections')
+metrics.counter('smart_home_db_commits_total', 'Commits and rollbacks on pooled connections')
+metrics.gauge('smart_home_db_connections', 'Open pool connections by state', ('state',))
+metrics.gauge('smart_home_queue_depth', 'Items waiting in background queues', ('queue',))
+metrics.counter('smart_home_log_records_dropped_total', 'Log records dropped', ('reason',))
+metrics.counter('smart_home_db_slow_queries_total', 'Statements over DB_SLOW_QUERY_MS while profiling')
+metrics.gauge('smart_home_stream_clients', 'Connected dashboard event streams')
+
+@metrics.collector
+def collect_component_metrics():
+    """Counters and depths the components already keep, read at scrape time"""
+    yield 'smart_home_email_total', ('sent',), email_dispatcher.sent
+    yield 'smart_home_email_total', ('failed',), email_dispatcher.failed
+    yield 'smart_home_email_total', ('retried',), email_dispatcher.retried
+    pool = db_pool.stats()
+    yield 'smart_home_db_connections_opened_total', (), pool['connections_opened']
+    yield 'smart_home_db_connections_closed_total', (), pool['connections_closed']
+    yield 'smart_home_db_checkouts_total', (), pool['checkouts']
+    yield 'smart_home_db_pool_timeouts_total', (), pool['timeouts']
+    yield 'smart_home_db_statements_total', (), pool['statements']
+    yield 'smart_home_db_commits_total', (), pool['commits']
+    yield 'smart_home_db_connections', ('idle',), pool['idle']
+    yield 'smart_home_db_connections', ('in_use',), pool['in_use']
+    yield 'smart_home_queue_depth', ('side_effects',), side_effect_queue.depth()
+    yield 'smart_home_queue_depth', ('sensor_events',), sensor_event_writer.pending()
+    yield 'smart_home_queue_depth', ('log',), log_handler.queue.qsize()
+    yield 'smart_home_log_records_dropped_total', ('queue_full',), log_handler.dropped
+    yield 'smart_home_log_records_dropped_total', ('rate_limited',), log_throttle.suppressed
+    yield 'smart_home_db_slow_queries_total', (), db_profiler.stats['slow_queries']
+    yield 'smart_home_stream_clients', (), broadcaster.clients
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the server's counters, histograms and queue depths"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def update_system_control(query, params=None, tx=None):
+    """Run an UPDATE against system_control, inside tx if given, otherwise on its own connection.
+    The updated row is written through to state_cache (after commit when inside tx)."""
+    query = query.rstrip() + ' RETURNING *'
+    if tx is not None:
+        tx.cur.execute(query, params)
+        row = tx.cur.fetchone()
+        tx.summary['control_updates'] += 1
+        if row is not None:
+            tx.system_control = dict(row)
+            tx.after_commit(state_cache.put_system_control, dict(row))
+        return tx.cur.rowcount
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(query, params)
+    row = cur.fetchone()
+    rowcount = cur.rowcount
+    conn.commit()
+    conn.close()
+    if row is not None:
+        state_cache.put_system_control(row)
+    return rowcount
+
+def update_sensor_board_control(query, params=None):
+    """Run an UPDATE/INSERT against sensor_board_control and write the row through to state_cache"""
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(query.rstrip() + ' RETURNING *', params)
+    row = cur.fetchone()
+    rowcount = cur.rowcount
+    conn.commit()
+    conn.close()
+    if row is not None:
+        state_cache.put_sensor_board_control(row)
+    return rowcount
+
+# Sensors with structured event_log rows, and the flag /api/history/<sensor> reports for them
+HISTORY_SENSORS = {
+    'motion': 'motion_detected',
+    'door': 'door_open',
+    'fire': 'flame_detected',
+    'air_quality': 'gas_detected',
+    'sound': 'loud_noise'
+}
+
+# (message pattern, sensor, event_code) for event_log rows written before the structured columns existed;
+# more specific patterns first
+EVENT_LOG_BACKFILL_PATTERNS = [
+    ('%Motion detected while away%', 'motion', 'motion_away'),
+    ('%Motion detected%', 'motion', 'motion_detected'),
+    ('%Door opened while away%', 'door', 'door_away'),
+    ('%Door/Window opened%', 'door', 'door_opened'),
+    ('%Fire detected%', 'fire', 'fire_detected'),
+    ('%Gas leak detected%', 'air_quality', 'gas_detected'),
+    ('%Loud noise detected%', 'sound', 'loud_noise')
+]
+
+def backfill_event_log_fields(cur):
+    """Derive sensor/event_code/severity for event_log rows written before those columns existed"""
+    tagged = 0
+    for pattern, sensor, code in EVENT_LOG_BACKFILL_PATTERNS:
+        cur.execute('''
+            UPDATE event_log SET sensor = %s, event_code = %s
+            WHERE sensor IS NULL AND event_message LIKE %s
+        ''', (sensor, code, pattern))
+        tagged += cur.rowcount
+    cur.execute('''
+        UPDATE event_log
+        SET severity = CASE WHEN event_code IN ('fire_detected', 'gas_detected') THEN 'critical'
+                            WHEN event_type = 'ALERT' THEN 'warning'
+                            ELSE 'info' END
+    ''')
+    log.info("✅ Event log backfilled with structured fields (%d sensor events)", tagged)
+
+def log_event(event_type, message, tx=None, sensor=None, code=None, severity=None):
+    """Log event to database.
+    sensor (a HISTORY_SENSORS key) and code tag sensor events for /api/history/<sensor>;
+    severity defaults to 'warning' for ALERT and 'info' otherwise."""
+    try:
+        if severity is None:
+            severity = 'warning' if event_type == 'ALERT' else 'info'
+        if tx is not None and tx.defer_side_effects:
+            tx.defer(log_event, event_type, message, sensor=sensor, code=code, severity=severity)
+            return
+        if tx is not None:
+            tx.cur.execute('''
+                INSERT INTO event_log (event_type, event_message, sensor, event_code, severity)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING timestamp
+            ''', (event_type, message, sensor, code, severity))
+            timestamp = tx.cur.fetchone()['timestamp']
+            tx.summary['event_log'] += 1
+            tx.after_commit(event_log_counter.add)
+            if sensor:
+                tx.after_commit(metrics.inc, 'smart_home_sensor_alerts_total', (sensor, code or '', severity))
+            tx.after_commit(publish_event_log, event_type, message, timestamp)
+            return
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO event_log (event_type, event_message, sensor, event_code, severity)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING timestamp
+        ''', (event_type, message, sensor, code, severity))
+        timestamp = cur.fetchone()[0]
+        conn.commit()
+        conn.close()
+        event_log_counter.add()
+        if sensor:
+            metrics.inc('smart_home_sensor_alerts_total', (sensor, code or '', severity))
+        publish_event_log(event_type, message, timestamp)
+    except Exception as e:
+        log.error("Error logging event: %s", e)
+        if tx is not None:
+            raise
+
+def log_sensor_event(sensor_name, sensor_information, action_taken, tx=None):
+    """Log a sensor event with action taken"""
+    try:
+        # Ensure all values are strings and not None
+        sensor_name = str(sensor_name) if sensor_name is not None else 'Unknown Sensor'
+        sensor_information = str(sensor_information) if sensor_information is not None else 'N/A'
+        action_taken = str(action_taken) if action_taken is not None else 'No action'
+        
+        if tx is not None:
+            tx.cur.execute('''
+                INSERT INTO sensor_events (sensor_name, sensor_information, action_taken, timestamp) 
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ''', (sensor_name, sensor_information, action_taken))
+            tx.summary['sensor_events'] += 1
+            return
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # Explicitly set timestamp to ensure it's current
+        cur.execute('''
+            INSERT INTO sensor_events (sensor_name, sensor_information, action_taken, timestamp) 
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ''', (sensor_name, sensor_information, action_taken))
+        conn.commit()
+        conn.close()
+        
+        log.debug("✅ Logged sensor event: %s", sensor_name)
+    except Exception as e:
+        if tx is not None:
+            log.error("❌ Error logging sensor event for %s: %s", sensor_name, e)
+            raise
+        log.exception("❌ Error logging sensor event for %s: %s", sensor_name, e)
+
+# Partitioned tables: name -> (partition key column, retention days)
+PARTITIONED_TABLES = {
+    'sensor_data': ('created_at', SENSOR_DATA_RETENTION_DAYS),
+    'sensor_events': ('timestamp', SENSOR_EVENTS_RETENTION_DAYS)
+}
+
+def partition_period_start(day):
+    """First day of the partition period containing day (weekly periods start on Monday)"""
+    if SENSOR_PARTITIONING == 'weekly':
+        return day - timedelta(days=day.weekday())
+    return day
+
+def partition_step():
+    return timedelta(days=7 if SENSOR_PARTITIONING == 'weekly' else 1)
+
+def partition_table(cur, table):
+    """Turn an ordinary table into one range-partitioned on its time column (no-op if it already is).
+    Creates partitions from the oldest kept row through the upcoming periods plus a default
+    partition, copies the rows over (skipping rows already past retention) and keeps the id sequence."""
+    column, retention_days = PARTITIONED_TABLES[table]
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    if not row or row[0] != 'r':
+        ensure_partitions(cur, table)
+        return
+    
+    log.info("🔄 Converting %s to %s partitions...", table, SENSOR_PARTITIONING)
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    sequence = cur.fetchone()[0]
+    cur.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+    cur.execute(f'''
+        CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE ({column})
+    ''')
+    cur.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, {column})')
+    if sequence:
+        cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    
+    if retention_days > 0:
+        kept = f"{column} >= CURRENT_TIMESTAMP - {int(retention_days)} * INTERVAL '1 day'"
+    else:
+        kept = f'{column} IS NOT NULL'
+    cur.execute(f'SELECT MIN({column}) FROM {table}_unpartitioned WHERE {kept}')
+    oldest = cur.fetchone()[0]
+    ensure_partitions(cur, table, oldest.date() if oldest else None)
+    
+    cur.execute(f'INSERT INTO {table} SELECT * FROM {table}_unpartitioned WHERE {kept}')
+    copied = cur.rowcount
+    cur.execute(f'DROP TABLE {table}_unpartitioned')
+    log.info("✅ %s partitioned (%d rows kept)", table, copied)
+
+def create_partition(cur, table, start):
+    """Create the partition for the period starting at start (no-op if it exists).
+    Rows that already landed in the default partition for that period (e.g. readings stamped
+    ahead by the board clock) would make a plain CREATE ... PARTITION OF fail, so the partition
+    is built as a standalone table, those rows are moved into it and it is then attached."""
+    column = PARTITIONED_TABLES[table][0]
+    name = f"{table}_p{start.strftime('%Y%m%d')}"
+    cur.execute('SELECT to_regclass(%s)', (name,))
+    if cur.fetchone()[0]:
+        return False
+    end = start + partition_step()
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    in_range = f"{column} >= '{start.isoformat()}' AND {column} < '{end.isoformat()}'"
+    cur.execute(f'SELECT 1 FROM {table}_default WHERE {in_range} LIMIT 1')
+    if cur.fetchone() is None:
+        cur.execute(f'CREATE TABLE {name} PARTITION OF {table} {bounds}')
+        return True
+    
+    cur.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+    cur.execute(f'''
+        WITH moved AS (DELETE FROM {table}_default WHERE {in_range} RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    ''')
+    moved = cur.rowcount
+    cur.execute(f'ALTER TABLE {name} ADD CONSTRAINT {name}_range CHECK ({in_range})')  # lets ATTACH skip its own scan
+    cur.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} {bounds}')
+    cur.execute(f'ALTER TABLE {name} DROP CONSTRAINT {name}_range')
+    log.info("📦 Moved %d rows of %s from the default partition into %s", moved, table, name)
+    return True
+
+def ensure_partitions(cur, table, first=None):
+    """Create the default partition and the partitions from first (default: the current period)
+    to SENSOR_PARTITION_PREMAKE periods ahead. Each partition is created in its own savepoint, so
+    one that cannot be created is logged and skipped instead of failing the whole run."""
+    cur.execute(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT')
+    today = partition_period_start(datetime.now(timezone.utc).date())
+    start = partition_period_start(min(first, today) if first else today)
+    last = today + partition_step() * SENSOR_PARTITION_PREMAKE
+    while start <= last:
+        cur.execute('SAVEPOINT create_partition')
+        try:
+            create_partition(cur, table, start)
+            cur.execute('RELEASE SAVEPOINT create_partition')
+        except Exception as e:
+            cur.execute('ROLLBACK TO SAVEPOINT create_partition')
+            log.error("❌ Could not create %s partition for %s: %s", table, start, e)
+        start += partition_step()
+
+def drop_expired_partitions(cur, table):
+    """Enforce retention by dropping whole partitions that ended before the cutoff.
+    Old rows in the default partition (e.g. readings with an unsynced device clock) are deleted."""
+    column, retention_days = PARTITIONED_TABLES[table]
+    if retention_days <= 0:
+        return []
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    cur.execute('''
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+    ''', (table,))
+    dropped = []
+    for (name,) in cur.fetchall():
+        suffix = name[len(table) + 2:]
+        if not name.startswith(f'{table}_p') or len(suffix) != 8 or not suffix.isdigit():
+            continue
+        start = datetime.strptime(suffix, '%Y%m%d').date()
+        if start + partition_step() <= cutoff:
+            cur.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    cur.execute(f'DELETE FROM {table}_default WHERE {column} < %s', (cutoff,))
+    return dropped
+
+def run_partition_maintenance():
+    """Create upcoming partitions and drop expired ones, then schedule the next run.
+    Retention for each table runs in its own savepoint so a failure elsewhere cannot block it."""
+    try:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            for table in PARTITIONED_TABLES:
+                ensure_partitions(cur, table)
+                cur.execute('SAVEPOINT partition_retention')
+                try:
+                    dropped = drop_expired_partitions(cur, table)
+                    cur.execute('RELEASE SAVEPOINT partition_retention')
+                except Exception as e:
+                    cur.execute('ROLLBACK TO SAVEPOINT partition_retention')
+                    log.error("❌ Retention for %s failed: %s", table, e)
+                    continue
+                if dropped:
+                    log.info("🗑️ Dropped expired partitions: %s", ', '.join(dropped))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        log.error("❌ Partition maintenance failed: %s", e)
+    timer_scheduler.schedule('partition-maintenance', SENSOR_PARTITION_MAINTENANCE_INTERVAL, run_partition_maintenance)
+
+# Rollup tables: sensor_rollup_<resolution>, one row per bucket
+ROLLUP_RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}  # bucket width in seconds
+ROLLUP_METRICS = ('temperature', 'humidity', 'air_quality', 'sound_level', 'light_level')
+ROLLUP_COUNTS = (('motion_count', 'pir_motion'), ('flame_count', 'flame_detected'), ('door_open_count', 'door_open'))
+
+def rollup_bucket(created_at, resolution):
+    """Start of the UTC bucket containing created_at (naive, like the TIMESTAMP columns)"""
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if resolution == 'minute':
+        return created_at.replace(second=0, microsecond=0)
+    if resolution == 'hour':
+        return created_at.replace(minute=0, second=0, microsecond=0)
+    return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+@stage_tracer.timed('rollups')
+def update_sensor_rollups(cur, readings):
+    """Fold readings (dicts with the sensor_data columns and created_at) into the minute/hour/day
+    rollups on cur, in one round trip. Readings are pre-aggregated per bucket, then upserted."""
+    columns = ['bucket', 'samples']
+    for metric in ROLLUP_METRICS:
+        columns += [f'{metric}_min', f'{metric}_max', f'{metric}_sum']
+    columns += [count for count, _ in ROLLUP_COUNTS]
+    
+    updates = ['samples = r.samples + EXCLUDED.samples']
+    for metric in ROLLUP_METRICS:
+        updates += [f'{metric}_min = LEAST(r.{metric}_min, EXCLUDED.{metric}_min)',
+                    f'{metric}_max = GREATEST(r.{metric}_max, EXCLUDED.{metric}_max)',
+                    f'{metric}_sum = r.{metric}_sum + EXCLUDED.{metric}_sum']
+    updates += [f'{count} = r.{count} + EXCLUDED.{count}' for count, _ in ROLLUP_COUNTS]
+    
+    statements = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        buckets = {}
+        for reading in readings:
+            bucket = rollup_bucket(reading['created_at'], resolution)
+            agg = buckets.get(bucket)
+            if agg is None:
+                agg = buckets[bucket] = {'samples': 0, 'counts': [0] * len(ROLLUP_COUNTS),
+                                         'metrics': {metric: [None, None, 0.0] for metric in ROLLUP_METRICS}}
+            agg['samples'] += 1
+            for metric in ROLLUP_METRICS:
+                value = float(reading[metric])
+                low, high, total = agg['metrics'][metric]
+                agg['metrics'][metric] = [value if low is None else min(low, value),
+                                          value if high is None else max(high, value),
+                                          total + value]
+            for i, (_, field) in enumerate(ROLLUP_COUNTS):
+                agg['counts'][i] += 1 if reading[field] else 0
+        values = []
+        for bucket, agg in sorted(buckets.items()):
+            row = [bucket, agg['samples']]
+            for metric in ROLLUP_METRICS:
+                row += agg['metrics'][metric]
+            row += agg['counts']
+            values.append(cur.mogrify('(' + ', '.join(['%s'] * len(row)) + ')', row).decode())
+        statements.append(f'''
+            INSERT INTO sensor_rollup_{resolution} AS r ({', '.join(columns)})
+            VALUES {', '.join(values)}
+            ON CONFLICT (bucket) DO UPDATE SET {', '.join(updates)}
+        ''')
+    cur.execute(';'.join(statements))
+
+def backfill_sensor_rollups(cur):
+    """Build rollups from existing sensor_data the first time the rollup tables exist"""
+    cur.execute('SELECT EXISTS (SELECT 1 FROM sensor_rollup_minute) AS has_rollups, EXISTS (SELECT 1 FROM sensor_data) AS has_data')
+    has_rollups, has_data = cur.fetchone()
+    if has_rollups or not has_data:
+        return
+    for resolution in ROLLUP_RESOLUTIONS:
+        aggregates = []
+        for metric in ROLLUP_METRICS:
+            aggregates += [f'MIN({metric})', f'MAX({metric})', f'SUM({metric})']
+        aggregates += [f'COUNT(*) FILTER (WHERE {field})' for _, field in ROLLUP_COUNTS]
+        cur.execute(f'''
+            INSERT INTO sensor_rollup_{resolution}
+            SELECT date_trunc('{resolution}', created_at), COUNT(*), {', '.join(aggregates)}
+            FROM sensor_data
+            WHERE created_at IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (bucket) DO NOTHING
+        ''')
+    log.info("✅ Sensor rollups backfilled from sensor_data")
+
+def write_sensor_events(cur, rows):
+    """Insert sensor_events rows on cur with a single statement.
+    rows are (sensor_name, sensor_information, action_taken, timestamp, is_keyframe) tuples, timestamp may
+    be None (= CURRENT_TIMESTAMP). Large batches go through COPY, small ones through one multi-row INSERT."""
+    if not rows:
+        return 0
+    if len(rows) >= SENSOR_EVENT_COPY_THRESHOLD:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        now = datetime.now(timezone.utc)
+        for sensor_name, sensor_information, action_taken, timestamp, is_keyframe in rows:
+            writer.writerow((sensor_name, sensor_information, action_taken, (timestamp or now).isoformat(),
+                             't' if is_keyframe else 'f'))
+        buf.seek(0)
+        cur.copy_expert('''
+            COPY sensor_events (sensor_name, sensor_information, action_taken, timestamp, is_keyframe)
+            FROM STDIN WITH (FORMAT csv)
+        ''', buf)
+    else:
+        execute_values(cur, '''
+            INSERT INTO sensor_events (sensor_name, sensor_information, action_taken, timestamp, is_keyframe)
+            VALUES %s
+        ''', rows, template='(%s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s)', page_size=len(rows))
+    return len(rows)
+
+def log_sensor_events(rows, tx=None, keyframe=False, at=None):
+    """Log several sensor events at once.
+    rows: [(sensor_name, sensor_information, action_taken)]. Written in one statement inside tx
+    (or on a pooled connection), or handed to the coalescing writer when
+    SENSOR_EVENT_FLUSH_INTERVAL is set. keyframe marks the rows as a full snapshot of all sensors;
+    at is their timestamp (default: now)."""
+    rows = [(str(name) if name is not None else 'Unknown Sensor',
+             str(info) if info is not None else 'N/A',
+             str(action) if action is not None else 'No action')
+            for name, info, action in rows]
+    if sensor_event_writer.enabled:
+        sensor_event_writer.add(rows, keyframe, at)
+        return 0
+    return store_sensor_events([row + (at, keyframe) for row in rows], tx=tx)
+
+def store_sensor_events(rows, tx=None):
+    """Write complete write_sensor_events() rows inside tx, or on a pooled connection"""
+    if tx is not None:
+        count = write_sensor_events(tx.cur, rows)
+        tx.summary['sensor_events'] += count
+        return count
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO event_log (event_type, event_message)
-            VALUES (%s, %s)
-        ''', (event_type, message))
+        count = write_sensor_events(conn.cursor(), rows)
         conn.commit()
+    finally:
         conn.close()
-    except Exception as e:
-        print(f"Error logging event: {e}")
+    return count
 
-def log_sensor_event(sensor_name, sensor_information, action_taken):
-    """Log a sensor event with action taken"""
+class SensorEventWriter:
+    """Coalesces sensor_events rows from several readings and flushes them in bulk.
+    Each row keeps the time it was logged; the background thread flushes every
+    flush_interval seconds (or sooner when a batch reaches the COPY threshold)."""
+
+    def __init__(self, flush_interval, max_buffer=10000):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._rows = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self.stats = {'rows_written': 0, 'flushes': 0, 'rows_dropped': 0, 'flush_errors': 0}
+
+    @property
+    def enabled(self):
+        return self.flush_interval > 0
+
+    def add(self, rows, keyframe=False, at=None):
+        now = at or datetime.now(timezone.utc)
+        with self._lock:
+            self._rows.extend(row + (now, keyframe) for row in rows)
+            overflow = len(self._rows) - self.max_buffer
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.stats['rows_dropped'] += overflow
+            pending = len(self._rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sensor-event-writer', daemon=True)
+                self._thread.start()
+        if pending >= SENSOR_EVENT_COPY_THRESHOLD:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all buffered rows; on failure they stay buffered for the next attempt"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        try:
+            conn = get_db_connection()
+            try:
+                write_sensor_events(conn.cursor(), rows)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log.error("❌ Error flushing %d sensor events: %s", len(rows), e)
+            with self._lock:
+                self._rows[:0] = rows
+                self.stats['flush_errors'] += 1
+                overflow = len(self._rows) - self.max_buffer
+                if overflow > 0:
+                    del self._rows[:overflow]
+                    self.stats['rows_dropped'] += overflow
+            return 0
+        with self._lock:
+            self.stats['rows_written'] += len(rows)
+            self.stats['flushes'] += 1
+        return len(rows)
+
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self):
+        """Stop the flush thread and write whatever is still buffered"""
+        self._stopping = True
+        self._wakeup.set()
+        self.flush()
+
+sensor_event_writer = SensorEventWriter(SENSOR_EVENT_FLUSH_INTERVAL, SENSOR_EVENT_BUFFER_MAX)
+
+_SENSOR_EVENT_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+class SensorEventFilter:
+    """Decides which sensor_events rows a reading produces.
+    Every keyframe_interval seconds all sensors are written as a keyframe. In between, with
+    changes_only, a sensor is written only when its state or action text changes or one of its
+    readings moved more than its deadband away from the last value written for it (numbers
+    without a deadband, such as thresholds, count as changed on any difference).
+    The timeline is rebuilt by carrying each sensor's last row forward from the latest keyframe."""
+
+    def __init__(self, changes_only, keyframe_interval, deadbands):
+        self.changes_only = changes_only
+        self.keyframe_interval = keyframe_interval
+        self.deadbands = deadbands
+        self._last = {}
+        self._last_keyframe = None
+        self._lock = threading.Lock()
+        self.stats = {'rows_seen': 0, 'rows_written': 0, 'keyframes': 0}
+
+    @staticmethod
+    def _signature(row):
+        sensor_name, sensor_information, action_taken = row
+        values = tuple(float(v) for v in _SENSOR_EVENT_NUMBER.findall(sensor_information))
+        return (_SENSOR_EVENT_NUMBER.sub('#', sensor_information), _SENSOR_EVENT_NUMBER.sub('#', action_taken), values)
+
+    def _changed(self, row, last_rows):
+        last = last_rows.get(row[0])
+        if last is None:
+            return True
+        info, action, values = self._signature(row)
+        if (info, action) != last[:2] or len(values) != len(last[2]):
+            return True
+        bands = self.deadbands.get(row[0], ())
+        for i, (value, previous) in enumerate(zip(values, last[2])):
+            if abs(value - previous) > (bands[i] if i < len(bands) else 0):
+                return True
+        return False
+
+    def select(self, rows, staged=None):
+        """(rows to write, is_keyframe) for one reading's describe_sensor_actions() rows.
+        Readings of one uncommitted batch pass the same staged dict, so each is compared
+        with the rows already selected before it instead of only with committed ones."""
+        with self._lock:
+            self.stats['rows_seen'] += len(rows)
+            keyframe = (self._last_keyframe is None
+                        or time.monotonic() - self._last_keyframe >= self.keyframe_interval)
+            last_rows = self._last
+            if staged is not None:
+                keyframe = keyframe and not staged.get('keyframe')
+                last_rows = dict(self._last, **staged.setdefault('last', {}))
+            if keyframe or not self.changes_only:
+                selected = list(rows)
+            else:
+                selected = [row for row in rows if self._changed(row, last_rows)]
+        if staged is not None:
+            staged['keyframe'] = staged.get('keyframe') or keyframe
+            staged['last'].update((row[0], self._signature(row)) for row in selected)
+        return selected, keyframe
+
+    def remember(self, rows, keyframe):
+        """Record rows as written (after commit when logged inside a transaction)"""
+        with self._lock:
+            for row in rows:
+                self._last[row[0]] = self._signature(row)
+            self.stats['rows_written'] += len(rows)
+            if keyframe:
+                self._last_keyframe = time.monotonic()
+                self.stats['keyframes'] += 1
+
+sensor_event_filter = SensorEventFilter(SENSOR_EVENT_MODE == 'changes', SENSOR_EVENT_KEYFRAME_INTERVAL, {
+    'MQ135 Air Quality Sensor': (SENSOR_EVENT_DEADBAND_AIR_QUALITY,),
+    'Sound Sensor': (SENSOR_EVENT_DEADBAND_SOUND,),
+    'LDR Light Sensor': (SENSOR_EVENT_DEADBAND_LIGHT,),
+    'DHT11 Temperature & Humidity': (SENSOR_EVENT_DEADBAND_TEMPERATURE, SENSOR_EVENT_DEADBAND_HUMIDITY)
+})
+
+class AlertDecision:
+    """What one combination of sensor conditions and control modes leads to (an entry of the decision table)"""
+    __slots__ = ('conditions', 'buzzer', 'light', 'critical', 'hazard', 'other_sensor_active', 'motion_door_fire',
+                 'low_light_trigger', 'manual_overrides', 'effects', 'actions')
+
+class CompiledAlertRules:
+    """alert_rules thresholds and sensor_controls flags compiled into a decision table.
+    A reading's conditions and the control modes form a 9-bit index; the entry at that index holds the
+    alert conditions, the buzzer/light demand, the ordered event log entries and notifications, and the
+    per-sensor display strings (as str.format templates of the reading's values)."""
+
+    MOTION, FLAME, DOOR, GAS, LOUD, DARK, AWAY, MANUAL, LIGHT_ON = (1 << bit for bit in range(9))
+
+    def __init__(self, key, rules, sensor_controls):
+        self.key = key
+        self.rules = rules
+        self.air_quality_threshold = rules['air_quality_threshold']
+        self.sound_threshold = rules['sound_threshold']
+        self.light_threshold = rules['light_threshold']
+        self.motion_buzzer_timeout = rules['motion_buzzer_timeout']
+        self.motion_light_timeout = rules['motion_light_timeout']
+        self.other_sensors_timeout = rules['other_sensors_timeout']
+        
+        def enabled(sensor_name, control_type):
+            return sensor_controls.get(sensor_name, {}).get(control_type + '_enabled', True)
+        self._enabled = enabled
+        self.motion_light_enabled = enabled('PIR Motion Sensor', 'light')
+        # Any sensor that can hold the light on for the short timeout
+        self.other_light_enabled = any(enabled(name, 'light') for name in
+                                       ('Flame Sensor', 'MQ135 Air Quality Sensor', 'Sound Sensor', 'Reed Switch (Door Sensor)'))
+        self.table = [self._compile(index) for index in range(1 << 9)]
+
+    def _compile(self, index):
+        motion, flame, door, gas, loud, dark, away, manual, light_on = (bool(index & (1 << bit)) for bit in range(9))
+        enabled = self._enabled
+        d = AlertDecision()
+        conditions, effects = [], []
+        buzzer = light = False
+        
+        # Fire and gas are critical - buzzer/light regardless of mode
+        if flame:
+            conditions.append('FIRE DETECTED')
+            buzzer |= enabled('Flame Sensor', 'buzzer')
+            light |= enabled('Flame Sensor', 'light')
+            effects.append(('event', 'ALERT', '🔥 Fire detected!', {'sensor': 'fire', 'code': 'fire_detected', 'severity': 'critical'}))
+            effects.append(('notify', 'Fire Alert', 'Fire detected in your home! Please check immediately.', 'fire', False))
+        if gas:
+            conditions.append('GAS LEAK')
+            buzzer |= enabled('MQ135 Air Quality Sensor', 'buzzer')
+            light |= enabled('MQ135 Air Quality Sensor', 'light')
+            effects.append(('event', 'ALERT', '⚠️ Gas leak detected! Air quality: {air_quality}',
+                            {'sensor': 'air_quality', 'code': 'gas_detected', 'severity': 'critical'}))
+            # Throttled to AIR_QUALITY_NOTIFICATION_INTERVAL
+            effects.append(('notify', 'Gas Leak Alert', 'Gas leak detected! Air quality reading: {air_quality}', 'warning', True))
+            effects.append(('notify', 'Air Quality Alert', 'Gas leak detected! Air quality reading: {air_quality}', 'air_quality', True))
+        # Loud noise (glass breaking, etc.) only activates in AUTO mode
+        if loud:
+            conditions.append('LOUD NOISE')
+            if not manual:
+                buzzer |= enabled('Sound Sensor', 'buzzer')
+                light |= enabled('Sound Sensor', 'light')
+            effects.append(('event', 'ALERT', '🔊 Loud noise detected! Sound level: {sound_level}', {'sensor': 'sound', 'code': 'loud_noise'}))
+            effects.append(('notify', 'Loud Noise Alert', 'Loud noise detected! Sound level: {sound_level}', 'sound', False))
+        if motion:
+            effects.append(('event', 'INFO', '👁️ Motion detected', {'sensor': 'motion', 'code': 'motion_detected'}))
+            effects.append(('notify', 'Motion Alert', 'Motion detected in your home', 'motion', False))
+            conditions.append('MOTION DETECTED')
+            if away:
+                conditions.append('MOTION WHILE AWAY')
+                buzzer |= enabled('PIR Motion Sensor', 'buzzer')
+                light |= enabled('PIR Motion Sensor', 'light')
+                effects.append(('event', 'ALERT', '🚨 Motion detected while away!', {'sensor': 'motion', 'code': 'motion_away'}))
+                effects.append(('notify', 'Security Alert', 'Motion detected while system is in away mode', 'motion', False))
+            elif not manual:
+                # In HOME mode motion triggers the light (motion light timeout), but not the buzzer
+                light |= enabled('PIR Motion Sensor', 'light')
+        if door:
+            effects.append(('event', 'INFO', '🚪 Door/Window opened', {'sensor': 'door', 'code': 'door_opened'}))
+            effects.append(('notify', 'Door Alert', 'Door or window has been opened', 'door', False))
+            conditions.append('DOOR OPENED')
+            if away:
+                conditions.append('DOOR OPEN WHILE AWAY')
+                effects.append(('event', 'ALERT', '🚨 Door opened while away!', {'sensor': 'door', 'code': 'door_away'}))
+                effects.append(('notify', 'Security Alert', 'Door or window opened while system is in away mode', 'door', False))
+                if not manual:
+                    buzzer |= enabled('Reed Switch (Door Sensor)', 'buzzer')
+                    light |= enabled('Reed Switch (Door Sensor)', 'light')
+            if not manual and dark:
+                light |= enabled('Reed Switch (Door Sensor)', 'light')
+        
+        d.conditions = tuple(conditions)
+        d.effects = tuple(effects)
+        d.buzzer, d.light = buzzer, light
+        d.critical = flame or gas
+        d.hazard = flame or gas or loud
+        d.other_sensor_active = d.hazard or door
+        d.motion_door_fire = motion or door or flame
+        # Motion or door in low light may switch the light on once its previous timeout has passed
+        d.low_light_trigger = dark and ((motion and self.motion_light_enabled) or
+                                        (door and enabled('Reed Switch (Door Sensor)', 'light')))
+        # Critical alerts that switch the light on even in manual mode
+        d.manual_overrides = tuple(label for label, active, sensor_name in
+                                   (('fire', flame, 'Flame Sensor'), ('gas', gas, 'MQ135 Air Quality Sensor'))
+                                   if active and enabled(sensor_name, 'light'))
+        d.actions = self._compile_actions(motion, flame, door, gas, loud, dark, away, manual, light_on)
+        return d
+
+    def _compile_actions(self, motion, flame, door, gas, loud, dark, away, manual, light_on):
+        """(sensor_name, sensor_information, action_taken) templates for the 7 sensors"""
+        def presence_action(active, idle):
+            if not active:
+                return idle
+            if not manual and dark:
+                return 'Light ON (auto - low light)'
+            if away:
+                return 'Buzzer ON, Light ON (away mode)'
+            return 'No action (normal conditions)'
+        
+        if dark:
+            ldr = 'Light ON (low light detected)' if light_on else f'Light ready (low light: {{light_level}} < {self.light_threshold})'
+        else:
+            ldr = 'No action (sufficient light: {light_level})'
+        return (
+            ('PIR Motion Sensor', f'Motion: {"Detected" if motion else "None"}',
+             presence_action(motion, 'No action (no motion)')),
+            ('Flame Sensor', f'Fire: {"Detected" if flame else "None"}',
+             'Buzzer ON, Light ON' if flame else 'No action (no fire detected)'),
+            ('MQ135 Air Quality Sensor', f'Reading: {{air_quality}} (threshold: {self.air_quality_threshold})',
+             'Buzzer ON, Light ON' if gas else f'No action (normal: {{air_quality}} < {self.air_quality_threshold})'),
+            ('Reed Switch (Door Sensor)', f'Door: {"Open" if door else "Closed"}',
+             presence_action(door, 'No action (door closed)')),
+            ('Sound Sensor', f'Level: {{sound_level}} (threshold: {self.sound_threshold})',
+             'Buzzer ON, Light ON' if loud else f'No action (normal: {{sound_level}} < {self.sound_threshold})'),
+            ('LDR Light Sensor', f'Light level: {{light_level}} (threshold: {self.light_threshold})', ldr),
+            ('DHT11 Temperature & Humidity', 'Temp: {temperature}°C, Humidity: {humidity}%', 'No action (monitoring only)')
+        )
+
+    def decide(self, pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, control):
+        """The decision table entry for a reading under the given system_control row"""
+        index = ((self.MOTION if pir_motion else 0) |
+                 (self.FLAME if flame_detected else 0) |
+                 (self.DOOR if door_open else 0) |
+                 (self.GAS if (air_quality or 0) > self.air_quality_threshold else 0) |
+                 (self.LOUD if (sound_level or 0) > self.sound_threshold else 0) |
+                 (self.DARK if (light_level or 0) > self.light_threshold else 0) |
+                 (0 if control.get('home_mode', True) else self.AWAY) |
+                 (self.MANUAL if control.get('manual_mode', False) else 0) |
+                 (self.LIGHT_ON if control.get('light_on', False) else 0))
+        return self.table[index]
+
+class AlertRuleEngine:
+    """Hands out the CompiledAlertRules for the current alert_rules and sensor_controls versions,
+    recompiling only when either changes. Shared by ingest, the dashboard and the actuator timers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = None
+        self.compiles = 0
+
+    def _key(self):
+        return state_cache.versions['alert_rules'], state_cache.versions['sensor_controls']
+
+    def current(self):
+        compiled = self._compiled
+        if compiled is not None and compiled.key == self._key():
+            return compiled
+        # Loading a table into state_cache bumps its version - load before keying
+        state_cache.get_alert_rules()
+        state_cache.get_sensor_controls()
+        key = self._key()
+        compiled = CompiledAlertRules(key, state_cache.get_alert_rules(), state_cache.get_sensor_controls())
+        with self._lock:
+            self._compiled = compiled
+            self.compiles += 1
+        return compiled
+
+alert_rules = AlertRuleEngine()
+
+def describe_sensor_actions(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level,
+                            temperature, humidity, control):
+    """Reading and automatic action for each of the 7 sensors, as (sensor_name, sensor_information, action_taken).
+    Shared by the sensor_events log and the dashboard's per-sensor table."""
+    # Ensure all values are valid (handle None/empty values)
+    sound_level = int(sound_level) if sound_level is not None and str(sound_level).strip() != '' else 0
+    air_quality = int(air_quality) if air_quality is not None and str(air_quality).strip() != '' else 0
+    light_level = int(light_level) if light_level is not None and str(light_level).strip() != '' else 0
+    temperature = float(temperature) if temperature is not None and str(temperature).strip() != '' else 0.0
+    humidity = float(humidity) if humidity is not None and str(humidity).strip() != '' else 0.0
+    
+    if not control:
+        control = {'buzzer_on': False, 'light_on': False, 'manual_mode': False, 'home_mode': True}
+    
+    decision = alert_rules.current().decide(pir_motion, flame_detected, door_open, air_quality, sound_level,
+                                            light_level, control)
+    values = {'air_quality': air_quality, 'sound_level': sound_level, 'light_level': light_level,
+              'temperature': temperature, 'humidity': humidity}
+    return [(sensor_name, information.format(**values), action.format(**values))
+            for sensor_name, information, action in decision.actions]
+
+@stage_tracer.timed('sensor_events')
+def log_sensor_event_batch(readings, tx=None):
+    """Log the sensor events of several readings (oldest first), each stamped with its created_at.
+    Change filtering runs across the batch in order; everything is written in one statement."""
     try:
-        # Ensure all values are strings and not None
-        sensor_name = str(sensor_name) if sensor_name is not None else 'Unknown Sensor'
-        sensor_information = str(sensor_information) if sensor_information is not None else 'N/A'
-        action_taken = str(action_taken) if action_taken is not None else 'No action'
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Explicitly set timestamp to ensure it's current
-        cur.execute('''
-            INSERT INTO sensor_events (sensor_name, sensor_information, action_taken, timestamp) 
-            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-        ''', (sensor_name, sensor_information, action_taken))
-        conn.commit()
-        conn.close()
-        
-        # Debug: log successful insert (only occasionally to avoid spam)
-        import time
-        if not hasattr(log_sensor_event, 'last_log') or (time.time() - log_sensor_event.last_log) > 10:
-            print(f"✅ Logged sensor event: {sensor_name}")
-            log_sensor_event.last_log = time.time()
+        control = state_cache.get_system_control(tx)
+        staged = {}
+        rows, selected_rows = [], []
+        for reading in readings:
+            selected, keyframe = sensor_event_filter.select(describe_sensor_actions(
+                reading['pir_motion'], reading['flame_detected'], reading['door_open'], reading['air_quality'],
+                reading['sound_level'], reading['light_level'], reading['temperature'], reading['humidity'],
+                control), staged)
+            if not selected:
+                continue
+            if sensor_event_writer.enabled:
+                sensor_event_writer.add(selected, keyframe, reading['created_at'])
+            else:
+                rows.extend(row + (reading['created_at'], keyframe) for row in selected)
+            selected_rows.extend(selected)
+        if rows:
+            store_sensor_events(rows, tx=tx)
+        if selected_rows:
+            if tx is not None:
+                tx.after_commit(sensor_event_filter.remember, selected_rows, staged['keyframe'])
+            else:
+                sensor_event_filter.remember(selected_rows, staged['keyframe'])
     except Exception as e:
-        print(f"❌ Error logging sensor event for {sensor_name}: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error("Error logging sensor event batch: %s", e)
+        if tx is not None:
+            raise
 
-def log_all_sensors(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, temperature, humidity):
-    """Log all sensors in real-time with their current readings"""
+@stage_tracer.timed('sensor_events')
+def log_all_sensors(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, temperature, humidity, tx=None,
+                    control=None, at=None):
+    """Log all sensors in real-time with their current readings
+    (only the changed ones between keyframes when SENSOR_EVENT_MODE=changes).
+    control and at (the system_control row and reading time to log against) default to the current
+    state and now; deferred calls pass the values from ingest time."""
     try:
-        # Ensure all values are valid (handle None/empty values)
-        sound_level = int(sound_level) if sound_level is not None and str(sound_level).strip() != '' else 0
-        air_quality = int(air_quality) if air_quality is not None and str(air_quality).strip() != '' else 0
-        light_level = int(light_level) if light_level is not None and str(light_level).strip() != '' else 0
-        temperature = float(temperature) if temperature is not None and str(temperature).strip() != '' else 0.0
-        humidity = float(humidity) if humidity is not None and str(humidity).strip() != '' else 0.0
-        
         # Get current system control state to determine actions
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        conn.close()
+        if control is None:
+            control = state_cache.get_system_control(tx)
         
-        if not control:
-            control = {'buzzer_on': False, 'light_on': False, 'manual_mode': False, 'home_mode': True}
-        
-        # Thresholds
-        LIGHT_THRESHOLD = 2000  # Higher value = darker (0-4095 range, Dark=4095, Bright=0)
-        # If light_level > 2000, it's considered dark
-        AIR_QUALITY_THRESHOLD = 2000
-        SOUND_THRESHOLD = 200  # Sound threshold for loud noise detection
-        
-        # Determine actions for each sensor
-        actions = {}
-        
-        # PIR Motion Sensor
-        if pir_motion:
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            if not control.get('manual_mode', False) and low_light:
-                actions['pir'] = 'Light ON (auto - low light)'
-            elif not control.get('home_mode', True):
-                actions['pir'] = 'Buzzer ON, Light ON (away mode)'
-            else:
-                actions['pir'] = 'No action (normal conditions)'
-        else:
-            actions['pir'] = 'No action (no motion)'
-        
-        # Flame Sensor
-        if flame_detected:
-            actions['flame'] = 'Buzzer ON, Light ON'
-        else:
-            actions['flame'] = 'No action (no fire detected)'
-        
-        # MQ135 Air Quality Sensor
-        if air_quality > AIR_QUALITY_THRESHOLD:
-            actions['mq135'] = 'Buzzer ON, Light ON'
-        else:
-            actions['mq135'] = f'No action (normal: {air_quality} < {AIR_QUALITY_THRESHOLD})'
-        
-        # Reed Switch (Door Sensor)
-        if door_open:
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            if not control.get('manual_mode', False) and low_light:
-                actions['door'] = 'Light ON (auto - low light)'
-            elif not control.get('home_mode', True):
-                actions['door'] = 'Buzzer ON, Light ON (away mode)'
-            else:
-                actions['door'] = 'No action (normal conditions)'
-        else:
-            actions['door'] = 'No action (door closed)'
-        
-        # Sound Sensor
-        if sound_level > SOUND_THRESHOLD:
-            actions['sound'] = 'Buzzer ON, Light ON'
-        else:
-            actions['sound'] = f'No action (normal: {sound_level} < {SOUND_THRESHOLD})'
+        rows, keyframe = sensor_event_filter.select(describe_sensor_actions(
+            pir_motion, flame_detected, door_open, air_quality, sound_level,
+            light_level, temperature, humidity, control))
+        if not rows:
+            return
         
-        # LDR Light Sensor
-        if light_level > LIGHT_THRESHOLD:  # Higher value = darker
-            if control.get('light_on', False):
-                actions['ldr'] = 'Light ON (low light detected)'
-            else:
-                actions['ldr'] = f'Light ready (low light: {light_level} < {LIGHT_THRESHOLD})'
+        # Log the selected sensors in one multi-row write
+        log_sensor_events(rows, tx=tx, keyframe=keyframe, at=at)
+        if tx is not None:
+            tx.after_commit(sensor_event_filter.remember, rows, keyframe)
         else:
-            actions['ldr'] = f'No action (sufficient light: {light_level})'
-        
-        # DHT11 Temperature & Humidity Sensor
-        actions['dht11'] = 'No action (monitoring only)'
-        
-        # Log all sensors (with individual error handling)
-        # Always log events every time sensor data is received - this ensures real-time updates
-        print(f"🔄 Logging sensor events for all sensors...")
-        try:
-            log_sensor_event('PIR Motion Sensor', f'Motion: {"Detected" if pir_motion else "None"}', actions.get('pir', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging PIR sensor: {e}")
-        
-        try:
-            log_sensor_event('Flame Sensor', f'Fire: {"Detected" if flame_detected else "None"}', actions.get('flame', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging Flame sensor: {e}")
-        
-        try:
-            log_sensor_event('MQ135 Air Quality Sensor', f'Reading: {air_quality} (threshold: {AIR_QUALITY_THRESHOLD})', actions.get('mq135', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging MQ135 sensor: {e}")
-        
-        try:
-            log_sensor_event('Reed Switch (Door Sensor)', f'Door: {"Open" if door_open else "Closed"}', actions.get('door', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging Door sensor: {e}")
-        
-        try:
-            log_sensor_event('Sound Sensor', f'Level: {sound_level} (threshold: {SOUND_THRESHOLD})', actions.get('sound', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging Sound sensor: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        try:
-            log_sensor_event('LDR Light Sensor', f'Light level: {light_level} (threshold: {LIGHT_THRESHOLD})', actions.get('ldr', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging LDR sensor: {e}")
+            sensor_event_filter.remember(rows, keyframe)
         
-        try:
-            log_sensor_event('DHT11 Temperature & Humidity', f'Temp: {temperature}°C, Humidity: {humidity}%', actions.get('dht11', 'No action'))
-        except Exception as e:
-            print(f"❌ Error logging DHT11 sensor: {e}")
-        
-        print(f"✅ Finished logging all sensor events")
+        log.debug("✅ Finished logging %d sensor events%s", len(rows), ' (keyframe)' if keyframe else '')
         
     except Exception as e:
-        print(f"Error logging all sensors: {e}")
-        import traceback
-        traceback.print_exc()
+        if tx is not None:
+            log.error("Error logging all sensors: %s", e)
+            raise
+        log.exception("Error logging all sensors: %s", e)
 
-def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level):
-    """Process all alerts, auto-lighting, and buzzer activation"""
+@stage_tracer.timed('alerts')
+def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, tx=None,
+                                drive_actuators=True):
+    """Process all alerts, auto-lighting, and buzzer activation.
+    With drive_actuators=False only the event log entries and notifications are produced
+    (used for all but the newest reading of a batch)."""
     try:
         global last_air_quality_notification
-        # Thresholds
-        LIGHT_THRESHOLD = 2000  # LDR threshold for low light (0-4095, higher = darker, lower = brighter)
-        # If light_level > 2000, it's considered dark (Dark=4095, Bright=0)
-        # Note: LDR sensor behavior - Dark = high value (4095), Bright = low value (0)
-        AIR_QUALITY_THRESHOLD = 2000  # MQ135 threshold for gas leak
-        SOUND_THRESHOLD = 200  # Sound threshold for loud noise (glass breaking, etc.)
         
         # Use UTC for all time comparisons to avoid timezone issues
         # Database timestamps are stored in UTC (TIMESTAMPTZ), so we use UTC here too
         now = datetime.now(timezone.utc)
         
         # Get current system control state
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute('SELECT * FROM system_control WHERE id = 1')
-        control = cur.fetchone()
-        
-        # Get per-sensor control states
-        cur.execute('SELECT sensor_name, light_enabled, buzzer_enabled FROM sensor_controls')
-        sensor_controls = {row['sensor_name']: {'light_enabled': row['light_enabled'], 'buzzer_enabled': row['buzzer_enabled']} 
-                          for row in cur.fetchall()}
-        
-        conn.close()
+        control = state_cache.get_system_control(tx)
         
         if not control:
             return
         
-        # Helper function to check if sensor control is enabled
-        def is_sensor_control_enabled(sensor_name, control_type):
-            """Check if light or buzzer is enabled for a specific sensor"""
-            sensor_control = sensor_controls.get(sensor_name, {'light_enabled': True, 'buzzer_enabled': True})
-            if control_type == 'light':
-                return sensor_control.get('light_enabled', True)
-            elif control_type == 'buzzer':
-                return sensor_control.get('buzzer_enabled', True)
-            return True  # Default to enabled if not found
-        
-        # Track alert conditions
-        alert_conditions = []
-        should_buzzer_on = False
-        should_light_on = False
-        away_mode_active = not control['home_mode']
-        
-        # Track alert types for different timeout handling
-        # Motion: Buzzer 5s, Light 60s
-        # Fire/Door: Both 30s
-        motion_alert_active = False
-        fire_door_alert_active = False
-        
-        # Track if motion/door/fire was detected in this cycle (for timeout tracking)
-        motion_detected_this_cycle = pir_motion
-        door_opened_this_cycle = door_open
-        fire_detected_this_cycle = flame_detected
-        
-        # Check for fire
-        if flame_detected:
-            alert_conditions.append('FIRE DETECTED')
-            # Check per-sensor controls before activating
-            # Fire is critical - always activate buzzer/light regardless of mode
-            if is_sensor_control_enabled('Flame Sensor', 'buzzer'):
-                should_buzzer_on = True
-            if is_sensor_control_enabled('Flame Sensor', 'light'):
-                should_light_on = True
-            fire_door_alert_active = True  # Fire uses 10s timeout
-            log_event('ALERT', '🔥 Fire detected!')
-            send_notification('Fire Alert', 'Fire detected in your home! Please check immediately.', 'fire')
-        
-        # Check for gas leak (throttle notifications to every 5 minutes)
-        if air_quality > AIR_QUALITY_THRESHOLD:
-            alert_conditions.append('GAS LEAK')
-            # Check per-sensor controls before activating
-            # Gas leak is critical - always activate buzzer/light regardless of mode
-            if is_sensor_control_enabled('MQ135 Air Quality Sensor', 'buzzer'):
-                should_buzzer_on = True
-            if is_sensor_control_enabled('MQ135 Air Quality Sensor', 'light'):
-                should_light_on = True
-            fire_door_alert_active = True  # Air quality uses 10s timeout
-            log_event('ALERT', f'⚠️ Gas leak detected! Air quality: {air_quality}')
-            
-            # Throttle air quality notifications to every 5 minutes
-            global last_air_quality_notification
-            if now - last_air_quality_notification >= AIR_QUALITY_NOTIFICATION_INTERVAL:
-                send_notification('Gas Leak Alert', f'Gas leak detected! Air quality reading: {air_quality}', 'warning')
-                last_air_quality_notification = now
-                send_notification('Air Quality Alert', f'Gas leak detected! Air quality reading: {air_quality}', 'air_quality')
-                last_air_quality_notification = now
-        
-        # Check for loud noise (glass breaking, etc.)
-        if sound_level > SOUND_THRESHOLD:
-            alert_conditions.append('LOUD NOISE')
-            # Check per-sensor controls before activating
-            # Only activate in AUTO mode (not manual mode)
-            if not control['manual_mode']:
-                if is_sensor_control_enabled('Sound Sensor', 'buzzer'):
-                    should_buzzer_on = True
-                if is_sensor_control_enabled('Sound Sensor', 'light'):
-                    should_light_on = True
-            fire_door_alert_active = True  # Sound uses 10s timeout
-            log_event('ALERT', f'🔊 Loud noise detected! Sound level: {sound_level}')
-            send_notification('Loud Noise Alert', f'Loud noise detected! Sound level: {sound_level}', 'sound')
-        
-        # Check for motion
-        if pir_motion:
-            log_event('INFO', '👁️ Motion detected')
-            send_notification('Motion Alert', 'Motion detected in your home', 'motion')
-            alert_conditions.append('MOTION DETECTED')
-            motion_alert_active = True  # Motion uses motion timeout (buzzer 10s, light 60s)
-            
-            # Motion while away triggers buzzer and light
-            if not control['home_mode']:
-                alert_conditions.append('MOTION WHILE AWAY')
-                # Check per-sensor controls before activating
-                if is_sensor_control_enabled('PIR Motion Sensor', 'buzzer'):
-                    should_buzzer_on = True
-                if is_sensor_control_enabled('PIR Motion Sensor', 'light'):
-                    should_light_on = True
-                log_event('ALERT', '🚨 Motion detected while away!')
-                send_notification('Security Alert', 'Motion detected while system is in away mode', 'motion')
+        # One decision table lookup gives the alert conditions, the buzzer/light demand
+        # (per-sensor controls applied) and the event log entries and notifications, in order
+        rules = alert_rules.current()
+        decision = rules.decide(pir_motion, flame_detected, door_open, air_quality, sound_level, light_level, control)
+        alert_conditions = decision.conditions
+        should_buzzer_on = decision.buzzer
+        should_light_on = decision.light
+        motion_alert_active = pir_motion  # Motion uses motion timeout (buzzer 10s, light 60s)
+        
+        values = {'air_quality': air_quality, 'sound_level': sound_level}
+        # Throttle air quality notifications to every 5 minutes
+        air_quality_notify = now - last_air_quality_notification >= AIR_QUALITY_NOTIFICATION_INTERVAL
+        for effect in decision.effects:
+            if effect[0] == 'event':
+                _, event_type, message, fields = effect
+                log_event(event_type, message.format(**values), tx=tx, **fields)
             else:
-                # In HOME mode, motion always triggers light (60s timeout), but not buzzer
-                if not control['manual_mode']:
-                    # Check per-sensor controls before activating
-                    if is_sensor_control_enabled('PIR Motion Sensor', 'light'):
-                        should_light_on = True  # Always trigger light for motion in HOME mode (60s timeout)
-                # Motion in HOME mode doesn't trigger buzzer (normal activity)
-        
-        # Check for door/window opening
-        if door_open:
-            log_event('INFO', '🚪 Door/Window opened')
-            send_notification('Door Alert', 'Door or window has been opened', 'door')
-            alert_conditions.append('DOOR OPENED')
-            fire_door_alert_active = True  # Door uses 10s timeout
-            
-            # Door opening while away triggers buzzer and light (only in AUTO mode)
-            if not control['home_mode']:
-                alert_conditions.append('DOOR OPEN WHILE AWAY')
-                log_event('ALERT', '🚨 Door opened while away!')
-                send_notification('Security Alert', 'Door or window opened while system is in away mode', 'door')
-                # Only activate in AUTO mode
-                if not control['manual_mode']:
-                    if is_sensor_control_enabled('Reed Switch (Door Sensor)', 'buzzer'):
-                        should_buzzer_on = True
-                    if is_sensor_control_enabled('Reed Switch (Door Sensor)', 'light'):
-                        should_light_on = True
-            
-            # Door opening triggers lights in low light (if not in manual mode)
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            if not control['manual_mode'] and low_light:
-                if is_sensor_control_enabled('Reed Switch (Door Sensor)', 'light'):
-                    should_light_on = True
-        else:
+                _, title, message, notification_type, throttled = effect
+                if throttled and not air_quality_notify:
+                    continue
+                send_notification(title, message.format(**values), notification_type, tx=tx)
+                if throttled:
+                    last_air_quality_notification = now
+        
+        if not door_open:
             # Door is closed - if buzzer was activated by door opening, clear manual_off flag
             # This allows buzzer to turn off after timeout when door closes
-            if not control['manual_mode'] and control.get('buzzer_on', False) and control.get('buzzer_manual_off', False):
+            if drive_actuators and not control['manual_mode'] and control.get('buzzer_on', False) and control.get('buzzer_manual_off', False):
                 # Check if buzzer was activated by door (check if it's been on for less than timeout)
                 if control.get('buzzer_activated_at'):
                     buzzer_activated = control['buzzer_activated_at']
@@ -2451,39 +5128,26 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                         # If door was recently opened (within last 15 seconds), likely door-triggered buzzer
                         # Clear manual_off flag to allow timeout to work
                         if time_elapsed < 15:  # Recent activation, likely from door
-                            conn = get_db_connection()
-                            cur = conn.cursor()
-                            cur.execute('''
+                            update_system_control('''
                                 UPDATE system_control 
-                                SET buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
+                                SET version = version + 1, buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
                                 WHERE id = 1
-                            ''')
-                            conn.commit()
-                            conn.close()
-                            print(f"🚪 Door closed - cleared buzzer_manual_off flag to allow timeout")
+                            ''', tx=tx)
+                            log.debug("🚪 Door closed - cleared buzzer_manual_off flag to allow timeout")
                             # Refresh control state
                             control['buzzer_manual_off'] = False
         
-        # Define timeouts based on alert type
+        if not drive_actuators:
+            return
+        
+        # Timeouts based on alert type
         # Motion: Buzzer 10s, Light 60s
         # All other sensors (fire, door, air quality, sound): Both buzzer and light 10s
-        MOTION_BUZZER_TIMEOUT = 10   # seconds
-        MOTION_LIGHT_TIMEOUT = 60    # seconds
-        OTHER_SENSORS_TIMEOUT = 10   # seconds (for fire, door, air quality, sound)
-        
-        motion_door_fire_alert = ('MOTION DETECTED' in alert_conditions) or ('DOOR OPENED' in alert_conditions) or ('FIRE DETECTED' in alert_conditions)
-        away_alert_triggered = ('MOTION WHILE AWAY' in alert_conditions) or ('DOOR OPEN WHILE AWAY' in alert_conditions)
+        MOTION_BUZZER_TIMEOUT = rules.motion_buzzer_timeout
+        MOTION_LIGHT_TIMEOUT = rules.motion_light_timeout
+        OTHER_SENSORS_TIMEOUT = rules.other_sensors_timeout
         
-        # Determine which timeout to use based on current alert type
-        # Motion: Buzzer 10s, Light 60s
-        # All other sensors: Both 10s
-        if motion_alert_active:
-            buzzer_timeout = MOTION_BUZZER_TIMEOUT  # 10s
-            light_timeout = MOTION_LIGHT_TIMEOUT     # 60s
-        else:
-            # All other sensors (fire, door, air quality, sound): 10s for both
-            buzzer_timeout = OTHER_SENSORS_TIMEOUT
-            light_timeout = OTHER_SENSORS_TIMEOUT
+        motion_door_fire_alert = decision.motion_door_fire
         
         # Check timeout for buzzer - keep on if timeout hasn't passed, turn off if it has
         # This ensures buzzer stays on for full timeout period even if motion stops
@@ -2501,9 +5165,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                 # Determine if this was a motion buzzer: if motion is active OR if we're within motion timeout
                 # and no other sensor is currently active
                 is_motion_buzzer = motion_alert_active or (time_elapsed < MOTION_BUZZER_TIMEOUT and 
-                                                          not (door_opened_this_cycle or fire_detected_this_cycle or 
-                                                               flame_detected or air_quality > AIR_QUALITY_THRESHOLD or 
-                                                               sound_level > SOUND_THRESHOLD))
+                                                          not decision.other_sensor_active)
                 
                 # Determine timeout based on what type of alert activated it
                 if is_motion_buzzer:
@@ -2521,35 +5183,26 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
         # Update buzzer state (only in AUTO mode - manual mode user has full control)
         if not control['manual_mode']:
             # Motion/door/fire alerts should always activate buzzer
-            critical_alert = flame_detected or air_quality > AIR_QUALITY_THRESHOLD
-            if should_buzzer_on and (critical_alert or motion_door_fire_alert or not control.get('buzzer_manual_off', False)):
+            if should_buzzer_on and (decision.critical or motion_door_fire_alert or not control.get('buzzer_manual_off', False)):
                 # Only activate if currently off (avoid unnecessary updates)
                 if not control.get('buzzer_on', False):
-                    conn = get_db_connection()
-                    cur = conn.cursor()
                     # Clear buzzer_manual_off when activating buzzer due to motion/door/fire
                     # This ensures timeout works properly after motion detection
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET buzzer_on = TRUE, buzzer_activated_at = CURRENT_TIMESTAMP, 
+                        SET version = version + 1, buzzer_on = TRUE, buzzer_activated_at = CURRENT_TIMESTAMP, 
                             buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1
-                    ''')
-                    conn.commit()
-                    conn.close()
-                    log_event('ALERT', f'🔔 Buzzer activated - {", ".join(alert_conditions) if alert_conditions else "Alert condition"}')
+                    ''', tx=tx)
+                    log_event('ALERT', f'🔔 Buzzer activated - {", ".join(alert_conditions) if alert_conditions else "Alert condition"}', tx=tx)
                 elif control.get('buzzer_on', False) and not control.get('buzzer_activated_at'):
                     # Update activation time if buzzer is on but time not set
                     # Also clear manual_off flag to ensure timeout works
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET buzzer_activated_at = CURRENT_TIMESTAMP, buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
+                        SET version = version + 1, buzzer_activated_at = CURRENT_TIMESTAMP, buzzer_manual_off = FALSE, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1 AND buzzer_activated_at IS NULL
-                    ''')
-                    conn.commit()
-                    conn.close()
+                    ''', tx=tx)
             # Always check timeout for buzzer - turn off if timeout has passed (even if sensor is still active)
             # This check runs after sensor checks, so it can override sensor-based settings
             if control.get('buzzer_on', False) and control.get('buzzer_activated_at'):
@@ -2567,9 +5220,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     # Determine if this was a motion buzzer: if motion is active OR if we're within motion timeout
                     # and no other sensor is currently active
                     is_motion_buzzer = motion_alert_active or (time_elapsed < MOTION_BUZZER_TIMEOUT and 
-                                                              not (door_opened_this_cycle or fire_detected_this_cycle or 
-                                                                   flame_detected or air_quality > AIR_QUALITY_THRESHOLD or 
-                                                                   sound_level > SOUND_THRESHOLD))
+                                                              not decision.other_sensor_active)
                     
                     # Determine which timeout to check based on what triggered the buzzer
                     if is_motion_buzzer:
@@ -2582,17 +5233,13 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                         should_buzzer_on = False  # Override sensor-based setting
                         # Turn off buzzer
                         if not control.get('buzzer_manual_off', False):
-                            conn = get_db_connection()
-                            cur = conn.cursor()
-                            cur.execute('''
+                            update_system_control('''
                                 UPDATE system_control 
-                                SET buzzer_on = FALSE, buzzer_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                                SET version = version + 1, buzzer_on = FALSE, buzzer_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                                 WHERE id = 1
-                            ''')
-                            conn.commit()
-                            conn.close()
+                            ''', tx=tx)
                             timeout_used = MOTION_BUZZER_TIMEOUT if is_motion_buzzer else OTHER_SENSORS_TIMEOUT
-                            log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - Timeout: {timeout_used}s elapsed')
+                            log_event('AUTO', f'🔔 Buzzer turned OFF (auto) - Timeout: {timeout_used}s elapsed', tx=tx)
                     else:
                         # Keep on if timeout hasn't passed (even if motion stopped)
                         should_buzzer_on = True
@@ -2601,16 +5248,12 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
             if not should_buzzer_on and control.get('buzzer_on', False):
                 # Turn off buzzer if conditions no longer met
                 if not control.get('buzzer_manual_off', False):
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET buzzer_on = FALSE, buzzer_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                        SET version = version + 1, buzzer_on = FALSE, buzzer_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1
-                    ''')
-                    conn.commit()
-                    conn.close()
-                    log_event('AUTO', '🔔 Buzzer turned OFF (auto) - Conditions no longer met')
+                    ''', tx=tx)
+                    log_event('AUTO', '🔔 Buzzer turned OFF (auto) - Conditions no longer met', tx=tx)
         
         # Keep light on for minimum timeout if motion/door/fire was detected
         # Check if light was activated by motion/door/fire and is still within timeout
@@ -2637,9 +5280,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     is_motion_light = True
                 else:
                     # Motion is not active - check if we're within 60s and no other sensor is active
-                    other_sensor_active = (door_opened_this_cycle or fire_detected_this_cycle or 
-                                          flame_detected or air_quality > AIR_QUALITY_THRESHOLD or 
-                                          sound_level > SOUND_THRESHOLD)
+                    other_sensor_active = decision.other_sensor_active
                     
                     if not other_sensor_active and time_elapsed < MOTION_LIGHT_TIMEOUT:
                         # No other sensor active and within 60s, likely motion (use 60s timeout)
@@ -2655,19 +5296,15 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     if time_elapsed >= MOTION_LIGHT_TIMEOUT:
                         should_light_on = False  # Turn off after 60 seconds
                         # Immediately update database to turn off light
-                        conn_timeout = get_db_connection()
-                        cur_timeout = conn_timeout.cursor()
-                        cur_timeout.execute('''
+                        update_system_control('''
                             UPDATE system_control 
-                            SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                            SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                             WHERE id = 1
-                        ''')
-                        conn_timeout.commit()
-                        conn_timeout.close()
-                        log_event('AUTO', f'💡 Light turned OFF (auto) - Motion timeout: {MOTION_LIGHT_TIMEOUT}s elapsed')
+                        ''', tx=tx)
+                        log_event('AUTO', f'💡 Light turned OFF (auto) - Motion timeout: {MOTION_LIGHT_TIMEOUT}s elapsed', tx=tx)
                     else:
                         # Check if motion sensor's light control is enabled
-                        if is_sensor_control_enabled('PIR Motion Sensor', 'light'):
+                        if rules.motion_light_enabled:
                             should_light_on = True  # Keep on if timeout hasn't passed (even if motion stopped)
                         else:
                             should_light_on = False  # Turn off if sensor control is disabled
@@ -2677,26 +5314,16 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     if time_elapsed >= OTHER_SENSORS_TIMEOUT:
                         should_light_on = False  # Turn off after 10 seconds
                         # Immediately update database to turn off light
-                        conn_timeout = get_db_connection()
-                        cur_timeout = conn_timeout.cursor()
-                        cur_timeout.execute('''
+                        update_system_control('''
                             UPDATE system_control 
-                            SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                            SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                             WHERE id = 1
-                        ''')
-                        conn_timeout.commit()
-                        conn_timeout.close()
-                        log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed')
+                        ''', tx=tx)
+                        log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed', tx=tx)
                     else:
-                        # Check if any sensor that could have triggered the light has light enabled
+                        # Keep on if any sensor that could have triggered the light has light enabled
                         # This ensures light stays on for full timeout even if sensor reading becomes normal
-                        # We check all sensors with OR (not elif) because any of them could have triggered it
-                        sensor_light_enabled = (is_sensor_control_enabled('Flame Sensor', 'light') or
-                                               is_sensor_control_enabled('MQ135 Air Quality Sensor', 'light') or
-                                               is_sensor_control_enabled('Sound Sensor', 'light') or
-                                               is_sensor_control_enabled('Reed Switch (Door Sensor)', 'light'))
-                        
-                        if sensor_light_enabled:
+                        if rules.other_light_enabled:
                             should_light_on = True  # Keep on if timeout hasn't passed (even if sensor reading is now normal)
                         else:
                             should_light_on = False  # Turn off if all sensor controls are disabled
@@ -2705,8 +5332,6 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
         # NOTE: This section should NOT re-activate light if timeout has passed
         # The timeout check above already handles turning off the light
         if not control['manual_mode']:
-            low_light = light_level > LIGHT_THRESHOLD  # Higher value = darker
-            
             # Lights should be on if:
             # 1. Any alert condition (fire, gas, noise, motion/door while away) - already set above
             # 2. Motion detected in low light (but only if timeout hasn't passed AND light is currently off)
@@ -2726,9 +5351,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     # Check if this was a motion light
                     # IMPORTANT: Only motion should use 60s timeout. All other sensors use 10s.
                     # Motion must be active AND no other sensor was detected this cycle
-                    is_motion_light = motion_alert_active and not (door_opened_this_cycle or fire_detected_this_cycle or 
-                                                                   flame_detected or air_quality > AIR_QUALITY_THRESHOLD or 
-                                                                   sound_level > SOUND_THRESHOLD)
+                    is_motion_light = motion_alert_active and not decision.other_sensor_active
                     if is_motion_light:
                         timeout_passed = time_elapsed >= MOTION_LIGHT_TIMEOUT
                     else:
@@ -2739,11 +5362,8 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                 
                 # Only allow sensor to turn on light if timeout has passed (light was off) AND sensor control is enabled
                 # This prevents re-activation immediately after timeout
-                if timeout_passed and (pir_motion or door_open) and low_light:
-                    if pir_motion and is_sensor_control_enabled('PIR Motion Sensor', 'light'):
-                        should_light_on = True
-                    elif door_open and is_sensor_control_enabled('Reed Switch (Door Sensor)', 'light'):
-                        should_light_on = True
+                if timeout_passed and decision.low_light_trigger:
+                    should_light_on = True
             
             # Adjust brightness based on ambient light
             target_brightness = control['brightness_level']
@@ -2751,7 +5371,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                 # Map light_level (0-4095) to brightness (20-100%)
                 # Higher light_level (darker) = higher brightness needed
                 # Invert the mapping: 4095 (dark) -> 100%, 0 (bright) -> 20%
-                target_brightness = int(map_value(light_level, LIGHT_THRESHOLD, 4095, 20, 100))
+                target_brightness = int(map_value(light_level, rules.light_threshold, 4095, 20, 100))
                 target_brightness = max(20, min(100, target_brightness))  # Clamp to 20-100
             else:
                 # If light should be off, keep current brightness for when it turns on again
@@ -2783,40 +5403,30 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                 
                 # Only turn off if timeout has passed
                 if can_turn_off:
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET light_on = FALSE, brightness_level = %s, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                        SET version = version + 1, light_on = FALSE, brightness_level = %s, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1
-                    ''', (target_brightness,))
-                    conn.commit()
-                    conn.close()
-                    log_event('AUTO', '💡 Light turned OFF (auto) - Conditions/timeout')
+                    ''', (target_brightness,), tx=tx)
+                    log_event('AUTO', '💡 Light turned OFF (auto) - Conditions/timeout', tx=tx)
             elif not control['manual_mode'] and (should_light_on != control['light_on'] or (should_light_on and target_brightness != control['brightness_level'])):
                 # Only update light state in AUTO mode - in MANUAL mode, user has full control
-                conn = get_db_connection()
-                cur = conn.cursor()
                 if should_light_on:
                     # Light turning ON - set activation time
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET light_on = %s, brightness_level = %s, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                        SET version = version + 1, light_on = %s, brightness_level = %s, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1
-                    ''', (should_light_on, target_brightness))
-                    conn.commit()
-                    conn.close()
-                    log_event('AUTO', f'💡 Light turned ON (auto) - Brightness: {target_brightness}%')
+                    ''', (should_light_on, target_brightness), tx=tx)
+                    log_event('AUTO', f'💡 Light turned ON (auto) - Brightness: {target_brightness}%', tx=tx)
                 else:
                     # Light turning OFF - clear activation time
-                    cur.execute('''
+                    update_system_control('''
                         UPDATE system_control 
-                        SET light_on = %s, brightness_level = %s, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                        SET version = version + 1, light_on = %s, brightness_level = %s, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                         WHERE id = 1
-                    ''', (should_light_on, target_brightness))
-                    conn.commit()
-                    conn.close()
-                    log_event('AUTO', '💡 Light turned OFF (auto) - Conditions no longer met')
+                    ''', (should_light_on, target_brightness), tx=tx)
+                    log_event('AUTO', '💡 Light turned OFF (auto) - Conditions no longer met', tx=tx)
             # Always check timeout for light - turn off if timeout has passed
             # This ensures light turns off after timeout even if sensor is still active
             # IMPORTANT: Only check timeouts in AUTO mode - in MANUAL mode, user has full control
@@ -2836,9 +5446,7 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                 # IMPORTANT: Only motion should use 60s timeout. All other sensors use 10s.
                 # Strategy: If no other sensor is active AND (motion is currently active OR we're within 60s), assume it's motion
                 # This handles the case where motion has stopped but we're still within the 60s timeout
-                other_sensor_active = (door_opened_this_cycle or fire_detected_this_cycle or 
-                                      flame_detected or air_quality > AIR_QUALITY_THRESHOLD or 
-                                      sound_level > SOUND_THRESHOLD)
+                other_sensor_active = decision.other_sensor_active
                 
                 if not other_sensor_active:
                     # If motion is currently active, definitely motion
@@ -2853,19 +5461,15 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     if time_elapsed >= MOTION_LIGHT_TIMEOUT:
                         should_light_on = False  # Override sensor-based setting
                         # Turn off light
-                        conn = get_db_connection()
-                        cur = conn.cursor()
-                        cur.execute('''
+                        update_system_control('''
                             UPDATE system_control 
-                            SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                            SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                             WHERE id = 1
-                        ''')
-                        conn.commit()
-                        conn.close()
-                        log_event('AUTO', f'💡 Light turned OFF (auto) - Motion timeout: {MOTION_LIGHT_TIMEOUT}s elapsed')
+                        ''', tx=tx)
+                        log_event('AUTO', f'💡 Light turned OFF (auto) - Motion timeout: {MOTION_LIGHT_TIMEOUT}s elapsed', tx=tx)
                     else:
                         # Keep on if timeout hasn't passed AND motion sensor's light control is enabled
-                        if is_sensor_control_enabled('PIR Motion Sensor', 'light'):
+                        if rules.motion_light_enabled:
                             should_light_on = True  # Keep on if timeout hasn't passed (even if motion stopped)
                         else:
                             should_light_on = False  # Turn off if sensor control is disabled
@@ -2873,27 +5477,17 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
                     if time_elapsed >= OTHER_SENSORS_TIMEOUT:
                         should_light_on = False  # Override sensor-based setting
                         # Turn off light
-                        conn = get_db_connection()
-                        cur = conn.cursor()
-                        cur.execute('''
+                        update_system_control('''
                             UPDATE system_control 
-                            SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                            SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                             WHERE id = 1
-                        ''')
-                        conn.commit()
-                        conn.close()
-                        log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed')
+                        ''', tx=tx)
+                        log_event('AUTO', f'💡 Light turned OFF (auto) - Timeout: {OTHER_SENSORS_TIMEOUT}s elapsed', tx=tx)
                     else:
                         # Keep on if timeout hasn't passed AND the triggering sensor's light control is enabled
                         # Don't check current sensor readings - just check if timeout passed and sensor control enabled
                         # This ensures light stays on for full 10 seconds even if sensor reading becomes normal
-                        # Check if any sensor that could have triggered the light has light enabled (use OR, not elif)
-                        sensor_light_enabled = (is_sensor_control_enabled('Flame Sensor', 'light') or
-                                               is_sensor_control_enabled('MQ135 Air Quality Sensor', 'light') or
-                                               is_sensor_control_enabled('Sound Sensor', 'light') or
-                                               is_sensor_control_enabled('Reed Switch (Door Sensor)', 'light'))
-                        
-                        if sensor_light_enabled:
+                        if rules.other_light_enabled:
                             should_light_on = True  # Keep on if timeout hasn't passed (even if sensor reading is now normal)
                         else:
                             should_light_on = False  # Turn off if all sensor controls are disabled
@@ -2901,109 +5495,434 @@ def process_alerts_and_controls(pir_motion, flame_detected, door_open, air_quali
             # Also handle case where should_light_on is False and light is on (for other conditions)
             if not should_light_on and control.get('light_on', False):
                 # Turn off light if conditions no longer met
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute('''
+                update_system_control('''
                     UPDATE system_control 
-                    SET light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
+                    SET version = version + 1, light_on = FALSE, light_activated_at = NULL, updated_at = CURRENT_TIMESTAMP
                     WHERE id = 1
-                ''')
-                conn.commit()
-                conn.close()
-                log_event('AUTO', '💡 Light turned OFF (auto) - Conditions no longer met')
+                ''', tx=tx)
+                log_event('AUTO', '💡 Light turned OFF (auto) - Conditions no longer met', tx=tx)
             if should_light_on and control.get('light_on', False) and not control.get('light_activated_at'):
                 # Update activation time if light is on but time not set
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute('''
+                update_system_control('''
                     UPDATE system_control 
-                    SET light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    SET version = version + 1, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
                     WHERE id = 1 AND light_activated_at IS NULL
-                ''')
-                conn.commit()
-                conn.close()
+                ''', tx=tx)
         
         # Also handle manual mode - if user manually controls light, respect that
         # But still activate for critical alerts (fire, gas) - these override manual mode
         if control['manual_mode']:
             # Critical alerts (fire, gas) override manual mode for lights and buzzer
-            if flame_detected or air_quality > AIR_QUALITY_THRESHOLD:
-                if flame_detected and is_sensor_control_enabled('Flame Sensor', 'light'):
-                    if not control.get('light_on', False):
-                        conn = get_db_connection()
-                        cur = conn.cursor()
-                        cur.execute('''
-                            UPDATE system_control 
-                            SET light_on = TRUE, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-                            WHERE id = 1
-                        ''')
-                        conn.commit()
-                        conn.close()
-                        log_event('ALERT', '💡 Light turned ON (critical alert override - fire)')
-                if air_quality > AIR_QUALITY_THRESHOLD and is_sensor_control_enabled('MQ135 Air Quality Sensor', 'light'):
-                    if not control.get('light_on', False):
-                        conn = get_db_connection()
-                        cur = conn.cursor()
-                        cur.execute('''
-                            UPDATE system_control 
-                            SET light_on = TRUE, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-                            WHERE id = 1
-                        ''')
-                        conn.commit()
-                        conn.close()
-                        log_event('ALERT', '💡 Light turned ON (critical alert override - gas)')
+            for alert in decision.manual_overrides:
+                if not control.get('light_on', False):
+                    update_system_control('''
+                        UPDATE system_control 
+                        SET version = version + 1, light_on = TRUE, light_activated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = 1
+                    ''', tx=tx)
+                    log_event('ALERT', f'💡 Light turned ON (critical alert override - {alert})', tx=tx)
         
         # Note: Auto-turn OFF logic is handled above in the main buzzer control section
         # This ensures buzzer stays on for minimum duration and respects all conditions
         
     except Exception as e:
-        print(f"Error processing alerts and controls: {e}")
+        log.error("Error processing alerts and controls: %s", e)
+        if tx is not None:
+            raise
 
-def send_email_notification(title, message):
-    """Send email notification via SMTP if enabled."""
+def queue_email_notification(cur, title, message, notification_id=None):
+    """Queue an e-mail to every configured recipient on cur (commits with the caller's transaction).
+    Returns the number of rows queued; call email_dispatcher.wake() after commit."""
     if not EMAIL_ENABLED:
-        return
-    if not (EMAIL_SENDER and EMAIL_SENDER_PASSWORD and EMAIL_RECIPIENTS):
-        print("⚠️ Email notification skipped: missing configuration.")
-        return
-    
-    try:
-        mime = MIMEText(message)
-        mime['Subject'] = title
-        mime['From'] = EMAIL_SENDER
-        mime['To'] = ', '.join(EMAIL_RECIPIENTS)
-        
-        context = ssl.create_default_context()
-        with smtplib.SMTP(EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT) as server:
-            server.starttls(context=context)
-            server.login(EMAIL_SENDER, EMAIL_SENDER_PASSWORD)
-            server.sendmail(EMAIL_SENDER, EMAIL_RECIPIENTS, mime.as_string())
-    except Exception as e:
-        print(f"Error sending email notification: {e}")
+        return 0
+    if not (EMAIL_SENDER and EMAIL_RECIPIENTS):
+        log.warning("⚠️ Email notification skipped: missing configuration.")
+        return 0
+    execute_values(cur, '''
+        INSERT INTO notification_outbox (notification_id, recipient, subject, body)
+        VALUES %s
+    ''', [(notification_id, recipient, title, message) for recipient in EMAIL_RECIPIENTS])
+    return len(EMAIL_RECIPIENTS)
+
+class SMTPSession:
+    """A reusable SMTP connection: opened (STARTTLS + login as configured) on first send,
+    reopened if the server dropped it, and closed after EMAIL_SMTP_IDLE_TIMEOUT idle seconds."""
+
+    def __init__(self, factory, on_connect=None):
+        self._factory = factory
+        self._on_connect = on_connect
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _open(self):
+        smtp = self._factory()
+        if EMAIL_SMTP_STARTTLS:
+            smtp.starttls(context=ssl.create_default_context())
+        if EMAIL_SENDER_PASSWORD:
+            smtp.login(EMAIL_SENDER, EMAIL_SENDER_PASSWORD)
+        self._smtp = smtp
+        if self._on_connect:
+            self._on_connect()
+
+    def send(self, recipient, mime):
+        if self._smtp is not None and time.monotonic() - self._last_used > EMAIL_SMTP_IDLE_TIMEOUT:
+            self.close()
+        for attempt in (1, 2):
+            if self._smtp is None:
+                self._open()
+            try:
+                self._smtp.sendmail(EMAIL_SENDER, [recipient], mime.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Server closed the idle session - reconnect once
+                self._smtp = None
+                if attempt == 2:
+                    raise
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > EMAIL_SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+class EmailDispatcher:
+    """Drains notification_outbox with worker threads, each holding its own SMTPSession.
+    Mails are claimed per recipient (FOR UPDATE SKIP LOCKED) and sent over one session;
+    in digest mode (EMAIL_DIGEST_WINDOW > 0) a recipient's queued mails wait until the oldest
+    is that old and then go out merged into one. Failures are retried with exponential
+    backoff up to EMAIL_MAX_ATTEMPTS. smtp_factory is injectable for tests."""
+
+    def __init__(self, workers, smtp_factory=None):
+        self.workers = max(1, workers)
+        self.smtp_factory = smtp_factory or (lambda: smtplib.SMTP(EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT, timeout=EMAIL_SMTP_TIMEOUT))
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._recovered = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.smtp_connects = 0
+
+    def _count_connect(self):
+        with self._cond:
+            self.smtp_connects += 1
+
+    def start(self):
+        with self._cond:
+            if not self._recovered:
+                # Rows a previous run claimed but never finished go back to the queue
+                self._recovered = True
+                conn = get_db_connection()
+                try:
+                    cur = conn.cursor()
+                    cur.execute("UPDATE notification_outbox SET status = 'pending' WHERE status = 'sending'")
+                    conn.commit()
+                finally:
+                    conn.close()
+            self._stopping = False
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'email-dispatcher-{len(self._threads) + 1}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        """New mail was queued"""
+        if not self._threads or not all(t.is_alive() for t in self._threads):
+            self.start()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _claim(self):
+        """Claim the due mails of one recipient; returns the rows (empty if nothing is due).
+        The recipient comes from the first due row this worker can lock, so a recipient whose
+        rows another worker holds is skipped instead of ending the claim with nothing."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute('''
+                WITH anchor AS (
+                    SELECT recipient FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                      AND created_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                    ORDER BY next_attempt_at, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE notification_outbox
+                SET status = 'sending', attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                      AND recipient = (SELECT recipient FROM anchor)
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, recipient, subject, body, attempts, created_at
+            ''', (EMAIL_DIGEST_WINDOW, EMAIL_BATCH_SIZE))
+            rows = sorted(cur.fetchall(), key=lambda row: row['id'])
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _build_messages(rows):
+        """[(outbox ids, MIMEText)] for one recipient's batch"""
+        if EMAIL_DIGEST_WINDOW > 0 and len(rows) > 1:
+            parts = []
+            for row in rows:
+                created = row['created_at'].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row['created_at'], datetime) else str(row['created_at'])
+                parts.append(f"[{created} UTC] {row['subject']}\n{row['body']}")
+            mime = MIMEText('\n\n'.join(parts))
+            mime['Subject'] = f"{len(rows)} alerts: {rows[0]['subject']}"
+            messages = [([row['id'] for row in rows], mime)]
+        else:
+            messages = []
+            for row in rows:
+                mime = MIMEText(row['body'])
+                mime['Subject'] = row['subject']
+                messages.append(([row['id']], mime))
+        for _, mime in messages:
+            mime['From'] = EMAIL_SENDER
+            mime['To'] = rows[0]['recipient']
+        return messages
+
+    def _finish(self, sent_ids, failures):
+        """Record results: sent_ids delivered; failures is [(ids, attempts, error)]"""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            if sent_ids:
+                cur.execute('''
+                    UPDATE notification_outbox
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ANY(%s)
+                ''', (sent_ids,))
+            for ids, attempts, error, permanent in failures:
+                if permanent or attempts >= EMAIL_MAX_ATTEMPTS:
+                    cur.execute('''
+                        UPDATE notification_outbox SET status = 'failed', last_error = %s
+                        WHERE id = ANY(%s)
+                    ''', (error, ids))
+                else:
+                    backoff = min(EMAIL_RETRY_BACKOFF * (2 ** (attempts - 1)), EMAIL_RETRY_BACKOFF_MAX)
+                    cur.execute('''
+                        UPDATE notification_outbox
+                        SET status = 'pending', last_error = %s,
+                            next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                        WHERE id = ANY(%s)
+                    ''', (error, backoff, ids))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _deliver(self, session, rows):
+        sent_ids = []
+        failures = []
+        for ids, mime in self._build_messages(rows):
+            attempts = max(row['attempts'] for row in rows if row['id'] in ids)
+            started = time.perf_counter()
+            try:
+                with stage_tracer.span('smtp_send'):
+                    session.send(rows[0]['recipient'], mime)
+                sent_ids.extend(ids)
+                metrics.observe('smart_home_email_send_seconds', time.perf_counter() - started, ('sent',))
+            except smtplib.SMTPRecipientsRefused as e:
+                failures.append((ids, attempts, str(e), True))
+                metrics.observe('smart_home_email_send_seconds', time.perf_counter() - started, ('refused',))
+            except Exception as e:
+                # Connection-level problem: drop the session so the next try reconnects
+                session.close()
+                failures.append((ids, attempts, str(e), False))
+                metrics.observe('smart_home_email_send_seconds', time.perf_counter() - started, ('error',))
+        self._finish(sent_ids, failures)
+        with self._cond:
+            self.batches += 1
+            self.sent += len(sent_ids)
+            for ids, attempts, error, permanent in failures:
+                if permanent or attempts >= EMAIL_MAX_ATTEMPTS:
+                    self.failed += len(ids)
+                    log.error("❌ Email to %s failed permanently: %s", rows[0]['recipient'], error)
+                else:
+                    self.retried += len(ids)
+                    log.warning("⚠️ Email to %s failed (attempt %d), will retry: %s", rows[0]['recipient'], attempts, error)
+
+    def process_pending(self, session=None):
+        """Send everything that is due now on the calling thread; returns the number of batches.
+        Used by the workers, and directly by tests against a local SMTP server."""
+        own_session = session is None
+        if own_session:
+            session = SMTPSession(self.smtp_factory, self._count_connect)
+        batches = 0
+        try:
+            while not self._stopping:
+                rows = self._claim()
+                if not rows:
+                    break
+                self._deliver(session, rows)
+                batches += 1
+        finally:
+            if own_session:
+                session.close()
+        return batches
+
+    def _run(self):
+        session = SMTPSession(self.smtp_factory, self._count_connect)
+        try:
+            while not self._stopping:
+                try:
+                    self.process_pending(session)
+                except Exception as e:
+                    log.error("❌ Email dispatcher error: %s", e)
+                session.close_if_idle()
+                with self._cond:
+                    if self._stopping:
+                        break
+                    # Digest windows and retry backoffs become due without a wake-up
+                    wait = EMAIL_POLL_INTERVAL if EMAIL_DIGEST_WINDOW <= 0 else min(EMAIL_POLL_INTERVAL, EMAIL_DIGEST_WINDOW)
+                    self._cond.wait(wait)
+        finally:
+            session.close()
 
+    def stats(self):
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute('SELECT status, COUNT(*) AS count FROM notification_outbox GROUP BY status')
+            queue_counts = {row['status']: row['count'] for row in cur.fetchall()}
+        finally:
+            conn.close()
+        return {
+            'enabled': EMAIL_ENABLED,
+            'workers': len([t for t in self._threads if t.is_alive()]),
+            'outbox': queue_counts,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'batches': self.batches,
+            'smtp_connects': self.smtp_connects,
+            'digest_window': EMAIL_DIGEST_WINDOW
+        }
 
-def send_notification(title, message, notification_type='info'):
-    """Send notification (dashboard + optional email)."""
+    def shutdown(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+email_dispatcher = EmailDispatcher(EMAIL_WORKERS)
+
+def send_notification(title, message, notification_type='info', tx=None):
+    """Send notification (dashboard + optional email).
+    The e-mail is queued in notification_outbox in the same transaction as the notification
+    (the ingest transaction when tx is given) and sent in the background by email_dispatcher."""
     try:
-        print(f"📧 NOTIFICATION: {title} - {message}")
+        log.info("📧 NOTIFICATION: %s - %s", title, message)
+        
+        if tx is not None and tx.defer_side_effects:
+            tx.defer(send_notification, title, message, notification_type)
+            return None
+        if tx is not None:
+            tx.cur.execute('''
+                INSERT INTO notifications (title, message, notification_type)
+                VALUES (%s, %s, %s)
+                RETURNING id, title, message, notification_type, created_at, read
+            ''', (title, message, notification_type))
+            row = tx.cur.fetchone()
+            tx.summary['notifications'] += 1
+            tx.after_commit(metrics.inc, 'smart_home_notifications_total', (notification_type,))
+            tx.after_commit(notifications_changed, 'notification', notification_to_dict(row))
+            if queue_email_notification(tx.cur, title, message, row['id']):
+                tx.after_commit(email_dispatcher.wake)
+            return row['id']
         
         conn = get_db_connection()
-        cur = conn.cursor()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute('''
             INSERT INTO notifications (title, message, notification_type)
             VALUES (%s, %s, %s)
-            RETURNING id
+            RETURNING id, title, message, notification_type, created_at, read
         ''', (title, message, notification_type))
-        notification_id = cur.fetchone()[0]
+        row = cur.fetchone()
+        queued = queue_email_notification(cur, title, message, row['id'])
         conn.commit()
         conn.close()
         
-        send_email_notification(title, message)
-        return notification_id
+        metrics.inc('smart_home_notifications_total', (notification_type,))
+        notifications_changed('notification', notification_to_dict(row))
+        if queued:
+            email_dispatcher.wake()
+        return row['id']
     except Exception as e:
-        print(f"Error sending notification: {e}")
+        log.error("Error sending notification: %s", e)
+        if tx is not None:
+            raise
         return None
 
+def notification_to_dict(notif):
+    """Dashboard representation of a notifications row"""
+    return {
+        'id': notif['id'],
+        'title': notif['title'],
+        'message': notif['message'],
+        'type': notif['notification_type'],
+        'timestamp': notif['created_at'].isoformat() if notif['created_at'] else None,
+        'read': notif['read']
+    }
+
+def load_notifications(limit=10):
+    """Most recent notifications, newest first, in dashboard form"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute('''
+            SELECT id, title, message, notification_type, created_at, read
+            FROM notifications
+            ORDER BY created_at DESC
+            LIMIT %s
+        ''', (limit,))
+        return [notification_to_dict(notif) for notif in cur.fetchall()]
+    finally:
+        conn.close()
+
+def notifications_changed(event, data):
+    """A notification was added, read or cleared: invalidate the dashboard snapshot and push it to streams"""
+    dashboard_snapshot.notifications_changed()
+    broadcaster.publish(event, data)
+
+def publish_event_log(event_type, message, timestamp):
+    """Push a new event_log entry to dashboard streams"""
+    timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else str(timestamp)
+    broadcaster.publish('event-log', {'type': event_type, 'message': message, 'timestamp': timestamp_str})
+
+def publish_dashboard_state(*_):
+    """Push state / sensor-event deltas after a reading or control change.
+    Skipped while nobody is connected; clients get a fresh snapshot when they (re)connect."""
+    if not broadcaster.clients:
+        return
+    try:
+        broadcaster.publish('state', build_system_state(), only_if_changed=True)
+        broadcaster.publish('sensor-events', build_sensor_events(), only_if_changed=True)
+    except Exception as e:
+        log.warning("⚠️ Error publishing dashboard state: %s", e)
+
+latest_reading.subscribe(publish_dashboard_state)
+state_cache.subscribe(publish_dashboard_state)
+state_cache.subscribe(publish_dashboard_state, 'sensor_controls')
+
 def map_value(value, from_min, from_max, to_min, to_max):
     """Map a value from one range to another"""
     if from_max == from_min:
@@ -3011,17 +5930,39 @@ def map_value(value, from_min, from_max, to_min, to_max):
     return to_min + (value - from_min) * (to_max - to_min) / (from_max - from_min)
 
 if __name__ == '__main__':
-    # Initialize database
-    init_database()
+    # Initialize database (waits up to DB_POOL_TIMEOUT for PostgreSQL to come up)
+    try:
+        init_database()
+        db_pool.warmup()
+        latest_reading.load()
+        # Re-arm any buzzer/light deadlines that were pending when the server stopped
+        sync_control_timers(state_cache.get_system_control())
+        # Keep upcoming partitions created and enforce retention
+        if SENSOR_PARTITIONING in ('daily', 'weekly'):
+            run_partition_maintenance()
+        # Send e-mails still queued from a previous run
+        if EMAIL_ENABLED:
+            email_dispatcher.start()
+    except DatabaseUnavailableError as e:
+        log.error("❌ Database connection error: %s", e)
+        log_handler.shutdown()
+        sys.exit(1)
+    atexit.register(log_handler.shutdown)  # runs last: flushes what the other shutdown hooks log
+    atexit.register(trace_handler.shutdown)
+    atexit.register(db_pool.closeall)
+    atexit.register(timer_scheduler.shutdown)
+    atexit.register(email_dispatcher.shutdown)
+    atexit.register(sensor_event_writer.shutdown)
+    atexit.register(side_effect_queue.shutdown)  # runs first: drained jobs may still log events
     
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static', exist_ok=True)
     
-    print("🚀 Starting Smart Home Monitoring Server...")
-    print("📊 Dashboard will be available at: http://localhost:8888")
-    print("🔐 Default login: admin / admin123")
-    print("⚠️  Change default credentials in production!")
+    log.info("🚀 Starting Smart Home Monitoring Server...")
+    log.info("📊 Dashboard will be available at: http://localhost:8888")
+    log.info("🔐 Default login: admin / admin123")
+    log.warning("⚠️  Change default credentials in production!")
     
     app.run(host='0.0.0.0', port=8888, debug=False)
 
@@ -35,29 +35,129 @@ function formatTimestamp(timestamp) {
 
 // Global state
 let currentEventPage = 1;
+let currentEventQuery = '';  // cursor=... / before=... that produced the current page ('' = newest)
 let eventPagination = null;
+let eventStream = null;
+let pollTimers = [];
+let eventsReloadTimer = null;
+let lastSnapshotEtag = null;
 
 // Initialize dashboard
 document.addEventListener('DOMContentLoaded', function() {
-    updateDashboard();
-    updateSensorBoardStatus();
-    loadSensorEvents();
+    loadDashboardSnapshot();
     loadEvents();
-    loadNotifications();
     loadControlBoardUrl();
     
-    // Update every 2 seconds
-    setInterval(() => {
-        updateDashboard();
-        loadSensorEvents();
-        loadNotifications();
-    }, 2000);
+    // Push updates over Server-Sent Events; poll only when the stream is unavailable
+    if (window.EventSource) {
+        connectStream();
+    } else {
+        startPolling();
+    }
+});
+
+// Polling fallback
+function startPolling() {
+    if (pollTimers.length > 0) return;
+    loadDashboardSnapshot();
+    
+    // Update every 2 seconds (one request; unchanged snapshots are revalidated with a 304)
+    pollTimers.push(setInterval(() => {
+        loadDashboardSnapshot();
+    }, 2000));
     
     // Update events every 5 seconds
-    setInterval(() => {
+    pollTimers.push(setInterval(() => {
         loadEvents();
-    }, 5000);
-});
+    }, 5000));
+}
+
+function stopPolling() {
+    pollTimers.forEach(timer => clearInterval(timer));
+    pollTimers = [];
+}
+
+// Server-Sent Events stream (the browser reconnects and resumes from the last event id by itself)
+function connectStream() {
+    eventStream = new EventSource(`${API_BASE}/stream`);
+    
+    eventStream.onopen = () => {
+        stopPolling();
+    };
+    
+    eventStream.onerror = () => {
+        // Keep the dashboard fresh while the stream is down
+        startPolling();
+        if (eventStream.readyState === EventSource.CLOSED) {
+            // Not reconnecting by itself (e.g. logged out): retry later
+            setTimeout(connectStream, 10000);
+        }
+    };
+    
+    eventStream.addEventListener('snapshot', (e) => {
+        const data = JSON.parse(e.data);
+        renderSystemState(data.state);
+        renderSensorEvents({sensor_events: data.sensor_events});
+        if (data.resync) {
+            loadNotifications();
+            loadEvents();
+        }
+    });
+    
+    eventStream.addEventListener('state', (e) => {
+        renderSystemState(JSON.parse(e.data));
+    });
+    
+    eventStream.addEventListener('sensor-events', (e) => {
+        renderSensorEvents({sensor_events: JSON.parse(e.data)});
+    });
+    
+    eventStream.addEventListener('notification', () => {
+        loadNotifications();
+    });
+    
+    eventStream.addEventListener('notifications-changed', () => {
+        loadNotifications();
+    });
+    
+    eventStream.addEventListener('event-log', () => {
+        scheduleEventsReload();
+    });
+}
+
+// Reload the event log page at most once per second while events are streaming in
+function scheduleEventsReload() {
+    if (eventsReloadTimer) return;
+    eventsReloadTimer = setTimeout(() => {
+        eventsReloadTimer = null;
+        loadEvents();
+    }, 1000);
+}
+
+// Load state, sensor events, notifications and board info in one request
+async function loadDashboardSnapshot() {
+    try {
+        const response = await fetch(`${API_BASE}/dashboard/snapshot`, {cache: 'no-cache'});
+        if (!response.ok) {
+            if (response.status === 401) {
+                window.location.href = '/login';
+                return;
+            }
+            throw new Error('Failed to fetch dashboard snapshot');
+        }
+        const etag = response.headers.get('ETag');
+        if (etag && etag === lastSnapshotEtag) return;  // Nothing changed
+        const data = await response.json();
+        lastSnapshotEtag = etag;
+        
+        renderSystemState(data.state);
+        renderSensorEvents({sensor_events: data.sensor_events});
+        renderNotifications({notifications: data.notifications});
+        renderSensorBoardStatus(data.sensor_board);
+    } catch (err) {
+        console.error('Error loading dashboard snapshot:', err);
+    }
+}
 
 // Update Dashboard
 async function updateDashboard() {
@@ -71,7 +171,14 @@ async function updateDashboard() {
             throw new Error('Failed to fetch system state');
         }
         const data = await response.json();
-        
+        renderSystemState(data);
+    } catch (err) {
+        console.error('Error updating dashboard:', err);
+    }
+}
+
+function renderSystemState(data) {
+    try {
         // Update sensor values
         document.getElementById('temperature').textContent = data.sensors.temperature.toFixed(1) + '°C';
         document.getElementById('humidity').textContent = data.sensors.humidity.toFixed(1) + '%';
@@ -152,7 +259,14 @@ async function updateSensorBoardStatus() {
         const response = await fetch(`${API_BASE}/sensor-board/info`);
         if (!response.ok) return;
         const data = await response.json();
-        
+        renderSensorBoardStatus(data);
+    } catch (err) {
+        console.error('Error updating sensor board status:', err);
+    }
+}
+
+function renderSensorBoardStatus(data) {
+    try {
         document.getElementById('monitoring-status').textContent = 'Monitoring: ' + (data.monitoring ? 'Active' : 'Stopped');
         document.getElementById('monitoring-btn').textContent = data.monitoring ? 'Stop' : 'Start';
         document.getElementById('monitoring-btn').className = 'btn-control ' + (data.monitoring ? 'active' : '');
@@ -167,14 +281,20 @@ async function updateSensorBoardStatus() {
     }
 }
 
-// Load Events with Pagination
-async function loadEvents(page = currentEventPage) {
+// Load Events with (cursor-based) Pagination
+async function loadEvents(query = currentEventQuery, page = currentEventPage) {
     try {
-        const response = await fetch(`${API_BASE}/events?page=${page}&per_page=10`);
+        const response = await fetch(`${API_BASE}/events?per_page=10${query ? '&' + query : ''}`);
         if (!response.ok) return;
         const data = await response.json();
         
         eventPagination = data.pagination;
+        // Paging back past the newest events lands on the first page
+        if (!eventPagination.has_prev) {
+            query = '';
+            page = 1;
+        }
+        currentEventQuery = query;
         currentEventPage = page;
         
         let eventList = document.getElementById('event-list');
@@ -207,7 +327,7 @@ async function loadEvents(page = currentEventPage) {
         });
         
         // Update pagination controls
-        document.getElementById('page-info').textContent = `Page ${eventPagination.page} of ${eventPagination.total_pages}`;
+        document.getElementById('page-info').textContent = `Page ${currentEventPage} of ${Math.max(eventPagination.total_pages, currentEventPage)}`;
         document.getElementById('prev-btn').disabled = !eventPagination.has_prev;
         document.getElementById('next-btn').disabled = !eventPagination.has_next;
     } catch (err) {
@@ -217,13 +337,13 @@ async function loadEvents(page = currentEventPage) {
 
 function loadPreviousEvents() {
     if (eventPagination && eventPagination.has_prev) {
-        loadEvents(currentEventPage - 1);
+        loadEvents(`before=${encodeURIComponent(eventPagination.prev_cursor)}`, currentEventPage - 1);
     }
 }
 
 function loadNextEvents() {
     if (eventPagination && eventPagination.has_next) {
-        loadEvents(currentEventPage + 1);
+        loadEvents(`cursor=${encodeURIComponent(eventPagination.next_cursor)}`, currentEventPage + 1);
     }
 }
 
@@ -255,7 +375,19 @@ async function loadSensorEvents() {
         }
         
         const data = await response.json();
-        
+        renderSensorEvents(data);
+    } catch (err) {
+        console.error('❌ Error loading sensor events:', err);
+        // Show error in table if element exists
+        let tbody = document.getElementById('sensor-events-body');
+        if (tbody) {
+            tbody.innerHTML = '<tr><td colspan="4" class="loading" style="color: red;">Error loading sensor events. Check console.</td></tr>';
+        }
+    }
+}
+
+function renderSensorEvents(data) {
+    try {
         let tbody = document.getElementById('sensor-events-body');
         if (!tbody) {
             console.error('sensor-events-body element not found');
@@ -340,12 +472,7 @@ async function loadSensorEvents() {
             window.lastSensorEventLog = now;
         }
     } catch (err) {
-        console.error('❌ Error loading sensor events:', err);
-        // Show error in table if element exists
-        let tbody = document.getElementById('sensor-events-body');
-        if (tbody) {
-            tbody.innerHTML = '<tr><td colspan="4" class="loading" style="color: red;">Error loading sensor events. Check console.</td></tr>';
-        }
+        console.error('❌ Error rendering sensor events:', err);
     }
 }
 
@@ -362,7 +489,14 @@ async function loadNotifications() {
         const response = await fetch(`${API_BASE}/notifications?limit=10`);
         if (!response.ok) return;
         const data = await response.json();
-        
+        renderNotifications(data);
+    } catch (err) {
+        console.error('Error loading notifications:', err);
+    }
+}
+
+function renderNotifications(data) {
+    try {
         let notificationList = document.getElementById('notification-list');
         let badge = document.getElementById('notification-badge');
         
@@ -442,7 +576,7 @@ async function clearEvents() {
         });
         
         if (response.ok) {
-            loadEvents(1); // Reload first page
+            loadEvents('', 1); // Reload first page
             alert('All events cleared');
         } else {
             const error = await response.json();